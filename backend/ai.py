@@ -1,33 +1,207 @@
 import os
-import base64
 import json
+import re
 import asyncio
-from volcenginesdkarkruntime import Ark
-from volcengine.visual.VisualService import VisualService
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
+from ocr_cache import OCRCache
+from llm_cache import LLMCache, create_llm_cache
+from storage import atomic_write_json, atomic_write_text, file_sha256, file_base64
+from text_index import TextBlockIndex
+from value_matcher import ValueMatcher
+from resilience import RetryableError, get_guard
+from clients import get_ark_client, get_visual_service
+from result_cache import result_cache
+from image_prep import image_preprocessor
+from logger import get_logger
+from metrics import span, timed, record_token_usage
+from json_stream import JsonStreamParser
+import events
+from prompt_builder import build_chunks, compact_document, content_budget, merge_results, conflicting_fields
 import glob
-from dotenv import load_dotenv
 
 
-# 如果关键环境变量不存在，则加载.env文件
-if not os.environ.get("ARK_API_KEY") or not os.environ.get("VOLC_ACCESSKEY"):
-    load_dotenv()
+# 外部接口客户端在第一次调用时由clients模块创建（连接池所有线程共享），导入ai时不加载SDK；
+# 测试和基准测试可以直接给ai.client、ai.visual_service赋值替换
+client = None
+visual_service = None
 
-# 初始化客户端
-client = Ark(
-    api_key=os.environ.get("ARK_API_KEY")
-)
+log = get_logger('ai')
+
+# OCR接口中表示限流和服务端错误的返回码，可以重试
+OCR_RETRYABLE_CODES = {50429, 50430, 50500, 50501}
+# 网关返回的限流和服务端错误：没有顶层的code，错误在ResponseMetadata.Error.Code中
+# （SDK把非200响应的JSON正文原样返回，HTTP状态码已经丢失）
+OCR_RETRYABLE_GATEWAY_ERRORS = {
+    'FlowLimitExceeded', 'AccountFlowLimitExceeded', 'RequestLimitExceeded', 'Throttling', 'TooManyRequests',
+    'InternalError', 'InternalServiceError', 'ServiceUnavailable', 'ServiceUnavailableTemp', 'ServerBusy',
+    'ServiceTimeout',
+}
+
+# OCR结果缓存，按文件内容和OCR参数寻址
+ocr_cache = OCRCache()
+
+# OCR请求线程池，限制同时进行的页码范围识别数量
+ocr_executor = ThreadPoolExecutor(max_workers=Config.OCR_MAX_CONCURRENCY)
+
+# 超长文档分块抽取的线程池
+prompt_executor = ThreadPoolExecutor(max_workers=Config.PROMPT_CHUNK_WORKERS)
+
+# 多文件map-reduce抽取的线程池，和分块抽取分开，避免嵌套提交时互相等待
+map_executor = ThreadPoolExecutor(max_workers=Config.MAP_REDUCE_WORKERS)
+
+# 大模型响应缓存，后端由 Config.LLM_CACHE_BACKEND 决定
+llm_cache = create_llm_cache()
+
+
+def save_extract_result(path, data, indent=2):
+    """
+    保存抽取结果并清除该任务的结果缓存
+
+    原子替换写入，读取方不会看到写了一半的文件，结果目录的修改时间也会随之改变，
+    其他进程中的结果缓存据此判断过期
+    """
+    atomic_write_json(path, data, indent=indent)
+    result_cache.invalidate_path(path)
+
+
+def _ark_client():
+    return client if client is not None else get_ark_client()
+
+
+def _visual_service():
+    return visual_service if visual_service is not None else get_visual_service()
+
+
+def _is_retryable_ark_error(error):
+    """限流(429)、服务端错误(5xx)、连接错误和超时可以重试"""
+    # 出错时SDK已经加载，这里导入没有额外开销
+    from volcenginesdkarkruntime._exceptions import ArkAPIConnectionError, ArkAPIStatusError
+    if isinstance(error, ArkAPIConnectionError):
+        return True
+    if isinstance(error, ArkAPIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _stream_text(stream, on_text):
+    """读取流式响应，每收到一段文本调用on_text，返回(完整文本, token用量)"""
+    parts = []
+    usage = None
+    for chunk in stream:
+        # 开启include_usage时最后一个chunk只有用量，没有choices
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            on_text(delta)
+    return "".join(parts), usage
+
+
+def _create_completion(model, messages, use_cache=True, on_text=None, **params):
+    """
+    调用大模型并使用响应缓存
+
+    参数:
+        on_text: 提供时使用流式响应，每收到一段文本调用on_text(文本)；命中缓存时以完整文本调用一次
+
+    返回:
+        (响应文本, 缓存键)
+    """
+    cache_key = LLMCache.make_key(model, messages, params.get("temperature"), params.get("max_tokens"))
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            log.info("使用模型响应缓存", extra={"model": model})
+            if on_text:
+                on_text(cached)
+            return cached, cache_key
+
+    # 未指定的参数不传给接口，保持接口默认值
+    params = {k: v for k, v in params.items() if v is not None}
+    if on_text:
+        params.update(stream=True, stream_options={"include_usage": True})
+    with span("llm", model=model):
+        completion = get_guard(f"ark:{model}").call(
+            _ark_client().chat.completions.create, model=model, messages=messages,
+            is_retryable=_is_retryable_ark_error, **params)
+        # 重试只覆盖建立请求，流式读取过程中的错误直接抛出
+        if on_text:
+            response_text, usage = _stream_text(completion, on_text)
+        else:
+            response_text, usage = completion.choices[0].message.content, getattr(completion, "usage", None)
+    record_token_usage(model, usage)
+    if usage is not None:
+        log.info("大模型调用完成", extra={"model": model, "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                                        "completion_tokens": getattr(usage, "completion_tokens", None)})
+    llm_cache.set(cache_key, response_text)
+    return response_text, cache_key
+
+
+def _json_receiver(schema, on_field):
+    """
+    流式抽取时的JSON解析器和文本回调：每收到一段文本就增量解析，解析出的顶层字段交给on_field
+
+    返回:
+        (解析器, on_text回调)；不需要流式输出时为 (None, None)
+    """
+    if on_field is None:
+        return None, None
+    parser = JsonStreamParser(schema)
+
+    def on_text(text):
+        for key, value in parser.feed(text):
+            on_field(key, value)
+    return parser, on_text
+
+
+def _parse_json_output(response_text, cache_key, model, json_save_path, schema=None, parser=None):
+    """
+    从模型输出中提取JSON并保存，流式调用时直接使用已增量解析的结果，不再重新解析
+
+    返回:
+        JSON对象，无法解析时返回带raw_text的错误字典；无法解析或输出不完整时删除缓存的响应
+    """
+    try:
+        with span("json_extract"):
+            if parser is None:
+                parser = JsonStreamParser(schema)
+                parser.feed(response_text)
+            json_content = parser.result()
+    except ValueError as e:
+        log.warning("JSON解析错误", extra={"model": model, "error": str(e), "raw_text": response_text})
+        # 无法解析的响应不保留在缓存中，下次重新请求
+        llm_cache.delete(cache_key)
+        return {"error": "无法解析为JSON", "raw_text": response_text}
+
+    if parser.truncated:
+        log.warning("模型输出不完整，已补齐并丢弃最后一个不完整的字段",
+                    extra={"model": model, "fields": len(json_content)})
+        # 补齐后的结果照常保存，但截断的响应不保留在缓存中，重新抽取时才能拿回丢弃的字段
+        llm_cache.delete(cache_key)
+    if parser.errors:
+        log.warning("抽取结果与schema不符", extra={"model": model, "errors": parser.errors[:20]})
+    if json_save_path:
+        save_extract_result(json_save_path, json_content)
+    return json_content
 
 # 1. 封装的Chat请求函数
 
 
+@timed("chat_completion")
 def chat_completion(model="deepseek-r1-250120",
                     system_prompt="你是一个专业助手",
                     user_prompt="请50个字介绍一下自己",
                     temperature=0.7,
                     max_tokens=200,
                     output_json=False,
-                    json_save_path=Config.EXTRACT_RESULTS_FOLDER):
+                    json_save_path=Config.EXTRACT_RESULTS_FOLDER,
+                    use_cache=True,
+                    schema=None,
+                    on_field=None):
     """
     封装的聊天完成函数
     doubao-1-5-pro-32k-250115
@@ -40,51 +214,46 @@ def chat_completion(model="deepseek-r1-250120",
         max_tokens: 最大生成token数
         output_json: 是否尝试解析输出为JSON
         json_save_path: JSON保存路径
+        use_cache: 是否使用响应缓存，False时强制重新请求模型
+        schema: 任务的JSON Schema，提供时按schema检查抽取出的字段
+        on_field: 提供且output_json为True时使用流式响应，每解析出一个顶层字段调用on_field(字段名, 取值)
 
     返回:
         如果output_json为True，尝试返回解析后的JSON对象，否则返回原始文本
     """
-    completion = client.chat.completions.create(
+    parser, on_text = _json_receiver(schema, on_field if output_json else None)
+    response_text, cache_key = _create_completion(
         model=model,
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
+        use_cache=use_cache,
+        on_text=on_text,
         temperature=temperature,
         max_tokens=max_tokens
     )
 
-    response_text = completion.choices[0].message.content
-
     # 如果需要JSON输出
     if output_json:
-        try:
-            # 尝试解析JSON内容
-            json_content = extract_json_from_text(response_text)
-            # 调用文档检索函数
-
-            # 如果提供了保存路径，保存JSON
-            if json_save_path:
-                os.makedirs(os.path.dirname(json_save_path), exist_ok=True)
-                with open(json_save_path, 'w', encoding='utf-8') as f:
-                    json.dump(json_content, f, ensure_ascii=False, indent=2)
-
-            return json_content
-        except Exception as e:
-            print(f"JSON解析错误: {e}")
-            return {"error": "无法解析为JSON", "raw_text": response_text}
+        return _parse_json_output(response_text, cache_key, model, json_save_path, schema=schema, parser=parser)
 
     return response_text
 
 # 2. 封装的多模态请求函数
 
 
+@timed("multimodal_completion")
 def multimodal_completion(file_ids: list,
                           model="doubao-1.5-vision-pro-32k-250115",
                           prompt="描述这些图片的内容",
                           max_tokens=300,
                           output_json=False,
-                          json_save_path=None):
+                          json_save_path=None,
+                          use_cache=True,
+                          map_reduce=None,
+                          schema=None,
+                          on_field=None):
     """
     封装的多模态完成函数
 
@@ -95,20 +264,25 @@ def multimodal_completion(file_ids: list,
         max_tokens: 最大生成token数
         output_json: 是否尝试解析输出为JSON
         json_save_path: JSON保存路径
+        use_cache: 是否使用响应缓存，False时强制重新请求模型
+        map_reduce: 多张图片时是否逐张抽取再合并，None时使用Config.EXTRACT_MAP_REDUCE
+        schema: 任务的JSON Schema，提供时按schema检查抽取出的字段
+        on_field: 提供且output_json为True时使用流式响应，每解析出一个顶层字段调用on_field(字段名, 取值)；
+            逐张抽取时每张图片的字段分别回调
 
     返回:
         如果output_json为True，尝试返回解析后的JSON对象，否则返回原始文本
     """
-    # 如果提供了保存路径且文件已存在，直接返回文件内容
-    if json_save_path and os.path.exists(json_save_path):
-        print(f"使用已有结果: {json_save_path}")
-        try:
-            with open(json_save_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"读取已有结果失败: {e}")
-            # 如果读取失败，继续执行后续代码重新生成结果
-    
+    if map_reduce is None:
+        map_reduce = Config.EXTRACT_MAP_REDUCE
+    if map_reduce and output_json and len(file_ids) > 1:
+        return _map_reduce(
+            file_ids,
+            lambda file_id: multimodal_completion(
+                [file_id], model=model, prompt=prompt, max_tokens=max_tokens, output_json=True,
+                use_cache=use_cache, map_reduce=False, schema=schema, on_field=on_field),
+            prompt, json_save_path, use_cache)
+
     # 存储所有图片的base64数据
     image_contents = []
 
@@ -116,35 +290,28 @@ def multimodal_completion(file_ids: list,
     for file_id in file_ids:
         image_path = os.path.join(Config.UPLOAD_FOLDER, file_id)
         if not os.path.exists(image_path):
-            print(f"图片路径不存在: {image_path}")
+            log.warning("图片路径不存在", extra={"path": image_path})
             return None
 
-        # 获取文件扩展名并确定MIME类型
-        file_extension = os.path.splitext(file_id)[1].lower()
-        mime_type = "image/png"  # 默认MIME类型
-        
-        # 根据扩展名设置正确的MIME类型
-        if file_extension in ['.jpg', '.jpeg']:
-            mime_type = "image/jpeg"
-        elif file_extension in ['.png', '.apng']:
-            mime_type = "image/png"
-        elif file_extension == '.gif':
-            mime_type = "image/gif"
-
-        # 读取图片并转换为Base64
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
-            image_contents.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:{mime_type};base64,{image_data}"
-                }
-            })
+        # 转正、纠偏、缩小并重新压缩，得到实际发送的图片及其MIME类型
+        with span("image_prep", file_id=file_id):
+            image_path, mime_type = image_preprocessor.prepare(image_path)
+
+        # 分块读取图片并转换为Base64 data URL
+        with span("base64_encode", file_id=file_id):
+            image_url = file_base64(image_path, prefix=f"data:{mime_type};base64,")
+        image_contents.append({
+            "type": "image_url",
+            "image_url": {
+                "url": image_url
+            }
+        })
 
     # 构建请求内容
     content =image_contents+[{"type": "text", "text": prompt}]
 
-    completion = client.chat.completions.create(
+    parser, on_text = _json_receiver(schema, on_field if output_json else None)
+    response_text, cache_key = _create_completion(
         model=model,
         messages=[
             {
@@ -152,81 +319,143 @@ def multimodal_completion(file_ids: list,
                 "content": content
             }
         ],
+        use_cache=use_cache,
+        on_text=on_text,
         max_tokens=max_tokens
     )
-    # print(completion)
-    response_text = completion.choices[0].message.content
 
     # 如果需要JSON输出
     if output_json:
-        try:
-            # 尝试解析JSON内容
-            json_content = extract_json_from_text(response_text)
-            
-
-            # 如果提供了保存路径，保存JSON
-            if json_save_path:
-                os.makedirs(os.path.dirname(json_save_path), exist_ok=True)
-                with open(json_save_path, 'w', encoding='utf-8') as f:
-                    json.dump(json_content, f, ensure_ascii=False, indent=2)
-                    # 调用文档检索函数  
-                extract_text_locations(task_id)
-
-            return json_content
-        except Exception as e:
-            print(f"JSON解析错误: {e}, 原始文本: {response_text}")
-            return {"error": "无法解析为JSON", "raw_text": response_text}
+        return _parse_json_output(response_text, cache_key, model, json_save_path, schema=schema, parser=parser)
 
     return response_text
 
 # 辅助函数：从文本中提取JSON
 
 
-def extract_json_from_text(text):
+def extract_json_from_text(text, schema=None):
     """
     从文本中提取JSON内容
+
+    单遍扫描，跳过JSON前后的说明文字和```json标记；输出被截断时补齐括号并丢弃最后一个不完整的字段，
+    见json_stream.JsonStreamParser。找不到JSON时抛出ValueError
     """
-    # 尝试直接解析整个文本
-    try:
-        return json.loads(text)
-    except:
-        pass
+    parser = JsonStreamParser(schema)
+    parser.feed(text)
+    return parser.result()
+
+# 3. 文档解析示例 (保持原样)
+
+
+def _parse_result_base_name(file_path, filename):
+    """
+    解析结果文件名（不含扩展名）
 
-    # 尝试查找JSON块
+    同一任务下有多个同名不同扩展名的文件时（如 a.pdf 和 a.png），
+    保留扩展名以避免解析结果互相覆盖
+    """
+    base_name, extension = os.path.splitext(filename)
+    task_folder = os.path.dirname(file_path)
+    siblings = [name for name in os.listdir(task_folder)
+                if name != filename and os.path.splitext(name)[0] == base_name]
+    if siblings:
+        return f"{base_name}_{extension.lstrip('.').lower()}"
+    return base_name
+
+
+def _load_legacy_parse_result(json_path):
+    """读取缓存上线前按文件名保存的解析结果（重新上传同名文件时upload_file会清理它）"""
+    if not os.path.exists(json_path):
+        return None
     try:
-        # 查找可能的JSON块（在```json 和 ``` 之间）
-        import re
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', text)
-        if json_match:
-            return json.loads(json_match.group(1))
-    except:
-        pass
+        with open(json_path, 'r', encoding='utf-8') as f:
+            detail = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return None
+    markdown_path = os.path.splitext(json_path)[0] + ".md"
+    markdown = ""
+    if os.path.exists(markdown_path):
+        with open(markdown_path, 'r', encoding='utf-8') as f:
+            markdown = f.read()
+    return {"detail": detail, "markdown": markdown}
+
+
+def clear_parse_result(file_id: str):
+    """删除任务目录下某个文件的解析结果（文件被重新上传时调用）"""
+    task_id = file_id.split('/')[0] if '/' in file_id else ''
+    filename = file_id.split('/', 1)[1] if '/' in file_id else file_id
+    result_dir = os.path.join(Config.PARSE_RESULTS_FOLDER, task_id) if task_id else Config.PARSE_RESULTS_FOLDER
+    base_name, extension = os.path.splitext(filename)
+    for name in (base_name, f"{base_name}_{extension.lstrip('.').lower()}"):
+        for suffix in ('.json', '.md', '.index'):
+            path = os.path.join(result_dir, name + suffix)
+            if os.path.exists(path):
+                os.remove(path)
 
-    # 尝试查找 { 和 } 之间的内容
+
+def _pdf_page_count(file_path):
+    """获取PDF页数，优先使用pypdf，未安装时按页对象数量估算"""
     try:
-        start = text.find('{')
-        end = text.rfind('}')
-        if start != -1 and end != -1:
-            return json.loads(text[start:end+1])
-    except:
+        from pypdf import PdfReader
+        return max(1, len(PdfReader(file_path).pages))
+    except ImportError:
         pass
+    except Exception as e:
+        log.warning("读取PDF页数失败，按页对象估算", extra={"path": file_path, "error": str(e)})
+    with open(file_path, 'rb') as f:
+        return max(1, len(re.findall(rb'/Type\s*/Page(?![a-zA-Z])', f.read())))
 
-    # 如果都失败了，抛出异常
-    raise ValueError("无法从文本中提取有效的JSON")
 
-# 3. 文档解析示例 (保持原样)
+def _ocr_response_error(resp):
+    """
+    取出OCR响应中的错误码和错误信息
+
+    返回:
+        (错误码, 错误信息)：网关错误是ResponseMetadata.Error中的字符串错误码，否则是顶层的code和message
+    """
+    error = (resp.get("ResponseMetadata") or {}).get("Error")
+    if isinstance(error, dict) and error.get("Code"):
+        return error["Code"], error.get("Message")
+    return resp.get("code"), resp.get("message")
+
+
+def _ocr_page_range(image_base64, params):
+    """
+    对文件的一个页码范围发起OCR请求
+
+    返回:
+        {"detail": 各页解析结果, "markdown": markdown文本}，失败返回None；
+        限流和服务端错误重试耗尽后抛出异常
+    """
+    def request():
+        try:
+            resp = _visual_service().ocr_pdf(dict(params, image_base64=image_base64, image_url=""))
+        except Exception as e:
+            # 接口错误会以JSON返回，这里的异常都是网络层面的错误
+            raise RetryableError(f"OCR请求异常: {e}") from e
+        code, message = _ocr_response_error(resp)
+        if code in OCR_RETRYABLE_CODES or code in OCR_RETRYABLE_GATEWAY_ERRORS:
+            raise RetryableError(f"OCR请求被限流或服务端出错: {code} {message}")
+        return resp
+
+    with span("ocr", page_start=params.get("page_start"), page_num=params.get("page_num")):
+        resp = get_guard("visual:ocr_pdf").call(request)
+    if not resp.get("data"):
+        code, message = _ocr_response_error(resp)
+        log.error("解析请求失败", extra={"code": code, "ocr_message": message})
+        return None
+    return {
+        "detail": json.loads(resp["data"]["detail"]),
+        "markdown": resp["data"]["markdown"]
+    }
 
 
+@timed("document_parse")
 def document_parse(file_id: str):
-    # 初始化服务
-    visual_service = VisualService()
-    visual_service.set_ak(os.environ.get("VOLC_ACCESSKEY"))
-    visual_service.set_sk(os.environ.get("VOLC_SECRETKEY"))
-    
     # 构建文件路径
     file_path = os.path.join(Config.UPLOAD_FOLDER, file_id)
     if not os.path.exists(file_path):
-        print(f"文件不存在: {file_path}")
+        log.warning("文件不存在", extra={"path": file_path})
         return None
         
     # 检查是否已有解析结果
@@ -235,70 +464,117 @@ def document_parse(file_id: str):
     # 处理文件路径，如果没有任务ID则使用根目录
     task_id = file_id.split('/')[0] if '/' in file_id else ''
     filename = file_id.split('/', 1)[1] if '/' in file_id else file_id
-    base_name = os.path.splitext(filename)[0]
+    base_name = _parse_result_base_name(file_path, filename)
     # 构建结果目录路径
     result_dir = os.path.join(Config.PARSE_RESULTS_FOLDER, task_id) if task_id else Config.PARSE_RESULTS_FOLDER
     
     # 确保结果目录存在
     os.makedirs(result_dir, exist_ok=True)
     json_path = os.path.join(result_dir, f"{base_name}.json")
-    
-    # 如果已有解析结果，直接返回
-    if os.path.exists(json_path):
-        print(f"使用已有解析结果: {json_path}")
-        with open(json_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    
-    # 构建请求参数
-    form = {
-        "image_base64": base64.b64encode(open(file_path, 'rb').read()).decode(),
-        "image_url": "",
+    markdown_path = os.path.join(result_dir, f"{base_name}.md")
+
+    # OCR参数，和文件内容、页码范围一起决定缓存键
+    ocr_params = {
         "version": "v3",
         "file_type": "pdf" if file_extension == ".pdf" else "image",  
-        "page_start": 0,
-        "page_num": 1,
         "parse_mode": "auto",
         "table_mode": "markdown",
         "filter_header": "true"
     }
-
-    # 发送请求
-    resp = visual_service.ocr_pdf(form)
-
-    if resp.get("data"):
-
-        # 保存 markdown
-        markdown_path = os.path.join(result_dir, f"{base_name}.md")
-        with open(markdown_path, "w") as f:
-            f.write(resp["data"]["markdown"])
-
-        # 保存 JSON
-        json_data = json.loads(resp["data"]["detail"])
-        json_path = os.path.join(result_dir, f"{base_name}.json")
-        with open(json_path, "w", encoding='utf-8') as f:
-            json.dump(json_data, f, indent=4, ensure_ascii=False)
-
-        print(f"解析结果已保存到: {result_dir}")
-        return json_data
-    else:
-        print("解析请求失败:", resp)
-        return None
+    page_count = _pdf_page_count(file_path) if file_extension == ".pdf" else 1
+    chunk_size = max(1, Config.OCR_PAGE_CHUNK_SIZE)
+    page_ranges = [(start, min(chunk_size, page_count - start)) for start in range(0, page_count, chunk_size)]
+    # 图片可以先缩小再识别，缓存键按实际发送的内容计算
+    source_path = file_path
+    if Config.OCR_PREPROCESS and file_extension != ".pdf":
+        with span("image_prep", file_id=file_id):
+            source_path, _ = image_preprocessor.prepare(file_path, max_side=Config.OCR_IMAGE_MAX_SIDE, deskew=False)
+    with span("file_hash", file_id=file_id):
+        content_hash = file_sha256(source_path)
+
+    # 先查缓存，只对未命中的页码范围发起OCR请求
+    chunks = {}
+    for page_start, page_num in page_ranges:
+        params = dict(ocr_params, page_start=page_start, page_num=page_num)
+        cache_key = OCRCache.make_key(file_path, params, content_hash=content_hash)
+        entry = ocr_cache.get(cache_key)
+        if entry is None and len(page_ranges) == 1:
+            # 兼容缓存上线前已保存的单页解析结果
+            entry = _load_legacy_parse_result(json_path)
+            if entry is not None:
+                log.info("使用已有解析结果", extra={"path": json_path})
+                ocr_cache.put(cache_key, entry["detail"], entry["markdown"])
+        if entry is not None:
+            chunks[page_start] = entry
+    missing = [(page_start, page_num) for page_start, page_num in page_ranges if page_start not in chunks]
+    if chunks:
+        log.info("使用OCR缓存", extra={"file_id": file_id, "cached_ranges": len(chunks), "ranges": len(page_ranges)})
+
+    if missing:
+        # 文件只分块编码一次，各页码范围共享同一份请求内容
+        with span("base64_encode", file_id=file_id):
+            image_base64 = file_base64(source_path)
+
+        def parse_range(page_range):
+            page_start, page_num = page_range
+            params = dict(ocr_params, page_start=page_start, page_num=page_num)
+            entry = _ocr_page_range(image_base64, params)
+            if entry is not None:
+                ocr_cache.put(OCRCache.make_key(file_path, params, content_hash=content_hash),
+                              entry["detail"], entry["markdown"])
+            return page_start, entry
+
+        # 各页码范围在有界线程池中并行识别
+        for page_start, entry in ocr_executor.map(parse_range, missing):
+            if entry is None:
+                log.error("解析请求失败", extra={"file_id": file_id, "page_start": page_start})
+                return None
+            chunks[page_start] = entry
+
+    # 按页码顺序合并各范围的结果，page_id统一为整个文档中的页码
+    detail = []
+    markdown_parts = []
+    for page_start, _ in page_ranges:
+        entry = chunks[page_start]
+        for offset, page in enumerate(entry["detail"]):
+            detail.append(dict(page, page_id=page_start + offset))
+        markdown_parts.append(entry["markdown"])
+    entry = {"detail": detail, "markdown": "\n\n".join(markdown_parts)}
+
+    # 在任务目录下保存 markdown 和 JSON，供位置检索和页面展示使用
+    with span("parse_save", file_id=file_id):
+        atomic_write_text(markdown_path, entry["markdown"])
+        atomic_write_json(json_path, entry["detail"], indent=4)
+        # 同时构建文本块索引，供extract_text_locations使用
+        TextBlockIndex.load(json_path, entry["detail"])
+
+    log.info("解析结果已保存", extra={"file_id": file_id, "path": result_dir, "pages": len(detail)})
+    if task_id:
+        events.publish(task_id, events.EVENT_OCR, {"file_id": file_id, "pages": len(detail)})
+    return entry["detail"]
 
 # 处理多个文件并生成提示词的函数
 # 处理多个文件并生成提示词的函数
 
 
+@timed("markdown_channel")
 def process_multiple_files(file_ids: list,
                            model="doubao-1-5-pro-32k-250115",
                            system_prompt="你是一个专业的文档分析助手，擅长从多个文档中提取和整合信息",
                            question="请分析这些文档并提取关键信息",
                            temperature=0.6,
-                           max_tokens=500,
+                           max_tokens=Config.EXTRACT_MAX_TOKENS,
                            output_json=False,
-                           json_save_path=None):
+                           json_save_path=None,
+                           use_cache=True,
+                           map_reduce=None,
+                           schema=None,
+                           on_field=None):
     """
     处理多个文件并生成提示词，然后调用AI能力
 
+    文件内容超出模型上下文时按页分块并发抽取，再按文档顺序合并各块的字段
+
     参数:
         file_ids: 文件ID列表
         model: 使用的模型名称
@@ -308,12 +584,28 @@ def process_multiple_files(file_ids: list,
         max_tokens: 最大生成token数
         output_json: 是否尝试解析输出为JSON
         json_save_path: JSON保存路径
+        use_cache: 是否使用响应缓存，False时强制重新请求模型
+        map_reduce: 多个文件时是否逐个文件抽取再合并，None时使用Config.EXTRACT_MAP_REDUCE
+        schema: 任务的JSON Schema，提供时按schema检查抽取出的字段
+        on_field: 提供且output_json为True时使用流式响应，每解析出一个顶层字段调用on_field(字段名, 取值)；
+            分块或逐个文件抽取时各次调用的字段分别回调，最终结果以合并后的为准
 
     返回:
         如果output_json为True，尝试返回解析后的JSON对象，否则返回原始文本
     """
-    # 存储所有文件内容
-    file_contents = []
+    if map_reduce is None:
+        map_reduce = Config.EXTRACT_MAP_REDUCE
+    if map_reduce and output_json and len(file_ids) > 1:
+        return _map_reduce(
+            file_ids,
+            lambda file_id: process_multiple_files(
+                [file_id], model=model, system_prompt=system_prompt, question=question,
+                temperature=temperature, max_tokens=max_tokens, output_json=True,
+                use_cache=use_cache, map_reduce=False, schema=schema, on_field=on_field),
+            question, json_save_path, use_cache)
+
+    # 每个文件压缩为按页的纯文本：OCR结果只保留页面markdown，不带坐标和文本块明细
+    files = []
 
     # 处理每个文件
     for file_id in file_ids:
@@ -321,55 +613,148 @@ def process_multiple_files(file_ids: list,
         if file_id.lower().endswith(('.pdf', '.jpg', '.jpeg', '.png', '.bmp')):
             parsed_data = document_parse(file_id)
             if parsed_data:
-                # 将解析结果转为字符串
-                file_content = json.dumps(
-                    parsed_data, ensure_ascii=False, indent=2)
+                pages = compact_document(parsed_data)
             else:
-                print(f"文件解析失败: {file_id}")
+                log.warning("文件解析失败", extra={"file_id": file_id})
                 continue
         else:
             # 对其他文件直接读取内容
             file_path = os.path.join(Config.UPLOAD_FOLDER, file_id)
             if not os.path.exists(file_path):
-                print(f"文件不存在: {file_path}")
+                log.warning("文件不存在", extra={"path": file_path})
                 continue
 
             try:
                 with open(file_path, 'r', encoding='utf-8') as f:
-                    file_content = f.read()
+                    pages = [f.read()]
             except UnicodeDecodeError:
                 # 如果不是文本文件，跳过
-                print(f"无法读取文件内容(非文本文件): {file_id}")
+                log.warning("无法读取文件内容(非文本文件)", extra={"file_id": file_id})
                 continue
 
-        # 按照模板格式添加文件内容
-        file_template = """[file name]: {file_name}
-[file content begin]
-{file_content}
-[file content end]"""
-
-        formatted_content = file_template.format(
-            file_name=os.path.basename(file_id),
-            file_content=file_content
+        files.append((os.path.basename(file_id), pages))
+
+    # 按模型上下文切分文件内容，未超出预算时只有一个分块
+    with span("prompt_build"):
+        chunks = build_chunks(files, content_budget(system_prompt, question, max_tokens)) or ['']
+
+    def complete(content, save_path):
+        return chat_completion(
+            model=model,
+            system_prompt=system_prompt,
+            user_prompt=f"{content}\n{question}",
+            temperature=temperature,
+            max_tokens=max_tokens,
+            output_json=output_json,
+            json_save_path=save_path,
+            use_cache=use_cache,
+            schema=schema,
+            on_field=on_field
         )
 
-        file_contents.append(formatted_content)
+    if len(chunks) == 1:
+        return complete(chunks[0], json_save_path)
+
+    # 超长文档：各分块并发抽取，再按文档顺序合并字段
+    log.info("文档内容超出模型上下文，分块抽取", extra={"chunks": len(chunks), "file_ids": file_ids})
+    results = list(prompt_executor.map(lambda content: complete(content, None), chunks))
+    if not output_json:
+        return "\n".join(results)
+
+    succeeded = [r for r in results if not _is_failed_extraction(r)]
+    if not succeeded:
+        # 所有分块都失败时返回第一个错误，与单次调用的失败结果一致
+        return results[0]
+    merged = merge_results(succeeded)
+    if json_save_path:
+        save_extract_result(json_save_path, merged)
+    return merged
+
+
+def _is_failed_extraction(result):
+    """文件缺失时结果为None，JSON解析失败时为带raw_text的错误字典"""
+    return not isinstance(result, dict) or ("error" in result and "raw_text" in result)
+
+
+def _reconcile_fields(conflicts, question, use_cache=True):
+    """让大模型在各文件的冲突取值中选出最终值，失败时返回空字典（保留规则合并的结果）"""
+    prompt = ("以下是从同一任务的多个文件中分别抽取的字段，这些字段在不同文件中的取值不一致，"
+              "每个字段给出了各文件的取值。请结合抽取要求为每个字段给出最终取值，只输出JSON对象，键为字段名。\n"
+              f"{json.dumps(conflicts, ensure_ascii=False)}\n抽取要求：\n{question}")
+    result = chat_completion(
+        model=Config.MAP_REDUCE_RECONCILE_MODEL,
+        system_prompt="你是一个专业的文档分析助手，擅长从多个文档中提取和整合信息",
+        user_prompt=prompt,
+        temperature=0,
+        max_tokens=Config.EXTRACT_MAX_TOKENS,
+        output_json=True,
+        json_save_path=None,
+        use_cache=use_cache
+    )
+    if _is_failed_extraction(result):
+        log.warning("冲突字段裁决失败，使用规则合并的结果", extra={"fields": list(conflicts)})
+        return {}
+    return {k: v for k, v in result.items() if k in conflicts}
 
-    # 组合所有文件内容和问题
-    combined_prompt = "\n".join(file_contents) + f"\n{question}"
 
-    # 调用chat_completion函数
-    return chat_completion(
-        model=model,
-        system_prompt=system_prompt,
-        user_prompt=combined_prompt,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        output_json=output_json,
-        json_save_path=json_save_path
-    )
+def _map_reduce(file_ids, extract_file, question, json_save_path=None, use_cache=True):
+    """
+    多文件任务的map-reduce抽取：每个文件单独并发抽取，再按文件顺序逐字段合并
+
+    每个请求只包含一个文件，响应缓存按文件命中，任务新增文件时只有新文件需要请求模型；
+    单个文件抽取失败时只丢弃该文件的结果。
 
+    参数:
+        file_ids: 文件ID列表
+        extract_file: 抽取单个文件的函数，参数为文件ID
+        question: 抽取要求，冲突字段裁决时使用
+        json_save_path: 合并结果的保存路径
+        use_cache: 是否使用响应缓存
 
+    返回:
+        合并后的JSON对象，所有文件都失败时返回第一个文件的结果
+    """
+    results = list(map_executor.map(extract_file, file_ids))
+    succeeded = []
+    for file_id, result in zip(file_ids, results):
+        if _is_failed_extraction(result):
+            log.warning("文件抽取失败，不参与合并", extra={"file_id": file_id})
+        else:
+            succeeded.append(result)
+    if not succeeded:
+        return results[0]
+
+    merged = merge_results(succeeded)
+    if Config.MAP_REDUCE_RECONCILE:
+        conflicts = conflicting_fields(succeeded)
+        if conflicts:
+            merged.update(_reconcile_fields(conflicts, question, use_cache))
+    if json_save_path:
+        save_extract_result(json_save_path, merged)
+    return merged
+
+
+def _task_parse_results(task_id):
+    """
+    列出任务的所有解析结果
+
+    返回:
+        [(文件ID, 解析结果路径), ...]，按解析结果文件名排序；
+        上传目录中已经没有对应文件的解析结果，文件ID中使用解析结果的文件名
+    """
+    task_folder = os.path.join(Config.UPLOAD_FOLDER, task_id)
+    filenames = {}
+    if os.path.isdir(task_folder):
+        for filename in os.listdir(task_folder):
+            filenames[_parse_result_base_name(os.path.join(task_folder, filename), filename)] = filename
+    results = []
+    for path in sorted(glob.glob(os.path.join(Config.PARSE_RESULTS_FOLDER, task_id, '*.json'))):
+        base_name = os.path.splitext(os.path.basename(path))[0]
+        results.append((f"{task_id}/{filenames.get(base_name, base_name)}", path))
+    return results
+
+
+@timed("localize")
 def extract_text_locations(task_id: str = None, text_to_search: str = None):
     """
     从解析结果中提取文本位置信息
@@ -390,32 +775,20 @@ def extract_text_locations(task_id: str = None, text_to_search: str = None):
                 file_path = file_info[0]
                 task_id = file_path.split('/')[-2]  # 获取倒数第二个路径部分作为task_id
         except Exception as e:
-            print(f"无法从文本中解析task_id: {e}")
+            log.warning("无法从文本中解析task_id", extra={"error": str(e)})
             return None
 
     if not task_id:
-        print("未提供task_id且无法从文本中解析")
+        log.warning("未提供task_id且无法从文本中解析")
         return None
 
-    # 构建解析结果文件路径
-
-    parse_result_path = os.path.join(Config.PARSE_RESULTS_FOLDER, task_id, '*.json')
-    json_files = glob.glob(parse_result_path)
-    if not json_files:
-        print(f"解析结果文件不存在: {parse_result_path}")
-        return None
-    parse_result_path = json_files[0]
-    
-    # 检查文件是否存在
-    if not os.path.exists(parse_result_path):
-        print(f"解析结果文件不存在: {parse_result_path}")
+    # 任务中所有文件的解析结果
+    parse_results = _task_parse_results(task_id)
+    if not parse_results:
+        log.warning("解析结果文件不存在", extra={"path": os.path.join(Config.PARSE_RESULTS_FOLDER, task_id)})
         return None
 
     try:
-        # 读取解析结果文件
-        with open(parse_result_path, 'r', encoding='utf-8') as f:
-            parse_data = json.load(f)
-
         # 读取markdown_result.json
         extract_result_dir = os.path.join(Config.EXTRACT_RESULTS_FOLDER, task_id)
         os.makedirs(extract_result_dir, exist_ok=True)
@@ -428,36 +801,22 @@ def extract_text_locations(task_id: str = None, text_to_search: str = None):
         
         markdown_result_path = os.path.join(extract_result_dir, 'markdown_result.json')
         if not os.path.exists(markdown_result_path):
-            print(f"markdown_result不存在: {markdown_result_path}")
+            log.warning("markdown_result不存在", extra={"path": markdown_result_path})
             return None
 
         with open(markdown_result_path, 'r', encoding='utf-8') as f:
             markdown_result = json.load(f)
 
-        # 提取文本位置信息
-        text_locations = []
-        on_the_page = []
-        norm_boxes = {}
-
-        # 遍历markdown_result中的所有字段
-        for field_name, field_value in markdown_result.items():
-            field_value_str = str(field_value)
-            # 遍历所有页面的文本块
-            for page in parse_data:
-                for textblock in page.get('textblocks', []):
-                    text = textblock.get('text', '')
-                    norm_box = textblock.get('norm_box')
-                    
-                    # 如果找到匹配的文本
-                    if text and norm_box and field_value_str in text:
-                        on_the_page.append(field_name)
-                        norm_boxes[field_name] = [[norm_box['x0'], norm_box['y0'], norm_box['x1'], norm_box['y1']]]
-                        break
-
-        # 构建结果JSON
+        # 使用各文件解析结果的倒排索引定位所有字段，索引随解析结果持久化，不存在时才读取解析结果重建；
+        # 多个文件的索引合并后一起查找，每个匹配记录所在的文件
+        index = TextBlockIndex.merge([(file_id, TextBlockIndex.load(path)) for file_id, path in parse_results])
+        located = ValueMatcher(index).match_all(markdown_result)
+
+        # 构建结果JSON，normBox按匹配分数从高到低排列，matches给出每个叶子值的路径、文件、页码和分数
         result = {
-            "onThePage": on_the_page,
-            "normBox": norm_boxes
+            "onThePage": list(located.keys()),
+            "normBox": {field_name: [match["box"] for match in matches] for field_name, matches in located.items()},
+            "matches": located
         }
 
         # 确保结果目录存在
@@ -465,14 +824,14 @@ def extract_text_locations(task_id: str = None, text_to_search: str = None):
         os.makedirs(extract_result_dir, exist_ok=True)
 
         # 保存结果
-        result_path = os.path.join(extract_result_dir, 'op.json')
-        with open(result_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=4)
+        save_extract_result(os.path.join(extract_result_dir, 'op.json'), result, indent=4)
+        events.publish(task_id, events.EVENT_LOCATIONS,
+                       {"onThePage": result["onThePage"], "normBox": result["normBox"]})
 
         return result
 
     except Exception as e:
-        print(f"处理文件时出错: {e}")
+        log.exception("计算原文位置时出错", extra={"task_id": task_id})
         return None
 
     return response_text
@@ -1,18 +1,48 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Request, request, jsonify, send_from_directory, send_file, g, Response
 from flask_cors import CORS
 import os
 import json
-import glob
 import uuid
-import asyncio
+import time
 from datetime import datetime
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, safe_join
 from config import Config  # 添加这行
 import ai  # 导入AI模块
-from concurrent.futures import ThreadPoolExecutor  # 添加这行
+from storage import save_stream, FileTooLargeError
+from jobs import JobManager, JobsDraining
+from pipeline import allowed_file, run_extraction_job, EXTRACT_STRATEGIES
+from catalog import catalog
+from result_cache import result_cache
+from schema_store import save_task_schema, list_versions as list_schema_versions
+from batch import BatchPipeline, BatchRejected, PipelineBusy, PipelineDraining
+from image_prep import image_preprocessor, DerivedImageUnavailable
+from resilience import guard_stats
+from logger import get_logger, request_id_var
+from metrics import registry, HTTP_SECONDS
+
+log = get_logger('app')
+
+# 请求体大小上限的余量，留给multipart表单中文件以外的字段
+FORM_OVERHEAD_BYTES = 1024 * 1024
+# 这些路由接收批量压缩包，使用压缩包的大小上限，其余路由使用单个文件的上限
+ARCHIVE_ENDPOINTS = {'submit_batch'}
+
+
+class UploadRequest(Request):
+    """按路由决定请求体大小上限的请求类"""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint in ARCHIVE_ENDPOINTS:
+            return Config.BATCH_MAX_ARCHIVE_BYTES + FORM_OVERHEAD_BYTES
+        return super().max_content_length
+
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config.from_object(Config)  # 使用配置类
+# 请求体超过上限时由werkzeug直接拒绝，不再读取剩余内容；单个文件的上限在保存时另外检查
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES
 
 # CORS配置，允许部分API路由的跨域访问
 frontend_port = os.environ.get('FRONTEND_PORT', '32211')
@@ -44,6 +74,9 @@ ALLOWED_EXTENSIONS = Config.ALLOWED_EXTENSIONS
 # 确保上传目录存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# 启动时把磁盘上有而目录中没有的任务和文件补进目录（第一次启动、升级前已有的任务、手工拷贝的文件）
+log.info("任务目录对账", extra={"added": catalog.reconcile()})
+
 # 解析结果存储目录
 RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
@@ -56,8 +89,87 @@ os.makedirs(EXTRACT_RESULTS_FOLDER, exist_ok=True)
 SCHEMA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema')
 os.makedirs(SCHEMA_FOLDER, exist_ok=True)
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+@app.before_request
+def start_request_timer():
+    # 使用调用方传入的X-Request-ID（便于和前端、网关日志关联），没有时生成一个
+    request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_id_token = request_id_var.set(request_id)
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        # 按路由规则而不是实际路径统计，避免每个文件路径产生一组指标
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_SECONDS.observe(elapsed, method=request.method, endpoint=endpoint, status=response.status_code)
+        if request.path != '/api/metrics':
+            log.info("请求完成", extra={"method": request.method, "path": request.path,
+                                         "status": response.status_code,
+                                         "duration_ms": round(elapsed * 1000, 2)})
+    request_id = request_id_var.get()
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+
+@app.teardown_request
+def reset_request_id(error=None):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
+
+
+def _collect_api_guards():
+    stats = guard_stats()
+    counters = [
+        ('calls', 'api_calls_total', '外部接口调用次数'),
+        ('failures', 'api_failures_total', '外部接口最终失败的次数'),
+        ('retries', 'api_retries_total', '外部接口重试次数'),
+        ('rejected', 'api_rejected_total', '熔断期间被拒绝的调用次数'),
+        ('throttled_seconds', 'api_throttled_seconds_total', '限流等待的累计时间（秒）'),
+    ]
+    families = [(name, 'counter', help_text, [({"api": api}, s[key]) for api, s in stats.items()])
+                for key, name, help_text in counters]
+    families.append(('api_circuit_open', 'gauge', '熔断器是否处于打开状态',
+                     [({"api": api}, int(s['circuit'] == 'open')) for api, s in stats.items()]))
+    return families
+
+
+def _collect_caches():
+    caches = {"ocr": ai.ocr_cache.stats(), "llm": ai.llm_cache.stats(), "result": result_cache.stats()}
+    return [
+        ('cache_hits_total', 'counter', '缓存命中次数', [({"cache": name}, s['hits']) for name, s in caches.items()]),
+        ('cache_misses_total', 'counter', '缓存未命中次数',
+         [({"cache": name}, s['misses']) for name, s in caches.items()]),
+    ]
+
+
+def _collect_image_prep():
+    stats = image_preprocessor.stats()
+    return [
+        ('image_prep_calls_total', 'counter', '图片预处理次数', [({}, stats['calls'])]),
+        ('image_prep_cache_hits_total', 'counter', '图片预处理命中磁盘缓存的次数', [({}, stats['cache_hits'])]),
+        ('image_prep_bytes_saved_total', 'counter', '图片预处理节省的请求字节数', [({}, stats['bytes_saved'])]),
+    ]
+
+
+registry.register_collector(_collect_api_guards)
+registry.register_collector(_collect_caches)
+registry.register_collector(_collect_image_prep)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus文本格式的指标：各阶段耗时、HTTP请求耗时、token用量、缓存和外部接口统计"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({'error': f'请求超过大小上限 {request.max_content_length} 字节'}), 413
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
@@ -80,7 +192,14 @@ def upload_file():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         file_path = os.path.join(task_folder, filename)
-        file.save(file_path)
+        # 分块写入磁盘并同时计算哈希和大小
+        try:
+            content_hash, file_size = save_stream(file.stream, file_path, max_bytes=Config.MAX_UPLOAD_BYTES)
+        except FileTooLargeError as e:
+            return jsonify({'error': str(e)}), 413
+        # 同名文件被覆盖时，旧的解析结果不再有效（OCR缓存按内容寻址，不受影响）
+        ai.clear_parse_result(f"{task_id}/{filename}")
+        catalog.record_document(task_id, filename, file_size, sha256=content_hash)
         
         # 这里可以调用文档解析服务
         # 模拟解析结果
@@ -116,6 +235,8 @@ def upload_file():
             'message': '文件上传成功',
             'filename': filename,
             'task_id': task_id,
+            'sha256': content_hash,
+            'size': file_size,
             'chucking_result': parse_result
         })
     
@@ -132,6 +253,47 @@ def get_file(file_path):
     else:
         return send_from_directory(app.config['UPLOAD_FOLDER'], file_path)
 
+def _send_derived_image(file_path, tile=False):
+    """按查询参数生成预览图或分块图，带ETag和缓存头返回，支持条件请求和Range"""
+    path = safe_join(app.config['UPLOAD_FOLDER'], file_path)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'error': '文件不存在'}), 404
+    try:
+        width = int(request.args.get('width', max(Config.THUMBNAIL_WIDTHS)))
+        page = int(request.args.get('page', 0))
+        x = int(request.args.get('x', 0))
+        y = int(request.args.get('y', 0))
+    except ValueError:
+        return jsonify({'error': 'width、page、x、y必须是整数'}), 400
+    if width < 1:
+        return jsonify({'error': 'width必须大于0'}), 400
+
+    try:
+        if tile:
+            derived_path, mimetype, etag = image_preprocessor.tile(path, width, x, y, page)
+        else:
+            derived_path, mimetype, etag = image_preprocessor.thumbnail(path, width, page)
+    except DerivedImageUnavailable as e:
+        return jsonify({'error': str(e)}), 501
+    except IndexError as e:
+        return jsonify({'error': str(e)}), 404
+    # URL中不带文件内容的版本，同名文件重新上传后URL不变，所以每次都用ETag向服务端确认（未变化时返回304）
+    return send_file(derived_path, mimetype=mimetype, conditional=True, etag=etag, max_age=0)
+
+@app.route('/api/thumbnails/<path:file_path>', methods=['GET'])
+def get_thumbnail(file_path):
+    """
+    文件的预览图 ?width=&page=
+
+    宽度对齐到THUMBNAIL_WIDTHS，PDF按页（从0开始）栅格化；按内容哈希和尺寸缓存在磁盘上
+    """
+    return _send_derived_image(file_path)
+
+@app.route('/api/tiles/<path:file_path>', methods=['GET'])
+def get_tile(file_path):
+    """预览图中第x列、第y行的分块 ?width=&page=&x=&y=，用于放大查看"""
+    return _send_derived_image(file_path, tile=True)
+
 @app.route('/api/results/<document_id>', methods=['GET'])
 def get_result(document_id):
     # 移除可能的文件扩展名
@@ -159,56 +321,79 @@ def verify_result():
 
 # API端点
 
+def _page_args(default_sort):
+    """
+    解析分页和排序参数 ?limit=&offset=&sort=&order=asc|desc
+
+    返回:
+        {"sort", "descending", "limit", "offset"}，参数无效时抛出ValueError
+    """
+    limit = int(request.args.get('limit', Config.CATALOG_PAGE_SIZE))
+    offset = int(request.args.get('offset', 0))
+    if limit < 1 or offset < 0:
+        raise ValueError('limit必须大于0，offset不能小于0')
+    return {
+        'sort': request.args.get('sort', default_sort),
+        'descending': request.args.get('order', 'desc') != 'asc',
+        'limit': min(limit, Config.CATALOG_MAX_PAGE_SIZE),
+        'offset': offset
+    }
+
+def _paged_response(items, total):
+    """列表接口保持返回数组，总数放在X-Total-Count响应头中"""
+    response = jsonify(items)
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
 @app.route('/api/documents', methods=['GET'])
 def get_documents():
-    """获取所有已上传的文档列表"""
-    documents = []
-    for filename in os.listdir(UPLOAD_FOLDER):
-        print(filename)
-        if allowed_file(filename):
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            documents.append({
-                'id': filename,
-                'name': filename,
-                'upload_time': os.path.getmtime(file_path),
-                'size': os.path.getsize(file_path)
-            })
-    
-    # 按上传时间排序，最新的在前
-    documents.sort(key=lambda x: x['upload_time'], reverse=True)
-    return jsonify(documents)
+    """获取上传目录根下的文档列表，默认按上传时间倒序，支持分页"""
+    try:
+        rows, total = catalog.list_documents('', **_page_args('upload_time'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    documents = [{
+        'id': row['file_id'],
+        'name': row['filename'],
+        'upload_time': row['upload_time'],
+        'size': row['size']
+    } for row in rows]
+    return _paged_response(documents, total)
 
 @app.route('/api/documents/<path:task_id>', methods=['GET'])
 def get_document(task_id):
     """获取指定文档及其相关文件的详细信息"""
-    # 构建目标文件夹路径
-    target_folder = os.path.join(UPLOAD_FOLDER, task_id)
-    
-    # 检查路径是否存在
-    if not os.path.exists(target_folder):
-        return jsonify({'error': '路径不存在'}), 404
-    
-    # 查找所有相关文件
-    documents = []
-    for filename in os.listdir(target_folder):
-        if allowed_file(filename):
-            file_path = os.path.join(target_folder, filename)
-            file_extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-            file_type = 'application/pdf' if file_extension == 'pdf' else f'image/{file_extension}'
-            
-            documents.append({
-                'id': os.path.join(task_id, filename),  # 包含相对路径的文件ID
-                'filename': filename,
-                'file_type': file_type,
-                'upload_time': os.path.getmtime(file_path),
-                'size': os.path.getsize(file_path)
-            })
-    
+    # 一个任务的文件数量有限，未指定limit时返回全部
+    try:
+        page = _page_args('upload_time')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if 'limit' not in request.args:
+        page['limit'] = None
+
+    task = catalog.get_task(task_id)
+    rows, total = catalog.list_documents(task_id, **page) if task else ([], 0)
+    if not total:
+        # 目录中还没有的任务文件夹（启动之后手工拷贝的），对账后再查一次
+        catalog.reconcile(task_ids={task_id})
+        task = catalog.get_task(task_id)
+        if task is None:
+            return jsonify({'error': '路径不存在'}), 404
+        rows, total = catalog.list_documents(task_id, **page)
+    documents = [{
+        'id': row['file_id'],  # 包含相对路径的文件ID
+        'filename': row['filename'],
+        'file_type': row['file_type'],
+        'upload_time': row['upload_time'],
+        'size': row['size']
+    } for row in rows]
+
     if not documents:
         return jsonify({'error': '文件夹中没有符合要求的文件'}), 404
         
     return jsonify({
-        'documents': documents
+        'documents': documents,
+        'total': total
     })
 
 @app.route('/api/create-task', methods=['POST'])
@@ -220,6 +405,7 @@ def create_task():
     # 创建任务文件夹
     task_folder = os.path.join(app.config['UPLOAD_FOLDER'], task_id)
     os.makedirs(task_folder, exist_ok=True)
+    catalog.ensure_task(task_id)
     
     # 返回任务ID
     return jsonify({
@@ -263,162 +449,145 @@ def get_schema_with_taskid(task_id):
             }
             return jsonify(default_schema)
 
-# 添加异步处理函数
-async def process_with_ai(task_id, schema_data,extract_strategy=["markdown","multi-modal"],):
-    """
-    使用AI处理任务
-    
-    参数:
-        task_id: 任务ID
-        schema_data: Schema数据
-    """
-    try:
-        # 从schema中提取提示词，如果没有则使用默认值
-        system_prompt = schema_data.get('system_prompt', '你是一个专业的文档分析助手，擅长从文档中提取结构化信息')
-        user_prompt = schema_data.get('user_prompt', '请分析这个文档并提取关键信息,并以JSON格式返回，jsonSchema如下：{jsonSchema}')
-        user_prompt = user_prompt.format(jsonSchema=json.dumps(schema_data, ensure_ascii=False))
-        # print(user_prompt)
-        # 获取任务相关的文件
-        task_folder = os.path.join(UPLOAD_FOLDER, task_id)
-        if not os.path.exists(task_folder):
-            print(f"任务文件夹不存在: {task_folder}")
-            return
-        
-        # 查找所有相关文件
-        files = []
-        for filename in os.listdir(task_folder):
-            if allowed_file(filename):
-                files.append(os.path.join(task_id, filename))
-        
-        if not files:
-            print(f"任务 {task_id} 没有可处理的文件")
-            return
-        
-        # 确保结果目录存在
-        extract_result_folder = os.path.join(EXTRACT_RESULTS_FOLDER, task_id)
-        os.makedirs(extract_result_folder, exist_ok=True)
+# 后台抽取任务管理器，状态持久化在JOBS_FOLDER中，重启后恢复未完成的任务
+job_manager = JobManager(run_extraction_job)
+job_manager.recover()
 
-
-        # 根据文件扩展名过滤文件列表
-        multimodal_files = [file_id for file_id in files if '.' in file_id and file_id.rsplit('.', 1)[1].lower() in Config.MULTIMODAL_ALLOWED_EXTENSIONS]
-        markdown_files = [file_id for file_id in files if '.' in file_id and file_id.rsplit('.', 1)[1].lower() in Config.MARKDOWN_ALLOWED_EXTENSIONS]
-        try:
-            # 处理多模态文件
-            if multimodal_files and "multi-modal" in extract_strategy:
-                print(f"正在处理多模态文件: {multimodal_files}")
-                # 图像文件使用多模态处理
-                result = ai.multimodal_completion(
-                    file_ids=multimodal_files,
-                    prompt=user_prompt,
-                    output_json=True,
-                    json_save_path=os.path.join(extract_result_folder, f"multimodal_result.json")
-                )
-                print(f"多模态处理完成: {multimodal_files}")
-        except Exception as e:
-            print(f"多模态处理出错: {e}")
-        try:
-            # 处理需要markdown解析的文件
-            if markdown_files and "markdown" in extract_strategy:
-                print(f"正在处理PDF文件: {markdown_files}")
-                # 使用process_multiple_files处理PDF文件
-                result = ai.process_multiple_files(
-                    file_ids=markdown_files,
-                    system_prompt=system_prompt,
-                    question=user_prompt,
-                    output_json=True,
-                    json_save_path=os.path.join(extract_result_folder, f"markdown_result.json")
-                )
-                print(f"PDF处理完成: {markdown_files}")
-        except Exception as e:
-            print(f"PDF处理出错: {e}")
-            
-            print(f"任务 {task_id} 处理完成")
-        
-    except Exception as e:
-        print(f"AI处理出错: {e}")
-
-# 创建线程池执行器
-executor = ThreadPoolExecutor(max_workers=4)  # 可以根据需要调整线程数
+def _parse_strategy():
+    """解析 ?strategy=markdown,multi-modal 参数，包含不支持的策略时返回None"""
+    extract_strategy = [s for s in request.args.get('strategy', ','.join(EXTRACT_STRATEGIES)).split(',') if s]
+    if not extract_strategy or any(s not in EXTRACT_STRATEGIES for s in extract_strategy):
+        return None
+    return extract_strategy
 
 @app.route('/api/schema/<task_id>', methods=['POST'])
 def save_schema(task_id):
-    """保存指定任务的JSON Schema并触发AI处理"""
+    """保存指定任务的JSON Schema并提交AI处理任务，立即返回任务ID"""
     schema_data = request.json
     
     if not schema_data:
         return jsonify({'error': '无效的Schema数据'}), 400
     
-    # 确保Schema目录存在
-    os.makedirs(SCHEMA_FOLDER, exist_ok=True)
-    
-    # 保存Schema
-    schema_path = os.path.join(SCHEMA_FOLDER, f"{task_id}.json")
-    with open(schema_path, 'w', encoding='utf-8') as f:
-        json.dump(schema_data, f, ensure_ascii=False, indent=2)
-    
-    # 使用线程池执行器替代asyncio.run
-    # 创建一个同步包装函数来调用异步函数
-    def run_async_task(task_id, schema_data):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(process_with_ai(task_id, schema_data))
-        finally:
-            loop.close()
+    extract_strategy = _parse_strategy()
+    if extract_strategy is None:
+        return jsonify({'error': '不支持的抽取策略'}), 400
     
-    # 提交任务到线程池并获取Future对象
-    future = executor.submit(run_async_task, task_id, schema_data)
+    # 保存Schema并记录版本，和上一版本比较得到变化的字段
+    version, schema_diff = save_task_schema(task_id, schema_data)
+    catalog.update_task(task_id, schema=schema_data.get('title') or task_id)
+    # ?full=1 时忽略差异，全量重新抽取
+    if request.args.get('full') == '1':
+        schema_diff = None
     
-    # 等待任务完成
-    future.result()
+    # 提交到后台执行，不阻塞请求线程，只有变化的字段会重新请求模型
+    try:
+        job = job_manager.submit(task_id, schema_data, extract_strategy, schema_diff=schema_diff)
+    except JobsDraining as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
     return jsonify({
-        'message': 'Schema保存成功，AI处理已完成',
-        'task_id': task_id
-    })
+        'message': 'Schema保存成功，AI处理已提交',
+        'task_id': task_id,
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'status_url': f"/api/jobs/{job['job_id']}",
+        'schema_version': version,
+        'schema_diff': schema_diff
+    }), 202
 
-@app.route('/api/multi-channel-results/<task_id>', methods=['GET'])
-def get_multi_channel_results(task_id):
-    """获取多渠道解析结果"""
-    # 获取所有渠道的解析结果
-    field_name_map={"markdown_result":"DeepSeek-R1","multimodal_result":"豆包vision"}
-    channels = []
-    on_the_page=[]
-    norm_box=[]
-    channel_files = glob.glob(os.path.join(EXTRACT_RESULTS_FOLDER, f"{task_id}/*.json"))
-    
-    
-    # 如果没有找到特定文档的渠道文件，则使用所有可用的渠道文件
-    if not channel_files:
-        channel_files = glob.glob(os.path.join(EXTRACT_RESULTS_FOLDER, "invoice/*.json"))
-    
-    for file_path in channel_files:
-        channel_name = os.path.splitext(os.path.basename(file_path))[0]  # 提取不带扩展名的文件名
-        if(channel_name != "op"):  # 修改判断条件
-            print(channel_name)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                channel_data = json.load(f)
-                channels.append({
-                    "channel": field_name_map.get(channel_name, channel_name),
-                    "data": channel_data
-                })
+@app.route('/api/schema/<task_id>/versions', methods=['GET'])
+def get_schema_versions(task_id):
+    """列出任务schema的历史版本及每个版本相对上一版本的字段差异"""
+    return jsonify(list_schema_versions(task_id))
+
+def _job_summary(job):
+    """返回给前端的任务状态，不包含完整的schema"""
+    return {key: value for key, value in job.items() if key != 'schema'}
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询抽取任务状态（整体及各抽取策略的状态和耗时）"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': '找不到指定的任务'}), 404
+    return jsonify(_job_summary(job))
+
+@app.route('/api/tasks/<task_id>/jobs', methods=['GET'])
+def get_task_jobs(task_id):
+    """获取指定任务ID下的所有抽取任务，最新的在前"""
+    return jsonify([_job_summary(job) for job in job_manager.list_for_task(task_id)])
+
+# 批量任务流水线，各阶段线程在第一次提交批次时启动
+batch_pipeline = BatchPipeline()
+
+
+def drain(timeout=None):
+    """
+    停止服务前等待后台的抽取任务和批量任务完成（由gunicorn.conf.py在worker退出时调用）
+
+    参数:
+        timeout: 两者合计的最长等待时间（秒）
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def remaining():
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    unfinished_batch_tasks = batch_pipeline.drain(remaining())
+    unfinished_jobs = job_manager.drain(remaining())
+    log.info("后台任务已停止", extra={"unfinished_jobs": unfinished_jobs,
+                                      "unfinished_batch_tasks": unfinished_batch_tasks})
+
+@app.route('/api/batch', methods=['POST'])
+def submit_batch():
+    """
+    批量提交任务，立即返回批次ID
+
+    两种方式：
+    1. multipart上传zip压缩包(archive字段)，顶层目录各为一个任务，schema字段指定默认Schema名，
+       压缩包内可以包含manifest.json为每个任务指定Schema
+    2. JSON清单 {"schema": "invoice", "tasks": [{"task_id": "...", "schema": "..."}]}，
+       任务文件已通过 /api/upload 上传
+    """
+    extract_strategy = _parse_strategy()
+    if extract_strategy is None:
+        return jsonify({'error': '不支持的抽取策略'}), 400
+    try:
+        if 'archive' in request.files:
+            batch = batch_pipeline.submit_archive(request.files['archive'].stream,
+                                                  default_schema=request.form.get('schema'),
+                                                  extract_strategy=extract_strategy)
+        elif request.is_json:
+            batch = batch_pipeline.submit_manifest(request.json, extract_strategy=extract_strategy)
         else:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                op_data = json.load(f)
-                on_the_page = op_data["onThePage"]
-                norm_box=op_data["normBox"]
-    # 生成默认的人类人工核对结果（使用第一个渠道的结果作为默认值）
-    default_decision = {}
-    if channels:
-        default_decision = channels[0]["data"]
-    
-    return jsonify({
-        "channels": channels,
-        "onThePage": on_the_page,
-        "normBox": norm_box,
-        "defaultDecision": default_decision
-        
+            return jsonify({'error': '需要上传压缩包或提交JSON清单'}), 400
+    except PipelineDraining as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    except PipelineBusy as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '60'}
+    except (BatchRejected, FileTooLargeError) as e:
+        return jsonify({'error': str(e)}), 400
+    batch['status_url'] = f"/api/batch/{batch['batch_id']}"
+    return jsonify(batch), 202
 
-    })
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """获取批次的汇总进度，?details=1 时返回每个任务的状态"""
+    batch = batch_pipeline.summary(batch_id, include_tasks=request.args.get('details') == '1')
+    if batch is None:
+        return jsonify({'error': '找不到指定的批次'}), 404
+    return jsonify(batch)
+
+@app.route('/api/multi-channel-results/<task_id>', methods=['GET'])
+def get_multi_channel_results(task_id):
+    """获取多渠道解析结果，内容未变化时根据ETag/Last-Modified返回304"""
+    entry = result_cache.get(task_id)
+    response = app.response_class(entry["body"], mimetype='application/json')
+    response.set_etag(entry["etag"])
+    if entry["last_modified"]:
+        response.last_modified = entry["last_modified"]
+    # 比对页面会反复轮询，每次都需要向服务端确认是否有新结果
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/api/schema/<schema_name>', methods=['GET'])
 def get_schema(schema_name):
@@ -444,6 +613,7 @@ def save_decision():
     decision_path = os.path.join(RESULTS_FOLDER, f"{document_id}_decision.json")
     with open(decision_path, 'w', encoding='utf-8') as f:
         json.dump(decision_data, f, ensure_ascii=False, indent=2)
+    catalog.mark_reviewed(document_id)
     
     return jsonify({'message': '人工核对结果已保存'})
 
@@ -477,23 +647,26 @@ def get_task_comparison(task_id):
 
 @app.route('/api/tasks', methods=['GET'])
 def get_tasks():
-    """获取所有可用的任务列表"""
+    """
+    获取有比对数据的任务列表 [{"task_id", "created_at"}]，默认按创建时间倒序
+
+    ?scope=all 列出目录中的所有任务，?details=1 时附带状态、schema、文件数等目录字段；
+    支持 ?status=&schema=&since=&until=（创建时间戳）过滤以及 limit/offset/sort/order 分页排序
+    """
     try:
-        results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
-        tasks = []
-        
-        for filename in os.listdir(results_dir):
-            if filename.endswith('_multi_channel.json'):
-                task_id = filename.replace('_multi_channel.json', '')
-                tasks.append({
-                    "task_id": task_id,
-                    "created_at": os.path.getctime(os.path.join(results_dir, filename))
-                })
-        
-        # 按创建时间排序
-        tasks.sort(key=lambda x: x['created_at'], reverse=True)
-        return jsonify(tasks)
+        since = request.args.get('since', type=float)
+        until = request.args.get('until', type=float)
+        tasks, total = catalog.list_tasks(status=request.args.get('status'),
+                                          schema=request.args.get('schema'),
+                                          since=since, until=until,
+                                          comparison=None if request.args.get('scope') == 'all' else True,
+                                          **_page_args('created_at'))
+        if request.args.get('details') != '1':
+            tasks = [{"task_id": task['task_id'], "created_at": task['created_at']} for task in tasks]
+        return _paged_response(tasks, total)
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"获取任务列表失败: {str(e)}"}), 500
 
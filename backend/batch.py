@@ -0,0 +1,492 @@
+import os
+import json
+import uuid
+import time
+import queue
+import zipfile
+import threading
+from werkzeug.utils import secure_filename
+from config import Config
+import ai
+from storage import atomic_write_json, save_stream
+from catalog import catalog
+from result_cache import result_cache
+from schema_store import save_task_schema
+from pipeline import allowed_file, task_files, run_extraction_job, EXTRACT_STRATEGIES
+from jobs import JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from logger import get_logger
+import events
+
+log = get_logger('batch')
+
+# 流水线阶段，按顺序执行
+STAGE_UPLOAD = 'upload'
+STAGE_OCR = 'ocr'
+STAGE_LLM = 'llm'
+STAGE_LOCALIZE = 'localize'
+STAGES = (STAGE_UPLOAD, STAGE_OCR, STAGE_LLM, STAGE_LOCALIZE)
+
+# 压缩包中可选的清单文件，格式和 submit_manifest 的清单相同，任务名是压缩包中的顶层目录名
+MANIFEST_NAME = 'manifest.json'
+
+
+class BatchRejected(Exception):
+    """批次内容无效，拒绝接收"""
+
+
+class PipelineDraining(BatchRejected):
+    """服务正在停止，不再接受新批次"""
+
+
+class PipelineBusy(BatchRejected):
+    """流水线积压的任务过多，需要稍后重试"""
+
+
+def load_schema(schema_name):
+    """按名称读取 SCHEMA_FOLDER 中的schema"""
+    schema_path = os.path.join(Config.SCHEMA_FOLDER, f"{secure_filename(schema_name)}.json")
+    if not os.path.exists(schema_path):
+        raise BatchRejected(f"找不到指定的Schema: {schema_name}")
+    with open(schema_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def parse_manifest(manifest):
+    """
+    检查批次清单的格式
+
+    清单格式: {"schema": "默认schema名", "tasks": [...]}，tasks可以是列表，元素为任务名或
+    {"task_id": "任务名", "schema": "schema名"}；也可以是 {"任务名": {"schema": "schema名"}}
+
+    返回:
+        (默认schema名, [(任务名, schema名), ...])，任务没有指定schema时schema名为None
+    """
+    if not isinstance(manifest, dict):
+        raise BatchRejected("清单必须是JSON对象")
+    default_schema = manifest.get('schema')
+    if default_schema is not None and not isinstance(default_schema, str):
+        raise BatchRejected("清单中的schema必须是字符串")
+    tasks = manifest.get('tasks', [])
+    if isinstance(tasks, dict):
+        entries = list(tasks.items())
+    elif isinstance(tasks, list):
+        entries = [(item.get('task_id'), item) if isinstance(item, dict) else (item, {}) for item in tasks]
+    else:
+        raise BatchRejected("清单中的tasks必须是列表或对象")
+    parsed = []
+    for name, options in entries:
+        if not isinstance(name, str) or not name:
+            raise BatchRejected(f"无效的任务: {name!r}")
+        if not isinstance(options, dict):
+            raise BatchRejected(f"任务 {name} 的配置必须是对象")
+        schema_name = options.get('schema')
+        if schema_name is not None and not isinstance(schema_name, str):
+            raise BatchRejected(f"任务 {name} 的schema必须是字符串")
+        parsed.append((name, schema_name))
+    return default_schema, parsed
+
+
+def member_filenames(members):
+    """
+    为一个任务的压缩包成员分配任务目录中的文件名
+
+    任务目录是平铺的，子目录中的文件命名为 子目录_文件名，不同子目录中的同名文件不会互相覆盖；
+    清理后仍然重名时（例如secure_filename去掉了非ASCII字符）在扩展名前加序号
+
+    参数:
+        members: 压缩包中的成员路径，目录任务的路径以任务目录开头
+
+    返回:
+        {成员路径: 文件名}
+    """
+    filenames = {}
+    used = set()
+    for member in members:
+        parts = member.split('/')
+        relative = parts[1:] if len(parts) > 1 else parts
+        stem, ext = os.path.splitext('/'.join(relative))
+        stem = secure_filename(stem) or 'file'
+        filename = f"{stem}{ext}"
+        index = 1
+        while filename.lower() in used:
+            filename = f"{stem}_{index}{ext}"
+            index += 1
+        used.add(filename.lower())
+        filenames[member] = filename
+    return filenames
+
+
+class BatchPipeline:
+    """
+    批量任务流水线
+
+    每个任务依次经过 上传(解压) -> OCR -> 大模型渠道 -> 原文定位 四个阶段，
+    每个阶段有独立的工作线程数（OCR和大模型的限流不同），阶段之间用有界队列连接，
+    下游处理不过来时上游会阻塞等待（背压）。流水线中未完成的任务总数超过上限时拒绝新批次。
+    批次状态保存在 Config.BATCHES_FOLDER/<batch_id>.json，只有未完成的批次保留在内存中。
+    """
+
+    def __init__(self, stage_workers=None, queue_size=None, max_pending=None, batches_folder=None):
+        """
+        参数:
+            stage_workers: {阶段名: 工作线程数}
+            queue_size: 每个阶段输入队列的长度
+            max_pending: 流水线中允许的未完成任务总数
+            batches_folder: 批次状态存储目录
+        """
+        self.stage_workers = stage_workers or {
+            STAGE_UPLOAD: Config.BATCH_UPLOAD_WORKERS,
+            STAGE_OCR: Config.BATCH_OCR_WORKERS,
+            STAGE_LLM: Config.BATCH_LLM_WORKERS,
+            STAGE_LOCALIZE: Config.BATCH_LOCALIZE_WORKERS,
+        }
+        self.queue_size = queue_size or Config.BATCH_QUEUE_SIZE
+        self.max_pending = max_pending or Config.BATCH_MAX_PENDING
+        self.batches_folder = batches_folder or Config.BATCHES_FOLDER
+        os.makedirs(self.batches_folder, exist_ok=True)
+
+        self.queues = {stage: queue.Queue(maxsize=self.queue_size) for stage in STAGES}
+        self.handlers = {
+            STAGE_UPLOAD: self._stage_upload,
+            STAGE_OCR: self._stage_ocr,
+            STAGE_LLM: self._stage_llm,
+            STAGE_LOCALIZE: self._stage_localize,
+        }
+        self.batches = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        # 未完成任务数归零时通知drain
+        self._idle = threading.Condition(self._lock)
+        self._started = False
+        self._draining = False
+
+    def _start(self):
+        """第一次提交时启动各阶段的工作线程"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for stage in STAGES:
+            for i in range(self.stage_workers[stage]):
+                threading.Thread(target=self._worker, args=(stage,), daemon=True,
+                                 name=f"batch-{stage}-{i}").start()
+
+    # ---- 批次提交 ----
+
+    def submit_archive(self, stream, default_schema=None, extract_strategy=None):
+        """
+        从zip压缩包创建批次：顶层目录对应一个任务，根目录下的单个文件各自成为一个任务
+
+        参数:
+            stream: 压缩包文件流
+            default_schema: 未在manifest.json中指定时使用的schema名
+            extract_strategy: 抽取策略列表
+        """
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        archive_path = os.path.join(self.batches_folder, f"{batch_id}.zip")
+        save_stream(stream, archive_path, max_bytes=Config.BATCH_MAX_ARCHIVE_BYTES)
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                manifest_schema, task_schemas = None, {}
+                if MANIFEST_NAME in archive.namelist():
+                    manifest_schema, entries = parse_manifest(
+                        json.loads(archive.read(MANIFEST_NAME).decode('utf-8')))
+                    task_schemas = dict(entries)
+                groups = {}
+                for info in archive.infolist():
+                    if info.is_dir() or info.filename == MANIFEST_NAME:
+                        continue
+                    parts = info.filename.split('/')
+                    if not allowed_file(parts[-1]) or parts[-1].startswith('.'):
+                        continue
+                    source = parts[0] if len(parts) > 1 else os.path.splitext(parts[0])[0]
+                    groups.setdefault(source, []).append(info.filename)
+        except BatchRejected:
+            os.remove(archive_path)
+            raise
+        except (zipfile.BadZipFile, ValueError) as e:
+            os.remove(archive_path)
+            raise BatchRejected(f"无效的压缩包: {e}")
+
+        tasks = []
+        for source, members in groups.items():
+            schema_name = task_schemas.get(source) or manifest_schema or default_schema
+            tasks.append({
+                'source': source,
+                'task_id': f"{secure_filename(source) or 'task'}_{batch_id[-8:]}",
+                'schema_name': schema_name,
+                'members': members
+            })
+        try:
+            return self._submit(batch_id, tasks, extract_strategy, archive_path=archive_path)
+        except BatchRejected:
+            os.remove(archive_path)
+            raise
+
+    def submit_manifest(self, manifest, extract_strategy=None):
+        """
+        从清单创建批次，清单中的任务文件已通过 /api/upload 上传
+
+        参数:
+            manifest: {"schema": "默认schema名", "tasks": [{"task_id": "...", "schema": "..."}]}，格式见parse_manifest
+        """
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        default_schema, entries = parse_manifest(manifest)
+        tasks = []
+        for task_id, schema_name in entries:
+            if secure_filename(task_id) != task_id:
+                raise BatchRejected(f"无效的任务ID: {task_id}")
+            tasks.append({
+                'source': task_id,
+                'task_id': task_id,
+                'schema_name': schema_name or default_schema,
+                'members': None
+            })
+        return self._submit(batch_id, tasks, extract_strategy)
+
+    def _submit(self, batch_id, tasks, extract_strategy, archive_path=None):
+        if not tasks:
+            raise BatchRejected('批次中没有可处理的任务')
+        # 提交前先读取所有schema，避免流水线跑到一半才发现schema不存在
+        schemas = {}
+        for task in tasks:
+            if not task['schema_name']:
+                raise BatchRejected(f"任务 {task['source']} 没有指定Schema")
+            if task['schema_name'] not in schemas:
+                schemas[task['schema_name']] = load_schema(task['schema_name'])
+
+        with self._lock:
+            if self._draining:
+                raise PipelineDraining('服务正在停止，请稍后重试')
+            if self._pending + len(tasks) > self.max_pending:
+                raise PipelineBusy(f"流水线积压任务过多({self._pending})，请稍后重试")
+            self._pending += len(tasks)
+
+        now = time.time()
+        batch = {
+            'batch_id': batch_id,
+            'status': JOB_RUNNING,
+            'created_at': now,
+            'finished_at': None,
+            'extract_strategy': extract_strategy or list(EXTRACT_STRATEGIES),
+            'archive_path': archive_path,
+            'tasks': [{
+                'source': task['source'],
+                'task_id': task['task_id'],
+                'schema': task['schema_name'],
+                'stage': STAGE_UPLOAD,
+                'status': JOB_QUEUED,
+                'error': None,
+                'timings': {}
+            } for task in tasks],
+            '_dirty': True,
+            '_saved_at': 0
+        }
+        with self._lock:
+            self.batches[batch_id] = batch
+        self._save(batch, force=True)
+        self._start()
+
+        items = [{
+            'batch_id': batch_id,
+            'index': i,
+            'task_id': task['task_id'],
+            'members': task['members'],
+            'schema': schemas[task['schema_name']],
+            'schema_name': task['schema_name'],
+            'results': {}
+        } for i, task in enumerate(tasks)]
+        # 由单独的线程把任务放入第一个阶段的有界队列，队列满时阻塞，不占用请求线程
+        threading.Thread(target=self._feed, args=(items,), daemon=True, name=f"batch-feed-{batch_id}").start()
+        return self.summary(batch_id)
+
+    def _feed(self, items):
+        for item in items:
+            self.queues[STAGE_UPLOAD].put(item)
+
+    # ---- 阶段执行 ----
+
+    def _worker(self, stage):
+        next_stage = STAGES[STAGES.index(stage) + 1] if stage != STAGES[-1] else None
+        while True:
+            item = self.queues[stage].get()
+            self._update_task(item, stage, JOB_RUNNING)
+            started = time.time()
+            try:
+                self.handlers[stage](item)
+            except Exception as e:
+                log.exception("批量任务阶段出错", extra={"batch_id": item['batch_id'], "task_id": item['task_id'],
+                                                      "stage": stage})
+                self._update_task(item, stage, JOB_FAILED, error=e, duration=time.time() - started)
+                events.publish(item['task_id'], events.EVENT_FAILED, {"stage": stage, "error": str(e)})
+                self._task_finished(item)
+                continue
+            duration = time.time() - started
+            if next_stage is None:
+                self._update_task(item, stage, JOB_DONE, duration=duration)
+                self._task_finished(item)
+            else:
+                self._update_task(item, next_stage, JOB_QUEUED, duration=duration, finished_stage=stage)
+                # 下游队列满时在这里阻塞，形成背压
+                self.queues[next_stage].put(item)
+
+    def _stage_upload(self, item):
+        """解压任务文件到上传目录，清单任务只检查文件是否存在"""
+        task_id = item['task_id']
+        if item['members']:
+            batch = self.batches[item['batch_id']]
+            task_folder = os.path.join(Config.UPLOAD_FOLDER, task_id)
+            os.makedirs(task_folder, exist_ok=True)
+            with zipfile.ZipFile(batch['archive_path']) as archive:
+                for member, filename in member_filenames(item['members']).items():
+                    with archive.open(member) as source:
+                        content_hash, size = save_stream(source, os.path.join(task_folder, filename),
+                                                         max_bytes=Config.MAX_UPLOAD_BYTES)
+                    ai.clear_parse_result(f"{task_id}/{filename}")
+                    catalog.record_document(task_id, filename, size, sha256=content_hash)
+        if not task_files(task_id):
+            raise ValueError(f"任务 {task_id} 没有可处理的文件")
+        # 和 POST /api/schema/<task_id> 一样保存任务的schema，供比对页面使用，
+        # 已抽取过的任务只重新抽取schema中变化的字段
+        _, item['schema_diff'] = save_task_schema(task_id, item['schema'])
+        catalog.update_task(task_id, schema=item['schema'].get('title') or item['schema_name'])
+
+    def _stage_ocr(self, item):
+        """预先完成OCR，结果进入OCR缓存，大模型阶段的markdown渠道直接命中缓存"""
+        events.reset(item['task_id'], batch_id=item['batch_id'])
+        for file_id in task_files(item['task_id']):
+            if ai.document_parse(file_id) is None:
+                raise ValueError(f"文件解析失败: {file_id}")
+
+    def _stage_llm(self, item):
+        """复用process_with_ai并发调用各抽取渠道，原文定位留给下一阶段"""
+        batch = self.batches[item['batch_id']]
+        strategy = batch['extract_strategy']
+        errors = {}
+
+        def reporter(channel, status, error=None):
+            if status == JOB_FAILED:
+                errors[channel or 'task'] = str(error)
+
+        item['results'] = run_extraction_job(item['task_id'], item['schema'], strategy, reporter, localize=False,
+                                             schema_diff=item.get('schema_diff'))
+        if not any(result is not None for result in item['results'].values()):
+            raise ValueError(f"所有抽取渠道都失败: {errors}")
+
+    def _stage_localize(self, item):
+        if item['results'].get('markdown') is not None:
+            ai.extract_text_locations(item['task_id'])
+        result_cache.save_field_diff(item['task_id'])
+        events.publish(item['task_id'], events.EVENT_DONE,
+                       {"channels": {k: v is not None for k, v in item['results'].items()}})
+
+    # ---- 状态 ----
+
+    def _update_task(self, item, stage, status, error=None, duration=None, finished_stage=None):
+        with self._lock:
+            batch = self.batches[item['batch_id']]
+            task = batch['tasks'][item['index']]
+            if duration is not None:
+                task['timings'][finished_stage or stage] = round(duration, 3)
+            task['stage'] = stage
+            task['status'] = status
+            if error is not None:
+                task['error'] = str(error)
+            batch['_dirty'] = True
+        self._save(batch)
+
+    def _task_finished(self, item):
+        with self._lock:
+            batch = self.batches.get(item['batch_id'])
+            # 只有最后一个阶段完成或任一阶段失败时任务状态才会是done/failed；
+            # 最后几个任务同时结束时，只有第一个看到全部完成的线程负责保存和移出内存
+            finished = batch is not None and batch['status'] != JOB_DONE and \
+                all(task['status'] in (JOB_DONE, JOB_FAILED) for task in batch['tasks'])
+            if finished:
+                batch['status'] = JOB_DONE
+                batch['finished_at'] = time.time()
+        if finished:
+            self._save(batch, force=True)
+            # 完成的批次只从状态文件读取，不再占用内存
+            with self._lock:
+                self.batches.pop(batch['batch_id'], None)
+            if batch['archive_path'] and os.path.exists(batch['archive_path']):
+                os.remove(batch['archive_path'])
+        # 批次的状态保存完之后才计为完成，drain返回时所有批次都已落盘
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def drain(self, timeout=None):
+        """
+        停止服务前调用：不再接受新批次，等待流水线中的任务处理完
+
+        批次中的任务只保存在内存中，进程退出后不会恢复，所以需要等待它们完成
+
+        返回:
+            超时后仍未完成的任务数
+        """
+        with self._lock:
+            self._draining = True
+            if self._pending:
+                log.info("等待批量流水线中的任务完成", extra={"tasks": self._pending, "timeout": timeout})
+            self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+            return self._pending
+
+    def _save(self, batch, force=False):
+        """持久化批次状态，大批次时每秒最多写一次"""
+        now = time.time()
+        with self._lock:
+            if not force and (not batch['_dirty'] or now - batch['_saved_at'] < 1):
+                return
+            data = {key: value for key, value in batch.items() if not key.startswith('_')}
+            batch['_dirty'] = False
+            batch['_saved_at'] = now
+            data = json.loads(json.dumps(data))
+        atomic_write_json(os.path.join(self.batches_folder, f"{batch['batch_id']}.json"), data)
+
+    def _load(self, batch_id):
+        with self._lock:
+            batch = self.batches.get(batch_id)
+            if batch is not None:
+                return {key: value for key, value in batch.items() if not key.startswith('_')}
+        if not batch_id or os.path.basename(batch_id) != batch_id:
+            return None
+        try:
+            with open(os.path.join(self.batches_folder, f"{batch_id}.json"), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def summary(self, batch_id, include_tasks=False):
+        """
+        批次的汇总进度
+
+        返回:
+            各阶段排队/执行中/完成/失败的任务数，include_tasks为True时附带每个任务的状态
+        """
+        batch = self._load(batch_id)
+        if batch is None:
+            return None
+        with self._lock:
+            tasks = [dict(task) for task in batch['tasks']]
+        stages = {stage: {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0} for stage in STAGES}
+        for task in tasks:
+            stage_index = STAGES.index(task['stage'])
+            for stage in STAGES[:stage_index]:
+                stages[stage][JOB_DONE] += 1
+            stages[task['stage']][task['status']] += 1
+        result = {
+            'batch_id': batch['batch_id'],
+            'status': batch['status'],
+            'created_at': batch['created_at'],
+            'finished_at': batch['finished_at'],
+            'total': len(tasks),
+            'succeeded': sum(1 for task in tasks if task['status'] == JOB_DONE and task['stage'] == STAGES[-1]),
+            'failed': sum(1 for task in tasks if task['status'] == JOB_FAILED),
+            'stages': stages
+        }
+        if include_tasks:
+            result['tasks'] = tasks
+        return result
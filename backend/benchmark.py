@@ -0,0 +1,679 @@
+"""
+抽取流水线基准测试
+
+用本地的替身代替方舟大模型接口和VisualService.ocr_pdf（可配置延迟、错误率和响应大小），
+按uploads/、parse_results/、extract_results/和schema/中的示例生成合成任务，
+测量document_parse、process_with_ai、extract_text_locations和列表接口的吞吐量、
+p50/p99延迟、峰值内存及各阶段耗时，结果输出为JSON，便于比较不同版本。
+
+用法:
+    python benchmark.py run --tasks 20 --concurrency 4 --output bench.json
+    python benchmark.py compare baseline.json bench.json
+    python benchmark.py imports
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import statistics
+import functools
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from config import Config
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ('parse', 'extract', 'localize', 'listing')
+# 写入合成schema的标记，替身接口据此返回对应示例的抽取结果
+SAMPLE_MARKER = 'x-bench-sample'
+_SAMPLE_MARKER_RE = re.compile(r'"%s": "([^"]+)"' % SAMPLE_MARKER)
+# 基准测试期间重定向到临时目录的数据目录
+DATA_FOLDERS = ('UPLOAD_FOLDER', 'EXTRACT_RESULTS_FOLDER', 'PARSE_RESULTS_FOLDER', 'RESULTS_FOLDER',
+                'SCHEMA_FOLDER', 'SCHEMA_VERSIONS_FOLDER', 'OCR_CACHE_FOLDER', 'IMAGE_CACHE_FOLDER',
+                'JOBS_FOLDER', 'BATCHES_FOLDER', 'EVENTS_FOLDER')
+# 导入耗时检查的模块，以及导入后不应加载的重量级依赖（第一次调用外部接口或处理图片时才加载）
+IMPORT_MODULES = ('ai', 'pipeline', 'app')
+# 各模块导入耗时中位数的默认上限（毫秒），约为开发机实测值（ai/pipeline约65ms，app约240ms）的3倍，
+# 留出构建机器较慢的余量；导入时加载了重量级依赖会另外检查出来
+IMPORT_BUDGETS_MS = {'ai': 250, 'pipeline': 250, 'app': 800}
+HEAVY_MODULES = ('volcenginesdkarkruntime', 'volcengine', 'httpx', 'PIL', 'pypdfium2')
+# 在新的子进程中执行：数据目录重定向到临时目录后导入模块，输出导入耗时和已加载的重量级依赖
+_IMPORT_PROBE = '''
+import sys, json, time
+import benchmark
+benchmark.configure_data_folders(sys.argv[2])
+start = time.perf_counter()
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": round(elapsed * 1000, 1),
+                  "heavy": [name for name in benchmark.HEAVY_MODULES if name in sys.modules]}))
+'''
+
+
+def configure_data_folders(workdir):
+    """把数据目录、目录数据库和大模型缓存重定向到workdir，必须在导入ai/app等模块之前调用"""
+    for attribute in DATA_FOLDERS:
+        path = os.path.join(workdir, attribute.lower().replace('_folder', ''))
+        os.makedirs(path, exist_ok=True)
+        setattr(Config, attribute, path)
+    Config.CATALOG_PATH = os.path.join(workdir, 'catalog', 'catalog.sqlite3')
+    Config.LLM_CACHE_PATH = os.path.join(workdir, 'llm_cache', 'responses.sqlite3')
+
+
+def percentile(values, p):
+    """和ApiGuard.stats相同的分位数算法"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _latency_summary(seconds):
+    """耗时列表（秒） -> 毫秒统计"""
+    if not seconds:
+        return {"count": 0}
+    return {
+        "count": len(seconds),
+        "total_s": round(sum(seconds), 4),
+        "mean_ms": round(sum(seconds) / len(seconds) * 1000, 2),
+        "p50_ms": round(percentile(seconds, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 2),
+        "max_ms": round(max(seconds) * 1000, 2)
+    }
+
+
+def _peak_rss_mb():
+    # Linux下ru_maxrss的单位是KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+# ---- 示例数据 ----
+
+def load_samples():
+    """
+    读取同时具有上传文件、解析结果、抽取结果和schema的示例
+
+    返回:
+        {示例名: {"upload", "pages", "markdown_result", "multimodal_result", "schema"}}
+    """
+    samples = {}
+    upload_root = os.path.join(BACKEND_DIR, 'uploads')
+    for name in sorted(os.listdir(upload_root)):
+        folder = os.path.join(upload_root, name)
+        parse_folder = os.path.join(BACKEND_DIR, 'parse_results', name)
+        result_folder = os.path.join(BACKEND_DIR, 'extract_results', name)
+        schema_path = os.path.join(BACKEND_DIR, 'schema', f"{name}.json")
+        if not (os.path.isdir(folder) and os.path.isdir(parse_folder) and os.path.isdir(result_folder)
+                and os.path.exists(schema_path)):
+            continue
+        uploads = sorted(f for f in os.listdir(folder) if not f.startswith('.'))
+        parses = sorted(f for f in os.listdir(parse_folder) if f.endswith('.json'))
+        if not uploads or not parses:
+            continue
+        sample = {"upload": os.path.join(folder, uploads[0])}
+        with open(os.path.join(parse_folder, parses[0]), 'r', encoding='utf-8') as f:
+            sample["pages"] = json.load(f)
+        for channel in ('markdown_result', 'multimodal_result'):
+            with open(os.path.join(result_folder, f"{channel}.json"), 'r', encoding='utf-8') as f:
+                sample[channel] = json.load(f)
+        with open(schema_path, 'r', encoding='utf-8') as f:
+            sample["schema"] = json.load(f)
+        samples[name] = sample
+    return samples
+
+
+def scale_fields(data, scale):
+    """把每个顶层字段复制scale-1份（字段名加后缀），放大schema和响应的大小"""
+    scaled = dict(data)
+    for copy in range(1, scale):
+        for key, value in data.items():
+            scaled[f"{key}_{copy}"] = value
+    return scaled
+
+
+def scale_schema(schema, scale, sample_name):
+    scaled = dict(schema, properties=scale_fields(schema.get('properties', {}), scale))
+    required = schema.get('required', [])
+    scaled['required'] = required + [f"{key}_{copy}" for copy in range(1, scale) for key in required]
+    scaled[SAMPLE_MARKER] = sample_name
+    return scaled
+
+
+def scale_pages(pages, count):
+    """把示例的页面重复count次，作为多页文档的解析结果"""
+    return [dict(page, page_id=i) for i, page in enumerate(pages * count)]
+
+
+# ---- 接口替身 ----
+
+class _Stub:
+    """替身接口的公共部分：按正态分布模拟延迟，按错误率注入失败"""
+
+    def __init__(self, latency_ms, jitter, error_rate, seed):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def _simulate(self):
+        """等待模拟的延迟，返回是否注入错误"""
+        with self._lock:
+            delay = max(0.0, self._random.gauss(self.latency, self.latency * self.jitter))
+            failed = self._random.random() < self.error_rate
+            self.calls += 1
+            self.errors += int(failed)
+        time.sleep(delay)
+        return failed
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.errors = 0
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors}
+
+
+class StubArk(_Stub):
+    """
+    方舟客户端替身，只实现client.chat.completions.create
+
+    从提示词中的schema标记找到对应示例，返回示例的抽取结果（按fields_scale放大），
+    多模态请求返回multimodal_result，文本请求返回markdown_result；注入的错误为429。
+    stream=True时按STREAM_CHUNK_CHARS切分成流式chunk返回，最后一个chunk只带用量。
+    """
+
+    STREAM_CHUNK_CHARS = 64
+
+    def __init__(self, samples, fields_scale, latency_ms, jitter, error_rate, seed):
+        super().__init__(latency_ms, jitter, error_rate, seed)
+        self.samples = samples
+        self.fields_scale = fields_scale
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **params):
+        import httpx
+        from volcenginesdkarkruntime._exceptions import ArkAPIStatusError
+        from prompt_builder import estimate_tokens
+
+        if self._simulate():
+            request = httpx.Request("POST", "https://ark.stub/api/v3/chat/completions")
+            raise ArkAPIStatusError("stub rate limited", response=httpx.Response(429, request=request),
+                                    body=None, request_id="benchmark")
+
+        texts, images = [], 0
+        for message in messages:
+            if isinstance(message["content"], str):
+                texts.append(message["content"])
+                continue
+            for part in message["content"]:
+                if part.get("type") == "text":
+                    texts.append(part["text"])
+                else:
+                    images += 1
+        prompt = "\n".join(texts)
+        match = _SAMPLE_MARKER_RE.search(prompt)
+        if match and match.group(1) in self.samples:
+            channel = 'multimodal_result' if images else 'markdown_result'
+            data = scale_fields(self.samples[match.group(1)][channel], self.fields_scale)
+        else:
+            data = {}
+        content = f"```json\n{json.dumps(data, ensure_ascii=False, indent=2)}\n```"
+        prompt_tokens = estimate_tokens(prompt) + images * 1000
+        completion_tokens = estimate_tokens(content)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+        if params.get("stream"):
+            return self._stream(content, usage)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage)
+
+    def _stream(self, content, usage):
+        for start in range(0, len(content), self.STREAM_CHUNK_CHARS):
+            delta = SimpleNamespace(content=content[start:start + self.STREAM_CHUNK_CHARS])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+class StubVisualService(_Stub):
+    """VisualService替身，只实现ocr_pdf；按图片内容前缀找到示例，返回示例解析结果重复pages次"""
+
+    def __init__(self, samples, pages, latency_ms, jitter, error_rate, seed):
+        super().__init__(latency_ms, jitter, error_rate, seed)
+        from storage import file_base64
+        self.pages = pages
+        self.responses = {}
+        for sample in samples.values():
+            detail = scale_pages(sample["pages"], pages)
+            self.responses[file_base64(sample["upload"])[:64]] = {
+                "detail": json.dumps(detail, ensure_ascii=False),
+                "markdown": "\n\n".join(page.get("page_md", "") for page in detail)
+            }
+
+    def ocr_pdf(self, form):
+        if self._simulate():
+            return {"code": 50429, "message": "stub rate limited"}
+        data = self.responses.get(form["image_base64"][:64])
+        if data is None:
+            return {"code": 50400, "message": "unknown stub document"}
+        return {"code": 10000, "data": data}
+
+
+# ---- 各阶段计时 ----
+
+class StageTimer:
+    """替换模块中的函数，记录每次调用的耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def wrap(self, owner, name, stage):
+        original = getattr(owner, name)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.samples[stage].append(elapsed)
+
+        setattr(owner, name, timed)
+
+    def reset(self):
+        with self._lock:
+            self.samples = defaultdict(list)
+
+    def summary(self):
+        with self._lock:
+            return {stage: _latency_summary(values) for stage, values in sorted(self.samples.items())}
+
+
+# ---- 基准测试 ----
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.samples = load_samples()
+        if not self.samples:
+            raise SystemExit("没有找到完整的示例数据（uploads/parse_results/extract_results/schema）")
+        self.sample_names = sorted(self.samples)
+        self.workdir = args.workdir or tempfile.mkdtemp(prefix='bench_')
+        self._configure()
+
+        # 数据目录和缓存配置必须在导入各模块之前修改，模块级的缓存和目录实例在导入时创建
+        import ai
+        import pipeline
+        import app as flask_app
+        from catalog import catalog
+        from result_cache import result_cache
+        from image_prep import image_preprocessor
+        self.ai = ai
+        self.pipeline = pipeline
+        self.app = flask_app.app
+        self.catalog = catalog
+        self.result_cache = result_cache
+        self.image_preprocessor = image_preprocessor
+
+        self.ark = StubArk(self.samples, args.fields_scale, args.ark_latency, args.jitter,
+                           args.ark_error_rate, args.seed)
+        self.ocr = StubVisualService(self.samples, args.pages, args.ocr_latency, args.jitter,
+                                     args.ocr_error_rate, args.seed + 1)
+        ai.client = self.ark
+        ai.visual_service = self.ocr
+
+        self.timer = StageTimer()
+        for owner, name, stage in (
+                (ai, '_ocr_page_range', 'ocr'),
+                (ai, 'document_parse', 'document_parse'),
+                (ai, '_create_completion', 'llm'),
+                (ai, '_parse_json_output', 'json_extract'),
+                (ai, 'chat_completion', 'chat_completion'),
+                (ai, 'multimodal_completion', 'multimodal_completion'),
+                (ai, 'process_multiple_files', 'markdown_channel'),
+                (ai, 'extract_text_locations', 'localize'),
+                (result_cache, 'save_field_diff', 'field_diff'),
+                (image_preprocessor, 'prepare', 'image_prep')):
+            self.timer.wrap(owner, name, stage)
+        self._task_count = 0
+
+    def _configure(self):
+        configure_data_folders(self.workdir)
+        Config.LLM_CACHE_BACKEND = self.args.llm_cache
+        # 逐请求的info日志会干扰计时和进度输出，未显式指定LOG_LEVEL时只输出警告
+        Config.LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING')
+        # 替身接口不需要真实的密钥，避免读取.env
+        for key in ('ARK_API_KEY', 'VOLC_ACCESSKEY', 'VOLC_SECRETKEY'):
+            os.environ.setdefault(key, 'benchmark')
+
+    def create_tasks(self, prefix, count):
+        """
+        生成合成任务：上传文件为示例文件加上唯一后缀（内容哈希不同，不会命中缓存），
+        schema为示例schema按fields_scale放大
+
+        返回:
+            [(任务ID, 文件ID, 示例名, schema), ...]
+        """
+        tasks = []
+        for i in range(count):
+            name = self.sample_names[(self._task_count + i) % len(self.sample_names)]
+            sample = self.samples[name]
+            task_id = f"{prefix}_{self._task_count + i:05d}"
+            filename = os.path.basename(sample["upload"])
+            with open(sample["upload"], 'rb') as f:
+                content = f.read() + f"\n<benchmark {task_id}>".encode('ascii')
+            upload_path = os.path.join(Config.UPLOAD_FOLDER, task_id, filename)
+            os.makedirs(os.path.dirname(upload_path), exist_ok=True)
+            with open(upload_path, 'wb') as f:
+                f.write(content)
+            self.catalog.record_document(task_id, filename, len(content))
+
+            schema = scale_schema(sample["schema"], self.args.fields_scale, name)
+            with open(os.path.join(Config.SCHEMA_FOLDER, f"{task_id}.json"), 'w', encoding='utf-8') as f:
+                json.dump(schema, f, ensure_ascii=False)
+            tasks.append((task_id, f"{task_id}/{filename}", name, schema))
+        self._task_count += count
+        return tasks
+
+    def _run(self, items, func):
+        """以args.concurrency个线程执行func(item)，func返回假值或抛出异常记为失败"""
+        def timed(item):
+            start = time.perf_counter()
+            try:
+                ok = bool(func(item))
+            except Exception as e:
+                print(f"基准测试调用失败: {e}")
+                ok = False
+            return time.perf_counter() - start, ok
+
+        self.timer.reset()
+        self.ark.reset()
+        self.ocr.reset()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            outcomes = list(executor.map(timed, items))
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency for latency, _ in outcomes]
+        return {
+            "operations": len(outcomes),
+            "errors": sum(1 for _, ok in outcomes if not ok),
+            "elapsed_s": round(elapsed, 4),
+            "throughput_per_s": round(len(outcomes) / elapsed, 3) if elapsed else None,
+            "latency": _latency_summary(latencies),
+            "peak_rss_mb": _peak_rss_mb(),
+            "stages": self.timer.summary(),
+            "stubs": {"ark": self.ark.stats(), "ocr": self.ocr.stats()}
+        }
+
+    def scenario_parse(self):
+        """document_parse：OCR替身 + 结果合并、保存和文本块索引"""
+        tasks = self.create_tasks('parse', self.args.tasks)
+        return self._run([file_id for _, file_id, _, _ in tasks],
+                         lambda file_id: self.ai.document_parse(file_id) is not None)
+
+    def scenario_extract(self):
+        """process_with_ai：OCR、两个抽取渠道、原文定位和字段比对的完整流程"""
+        tasks = self.create_tasks('extract', self.args.tasks)
+
+        def extract(task):
+            task_id, _, _, schema = task
+            results = self.pipeline.run_extraction_job(task_id, schema, ["markdown", "multi-modal"], None)
+            return any(result is not None for result in results.values())
+        return self._run(tasks, extract)
+
+    def scenario_localize(self):
+        """extract_text_locations：直接写入示例的解析结果和抽取结果，只测量定位"""
+        tasks = self.create_tasks('localize', self.args.tasks)
+        for task_id, file_id, name, _ in tasks:
+            sample = self.samples[name]
+            base_name = os.path.splitext(os.path.basename(file_id))[0]
+            parse_path = os.path.join(Config.PARSE_RESULTS_FOLDER, task_id, f"{base_name}.json")
+            os.makedirs(os.path.dirname(parse_path), exist_ok=True)
+            with open(parse_path, 'w', encoding='utf-8') as f:
+                json.dump(scale_pages(sample["pages"], self.args.pages), f, ensure_ascii=False)
+            self.ai.save_extract_result(
+                os.path.join(Config.EXTRACT_RESULTS_FOLDER, task_id, 'markdown_result.json'),
+                scale_fields(sample["markdown_result"], self.args.fields_scale))
+        return self._run([task_id for task_id, _, _, _ in tasks],
+                         lambda task_id: self.ai.extract_text_locations(task_id) is not None)
+
+    def scenario_listing(self):
+        """列表和结果接口：/api/tasks、/api/documents/<task_id>、/api/multi-channel-results/<task_id>"""
+        self.create_tasks('listing', self.args.catalog_tasks)
+        task_ids = [row['task_id'] for row in self.catalog.list_tasks(limit=None)[0]]
+        rng = random.Random(self.args.seed)
+        paths = []
+        for i in range(self.args.list_requests):
+            kind = i % 3
+            task_id = rng.choice(task_ids)
+            if kind == 0:
+                offset = rng.randrange(max(1, len(task_ids) - 50))
+                paths.append(f"/api/tasks?scope=all&details=1&limit=50&offset={offset}")
+            elif kind == 1:
+                paths.append(f"/api/documents/{task_id}")
+            else:
+                paths.append(f"/api/multi-channel-results/{task_id}")
+        local = threading.local()
+
+        def request(path):
+            if not hasattr(local, 'client'):
+                local.client = self.app.test_client()
+            return local.client.get(path).status_code == 200
+        return self._run(paths, request)
+
+    def run(self):
+        scenarios = {}
+        for name in self.args.scenarios:
+            print(f"运行基准测试场景: {name}")
+            scenarios[name] = getattr(self, f"scenario_{name}")()
+            print(f"  吞吐量 {scenarios[name]['throughput_per_s']}/s，"
+                  f"p50 {scenarios[name]['latency'].get('p50_ms')}ms，p99 {scenarios[name]['latency'].get('p99_ms')}ms")
+        from resilience import guard_stats
+        return {
+            "benchmark": "extraction-pipeline",
+            "started_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "parameters": {k: v for k, v in vars(self.args).items() if k not in ('command', 'output', 'workdir', 'keep')},
+            "scenarios": scenarios,
+            "guards": guard_stats(),
+            "caches": {
+                "result_cache": self.result_cache.stats(),
+                "image_prep": self.image_preprocessor.stats()
+            }
+        }
+
+    def close(self):
+        if not self.args.keep and not self.args.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def measure_imports(modules, repeat):
+    """
+    在新的子进程中分别导入各模块，测量冷启动的导入耗时
+
+    返回:
+        {模块名: {"median_ms", "min_ms", "max_ms", "heavy_modules"}}
+    """
+    results = {}
+    for module in modules:
+        samples, heavy = [], set()
+        for _ in range(repeat):
+            workdir = tempfile.mkdtemp(prefix='bench_import_')
+            try:
+                completed = subprocess.run([sys.executable, '-c', _IMPORT_PROBE, module, workdir], cwd=BACKEND_DIR,
+                                           capture_output=True, text=True, timeout=120,
+                                           env=dict(os.environ, LOG_LEVEL='WARNING'))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            if completed.returncode != 0:
+                raise SystemExit(f"导入{module}失败:\n{completed.stderr}")
+            probe = json.loads(completed.stdout.strip().splitlines()[-1])
+            samples.append(probe["ms"])
+            heavy.update(probe["heavy"])
+        results[module] = {
+            "median_ms": round(statistics.median(samples), 1),
+            "min_ms": min(samples),
+            "max_ms": max(samples),
+            "heavy_modules": sorted(heavy)
+        }
+    return results
+
+
+def check_imports(results, budget_ms=None):
+    """
+    打印各模块的导入耗时
+
+    参数:
+        budget_ms: 所有模块共用的导入耗时上限，None时使用IMPORT_BUDGETS_MS中各模块的上限
+
+    返回:
+        导入耗时中位数超过上限或导入时加载了重量级依赖的模块列表
+    """
+    violations = []
+    print(f"{'模块':<12}{'中位数(ms)':>12}{'最小(ms)':>12}{'最大(ms)':>12}  重量级依赖")
+    for module, result in results.items():
+        print(f"{module:<12}{result['median_ms']:>12}{result['min_ms']:>12}{result['max_ms']:>12}"
+              f"  {', '.join(result['heavy_modules']) or '-'}")
+        if result['heavy_modules']:
+            violations.append(f"{module}(加载了{', '.join(result['heavy_modules'])})")
+        else:
+            budget = budget_ms if budget_ms is not None else IMPORT_BUDGETS_MS.get(module)
+            if budget is not None and result['median_ms'] > budget:
+                violations.append(f"{module}({result['median_ms']}ms > {budget}ms)")
+    return violations
+
+
+def compare(baseline_path, current_path, threshold):
+    """
+    比较两次基准测试结果，打印各场景吞吐量和延迟的变化
+
+    返回:
+        吞吐量下降或p99延迟上升超过threshold（比例）的场景列表
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+
+    def change(old, new):
+        if not old or new is None:
+            return None
+        return (new - old) / old
+
+    regressions = []
+    print(f"{'场景':<10}{'指标':<18}{'基线':>12}{'当前':>12}{'变化':>10}")
+    for name in sorted(set(baseline["scenarios"]) & set(current["scenarios"])):
+        old, new = baseline["scenarios"][name], current["scenarios"][name]
+        metrics = (
+            ("throughput_per_s", old["throughput_per_s"], new["throughput_per_s"], -1),
+            ("p50_ms", old["latency"].get("p50_ms"), new["latency"].get("p50_ms"), 1),
+            ("p99_ms", old["latency"].get("p99_ms"), new["latency"].get("p99_ms"), 1),
+            ("peak_rss_mb", old["peak_rss_mb"], new["peak_rss_mb"], 1),
+        )
+        for metric, old_value, new_value, worse in metrics:
+            delta = change(old_value, new_value)
+            print(f"{name:<10}{metric:<18}{old_value!s:>12}{new_value!s:>12}"
+                  f"{'' if delta is None else f'{delta:+.1%}':>10}")
+            if delta is not None and metric in ("throughput_per_s", "p99_ms") and delta * worse > threshold:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="抽取流水线基准测试")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="运行基准测试")
+    run.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    run.add_argument('--tasks', type=int, default=20, help="parse/extract/localize场景的任务数")
+    run.add_argument('--concurrency', type=int, default=4, help="同时执行的任务或请求数")
+    run.add_argument('--pages', type=int, default=1, help="每个文档的页数（示例页面重复的次数）")
+    run.add_argument('--fields-scale', type=int, default=1, help="schema字段和模型响应放大的倍数")
+    run.add_argument('--ark-latency', type=float, default=800, help="大模型替身的平均延迟（毫秒）")
+    run.add_argument('--ocr-latency', type=float, default=1500, help="OCR替身的平均延迟（毫秒）")
+    run.add_argument('--jitter', type=float, default=0.2, help="延迟的标准差占平均值的比例")
+    run.add_argument('--ark-error-rate', type=float, default=0.0, help="大模型替身返回429的比例")
+    run.add_argument('--ocr-error-rate', type=float, default=0.0, help="OCR替身返回限流错误的比例")
+    run.add_argument('--catalog-tasks', type=int, default=200, help="listing场景额外生成的任务数")
+    run.add_argument('--list-requests', type=int, default=300, help="listing场景的请求数")
+    run.add_argument('--llm-cache', default='none', choices=('none', 'memory', 'sqlite'), help="大模型响应缓存后端")
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--workdir', help="数据目录，默认使用临时目录并在结束后删除")
+    run.add_argument('--keep', action='store_true', help="保留临时数据目录")
+    run.add_argument('--output', help="结果JSON的保存路径，默认输出到标准输出")
+
+    diff = commands.add_parser('compare', help="比较两次基准测试结果")
+    diff.add_argument('baseline')
+    diff.add_argument('current')
+    diff.add_argument('--threshold', type=float, default=0.1, help="判定为退化的变化比例")
+
+    imports = commands.add_parser('imports', help="测量模块的冷启动导入耗时，检查是否加载了重量级依赖")
+    imports.add_argument('--modules', nargs='+', default=list(IMPORT_MODULES))
+    imports.add_argument('--repeat', type=int, default=5, help="每个模块导入的次数（每次一个新进程）")
+    imports.add_argument('--budget-ms', type=float, default=None,
+                         help="所有模块导入耗时中位数的上限（毫秒），默认使用IMPORT_BUDGETS_MS中各模块的上限")
+    imports.add_argument('--output', help="结果JSON的保存路径")
+
+    args = parser.parse_args(argv)
+    if args.command == 'imports':
+        results = measure_imports(args.modules, args.repeat)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({"python": platform.python_version(), "git_commit": _git_commit(), "imports": results},
+                          f, ensure_ascii=False, indent=2)
+        violations = check_imports(results, args.budget_ms)
+        if violations:
+            print(f"导入耗时超出预算: {', '.join(violations)}")
+            return 1
+        return 0
+    if args.command == 'compare':
+        regressions = compare(args.baseline, args.current, args.threshold)
+        if regressions:
+            print(f"性能退化: {', '.join(regressions)}")
+            return 1
+        return 0
+
+    benchmark = Benchmark(args)
+    try:
+        report = benchmark.run()
+    finally:
+        benchmark.close()
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"基准测试结果已保存到: {args.output}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from config import Config
+
+# 任务状态
+TASK_UPLOADED = 'uploaded'
+TASK_EXTRACTING = 'extracting'
+TASK_EXTRACTED = 'extracted'
+TASK_FAILED = 'failed'
+TASK_REVIEWED = 'reviewed'
+
+# 旧版比对页面的比对数据文件（RESULTS_FOLDER/<task_id>_multi_channel.json）
+COMPARISON_SUFFIX = '_multi_channel.json'
+
+# 列表接口允许的排序字段
+TASK_SORT_FIELDS = ('created_at', 'updated_at', 'task_id', 'file_count', 'total_size')
+DOCUMENT_SORT_FIELDS = ('upload_time', 'filename', 'size')
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
+
+
+def _file_type(filename):
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    return 'application/pdf' if extension == 'pdf' else f'image/{extension}'
+
+
+class TaskCatalog:
+    """
+    任务和文档元数据目录
+
+    上传、抽取和保存核对结果时同步更新sqlite中的记录，列表接口只查询带索引的表，
+    不再遍历上传目录。启动时用reconcile补齐磁盘上有而目录中没有的任务和文件（例如手工拷贝的文件、
+    升级前已有的任务）；需要完全按磁盘重建（包括删除已不存在的文件）时使用rebuild。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or Config.CATALOG_PATH
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "task_id TEXT PRIMARY KEY, status TEXT NOT NULL, schema TEXT, error TEXT, "
+                "file_count INTEGER NOT NULL DEFAULT 0, total_size INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+                "comparison INTEGER NOT NULL DEFAULT 0)")
+            # 早期版本的目录没有comparison列，由启动时的reconcile补齐
+            columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(tasks)")}
+            if 'comparison' not in columns:
+                self._conn.execute("ALTER TABLE tasks ADD COLUMN comparison INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "file_id TEXT PRIMARY KEY, task_id TEXT NOT NULL, filename TEXT NOT NULL, "
+                "file_type TEXT NOT NULL, size INTEGER NOT NULL, sha256 TEXT, upload_time REAL NOT NULL)")
+            for statement in (
+                "CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at)",
+                "CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks (updated_at)",
+                "CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, created_at)",
+                "CREATE INDEX IF NOT EXISTS idx_tasks_schema ON tasks (schema, created_at)",
+                "CREATE INDEX IF NOT EXISTS idx_tasks_comparison ON tasks (comparison, created_at)",
+                "CREATE INDEX IF NOT EXISTS idx_documents_task ON documents (task_id, upload_time)",
+            ):
+                self._conn.execute(statement)
+
+    # ---- 写入 ----
+
+    def _ensure_task(self, task_id, now, created_at=None):
+        self._conn.execute(
+            "INSERT OR IGNORE INTO tasks (task_id, status, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (task_id, TASK_UPLOADED, created_at or now, now))
+
+    def _refresh_counts(self, task_id):
+        self._conn.execute(
+            "UPDATE tasks SET file_count = (SELECT COUNT(*) FROM documents WHERE task_id = ?), "
+            "total_size = (SELECT COALESCE(SUM(size), 0) FROM documents WHERE task_id = ?) WHERE task_id = ?",
+            (task_id, task_id, task_id))
+
+    def ensure_task(self, task_id):
+        """创建任务记录，已存在时不做任何修改"""
+        with self._lock, self._conn:
+            self._ensure_task(task_id, time.time())
+
+    def record_document(self, task_id, filename, size, sha256=None, upload_time=None):
+        """
+        记录上传的文件，同名文件覆盖原记录
+
+        参数:
+            task_id: 任务ID，直接放在上传目录根下的文件为空字符串
+            filename: 文件名
+            size: 文件大小（字节）
+            sha256: 文件内容哈希
+        """
+        now = time.time()
+        file_id = f"{task_id}/{filename}" if task_id else filename
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (file_id, task_id, filename, file_type, size, sha256, upload_time) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_id, task_id, filename, _file_type(filename), size, sha256, upload_time or now))
+            if task_id:
+                self._ensure_task(task_id, now)
+                self._refresh_counts(task_id)
+                self._conn.execute("UPDATE tasks SET updated_at = ? WHERE task_id = ?", (now, task_id))
+
+    def update_task(self, task_id, status=None, schema=None, error=None):
+        """更新任务状态或schema名称，任务不存在时先创建"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._ensure_task(task_id, now)
+            if status is not None:
+                self._conn.execute("UPDATE tasks SET status = ?, error = ? WHERE task_id = ?",
+                                   (status, str(error) if error else None, task_id))
+            if schema is not None:
+                self._conn.execute("UPDATE tasks SET schema = ? WHERE task_id = ?", (schema, task_id))
+            self._conn.execute("UPDATE tasks SET updated_at = ? WHERE task_id = ?", (now, task_id))
+
+    def mark_reviewed(self, task_id):
+        """保存人工核对结果后调用，只更新已存在的任务"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE tasks SET status = ?, error = NULL, updated_at = ? WHERE task_id = ?",
+                               (TASK_REVIEWED, time.time(), task_id))
+
+    # ---- 查询 ----
+
+    def get_task(self, task_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_tasks(self, status=None, schema=None, since=None, until=None, comparison=None,
+                   sort='created_at', descending=True, limit=None, offset=0):
+        """
+        分页列出任务
+
+        参数:
+            status/schema: 按状态、schema名称过滤
+            comparison: True时只列出有旧版比对数据（_multi_channel.json）的任务
+            since/until: 按创建时间（时间戳）过滤
+            sort: 排序字段，见TASK_SORT_FIELDS
+            descending: 是否倒序
+            limit/offset: 分页
+
+        返回:
+            (任务列表, 符合条件的总数)
+        """
+        conditions, params = [], []
+        for column, op, value in (('status', '=', status), ('schema', '=', schema),
+                                  ('created_at', '>=', since), ('created_at', '<', until),
+                                  ('comparison', '=', None if comparison is None else int(comparison))):
+            if value is not None:
+                conditions.append(f"{column} {op} ?")
+                params.append(value)
+        return self._page('tasks', conditions, params, sort, TASK_SORT_FIELDS, descending, limit, offset)
+
+    def list_documents(self, task_id='', sort='upload_time', descending=True, limit=None, offset=0):
+        """分页列出某个任务的文件，task_id为空字符串时列出上传目录根下的文件"""
+        return self._page('documents', ["task_id = ?"], [task_id], sort, DOCUMENT_SORT_FIELDS,
+                          descending, limit, offset)
+
+    def _page(self, table, conditions, params, sort, sort_fields, descending, limit, offset):
+        if sort not in sort_fields:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        # 排序字段相同时按主键排序，保证分页结果稳定
+        key = 'task_id' if table == 'tasks' else 'file_id'
+        direction = 'DESC' if descending else 'ASC'
+        query = f"SELECT * FROM {table}{where} ORDER BY {sort} {direction}, {key} {direction} LIMIT ? OFFSET ?"
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+            rows = self._conn.execute(query, params + [-1 if limit is None else limit, offset or 0]).fetchall()
+        return [dict(row) for row in rows], total
+
+    # ---- 对账 ----
+
+    def _scan(self, task_ids=None):
+        """
+        扫描上传目录和比对结果目录
+
+        参数:
+            task_ids: 只扫描这些任务，None表示全部（同时扫描上传目录根下的文件）
+
+        返回:
+            ({任务ID: 创建时间}, [文件记录, ...], 已核对的任务ID集合, 有比对数据的任务ID集合)
+        """
+        documents = []
+        tasks = {}
+
+        def add_task(task_id, created_at):
+            if task_id not in tasks or created_at < tasks[task_id]:
+                tasks[task_id] = created_at
+
+        if os.path.isdir(Config.UPLOAD_FOLDER):
+            for name in os.listdir(Config.UPLOAD_FOLDER):
+                path = os.path.join(Config.UPLOAD_FOLDER, name)
+                if os.path.isdir(path):
+                    if task_ids is not None and name not in task_ids:
+                        continue
+                    add_task(name, os.path.getctime(path))
+                    for filename in os.listdir(path):
+                        file_path = os.path.join(path, filename)
+                        if allowed_file(filename) and os.path.isfile(file_path):
+                            stat = os.stat(file_path)
+                            documents.append((f"{name}/{filename}", name, filename, _file_type(filename),
+                                              stat.st_size, None, stat.st_mtime))
+                elif task_ids is None and allowed_file(name):
+                    stat = os.stat(path)
+                    documents.append((name, '', name, _file_type(name), stat.st_size, None, stat.st_mtime))
+
+        # 只有比对数据的历史任务
+        reviewed = set()
+        comparisons = set()
+        if os.path.isdir(Config.RESULTS_FOLDER):
+            for filename in os.listdir(Config.RESULTS_FOLDER):
+                path = os.path.join(Config.RESULTS_FOLDER, filename)
+                if filename.endswith(COMPARISON_SUFFIX):
+                    task_id = filename[:-len(COMPARISON_SUFFIX)]
+                    if task_ids is None or task_id in task_ids:
+                        add_task(task_id, os.path.getctime(path))
+                        comparisons.add(task_id)
+                elif filename.endswith('_decision.json'):
+                    reviewed.add(filename[:-len('_decision.json')])
+        return tasks, documents, reviewed, comparisons
+
+    @staticmethod
+    def _schema_title(task_id):
+        try:
+            with open(os.path.join(Config.SCHEMA_FOLDER, f"{task_id}.json"), 'r', encoding='utf-8') as f:
+                return json.load(f).get('title')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    def _has_results(task_id):
+        folder = os.path.join(Config.EXTRACT_RESULTS_FOLDER, task_id)
+        return os.path.isdir(folder) and any(
+            name.endswith('.json') and name != 'op.json' for name in os.listdir(folder))
+
+    def _insert_task(self, task_id, created_at, reviewed, comparisons, previous, now):
+        """按磁盘上的结果推断状态并写入任务记录，previous中已有的schema、创建时间等优先"""
+        if task_id in reviewed:
+            status = TASK_REVIEWED
+        elif self._has_results(task_id):
+            status = TASK_EXTRACTED
+        else:
+            status = previous.get('status') if previous.get('status') == TASK_FAILED else TASK_UPLOADED
+        self._conn.execute(
+            "INSERT INTO tasks (task_id, status, schema, error, created_at, updated_at, comparison) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task_id, status, previous.get('schema') or self._schema_title(task_id),
+             previous.get('error') if status == TASK_FAILED else None,
+             previous.get('created_at', created_at), previous.get('updated_at', now),
+             int(task_id in comparisons)))
+        self._refresh_counts(task_id)
+
+    def reconcile(self, task_ids=None):
+        """
+        把磁盘上有而目录中没有的任务和文件补进目录，并更新任务是否有比对数据
+
+        已有的记录不做修改，也不删除磁盘上已经不存在的记录（需要时用rebuild）
+
+        参数:
+            task_ids: 只对账这些任务，None表示全部
+
+        返回:
+            {"tasks": 新增任务数, "documents": 新增文件数}
+        """
+        tasks, documents, reviewed, comparisons = self._scan(task_ids)
+        now = time.time()
+        with self._lock, self._conn:
+            known_tasks = {row['task_id'] for row in self._conn.execute("SELECT task_id FROM tasks")}
+            known_documents = {row['file_id'] for row in self._conn.execute("SELECT file_id FROM documents")}
+            new_documents = [document for document in documents if document[0] not in known_documents]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO documents (file_id, task_id, filename, file_type, size, sha256, upload_time) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", new_documents)
+            new_tasks = [task_id for task_id in tasks if task_id not in known_tasks]
+            for task_id in new_tasks:
+                self._insert_task(task_id, tasks[task_id], reviewed, comparisons, {}, now)
+            for task_id in {document[1] for document in new_documents if document[1]} - set(new_tasks):
+                self._refresh_counts(task_id)
+            self._conn.executemany("UPDATE tasks SET comparison = 1 WHERE task_id = ? AND comparison = 0",
+                                   [(task_id,) for task_id in comparisons])
+        return {"tasks": len(new_tasks), "documents": len(new_documents)}
+
+    def rebuild(self):
+        """
+        按磁盘上的目录重建目录记录
+
+        文件以上传目录为准；任务状态根据抽取结果和核对结果推断，
+        已有记录中的schema名称在没有新信息时保留。
+
+        返回:
+            {"tasks": 任务数, "documents": 文件数}
+        """
+        tasks, documents, reviewed, comparisons = self._scan()
+        now = time.time()
+        with self._lock, self._conn:
+            existing = {row['task_id']: dict(row) for row in self._conn.execute("SELECT * FROM tasks")}
+            self._conn.execute("DELETE FROM documents")
+            self._conn.execute("DELETE FROM tasks")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (file_id, task_id, filename, file_type, size, sha256, upload_time) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", documents)
+            for task_id, created_at in tasks.items():
+                self._insert_task(task_id, created_at, reviewed, comparisons, existing.get(task_id, {}), now)
+        return {"tasks": len(tasks), "documents": len(documents)}
+
+
+catalog = TaskCatalog()
+
+
+if __name__ == '__main__':
+    # python catalog.py rebuild|reconcile
+    if sys.argv[1:] == ['rebuild']:
+        print(f"目录已重建: {catalog.rebuild()}")
+    elif sys.argv[1:] == ['reconcile']:
+        print(f"目录已对账: {catalog.reconcile()}")
+    else:
+        print("用法: python catalog.py rebuild|reconcile")
+        sys.exit(1)
@@ -0,0 +1,120 @@
+import os
+import atexit
+import threading
+from config import Config
+from logger import get_logger
+
+log = get_logger('clients')
+
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _http2_enabled():
+    """HTTP/2需要安装h2，未安装时退回HTTP/1.1长连接"""
+    if not Config.ARK_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        log.warning("未安装h2，大模型接口使用HTTP/1.1")
+        return False
+
+
+def _load_env():
+    """关键环境变量不存在时加载.env文件"""
+    if not os.environ.get("ARK_API_KEY") or not os.environ.get("VOLC_ACCESSKEY"):
+        from dotenv import load_dotenv
+        load_dotenv()
+
+
+# 方舟SDK、火山引擎SDK和httpx导入耗时较长（合计约0.5秒），只在第一次创建客户端时导入，
+# 不调用外部接口的进程（worker启动、命令行工具、只做原文定位的请求）不需要加载
+
+def _create_ark_client():
+    import httpx
+    from volcenginesdkarkruntime import Ark
+
+    # 所有线程共享一个httpx连接池，保持长连接避免每次请求重新握手
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=Config.HTTP_POOL_MAX_CONNECTIONS,
+                            max_keepalive_connections=Config.HTTP_POOL_KEEPALIVE,
+                            keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(Config.ARK_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT),
+        http2=_http2_enabled(),
+        follow_redirects=True
+    )
+    # 重试由resilience.get_guard统一处理，关闭SDK自带的重试避免重复重试
+    return Ark(
+        api_key=os.environ.get("ARK_API_KEY"),
+        base_url=Config.ARK_BASE_URL,
+        timeout=Config.ARK_TIMEOUT,
+        max_retries=0,
+        http_client=http_client
+    )
+
+
+def _create_visual_service():
+    from requests.adapters import HTTPAdapter
+    from volcengine.visual.VisualService import VisualService
+
+    # VisualService是单例，每次实例化都会重建session，所以只在这里创建一次
+    visual_service = VisualService()
+    visual_service.set_ak(os.environ.get("VOLC_ACCESSKEY"))
+    visual_service.set_sk(os.environ.get("VOLC_SECRETKEY"))
+    visual_service.set_connection_timeout(Config.HTTP_CONNECT_TIMEOUT)
+    visual_service.set_socket_timeout(Config.OCR_TIMEOUT)
+    # 连接池大小和OCR并发数一致，各OCR线程复用长连接
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(Config.OCR_MAX_CONCURRENCY, 1))
+    visual_service.session.mount('https://', adapter)
+    visual_service.session.mount('http://', adapter)
+    return visual_service
+
+
+_factories = {
+    "ark": _create_ark_client,
+    "visual": _create_visual_service,
+}
+
+
+def get_client(name):
+    """
+    获取共享的外部接口客户端，第一次使用时创建，之后所有线程复用
+
+    参数:
+        name: "ark"（大模型）或 "visual"（OCR）
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                _load_env()
+                client = _clients[name] = _factories[name]()
+    return client
+
+
+def get_ark_client():
+    return get_client("ark")
+
+
+def get_visual_service():
+    return get_client("visual")
+
+
+@atexit.register
+def close_clients():
+    """关闭所有客户端的连接池"""
+    with _lock:
+        clients = list(_clients.items())
+        _clients.clear()
+    for name, client in clients:
+        try:
+            if name == "visual":
+                client.session.close()
+            else:
+                client.close()
+        except Exception as e:
+            log.warning("关闭客户端失败", extra={"client": name, "error": str(e)})
@@ -1,4 +1,5 @@
 import os
+import json
 
 class Config:
     DEBUG = False
@@ -8,6 +9,146 @@ class Config:
     PARSE_RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parse_results')
     RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
     SCHEMA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema')
+    SCHEMA_VERSIONS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema_versions')
+    OCR_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ocr_cache')
+    IMAGE_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_cache')
+    LLM_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_cache', 'responses.sqlite3')
+    JOBS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs')
+    BATCHES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batches')
+    CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog', 'catalog.sqlite3')
+    EVENTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'events')
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
     MARKDOWN_ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
-    MULTIMODAL_ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
\ No newline at end of file
+    MULTIMODAL_ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
+
+    # 日志：格式（json为每行一个JSON对象，text为便于阅读的单行文本）和级别，DEBUG级别输出各阶段耗时
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+    # 后台抽取任务线程数
+    JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 4))
+
+    # 抽取渠道并发线程数及单个渠道的超时时间（秒）
+    CHANNEL_MAX_WORKERS = int(os.environ.get('CHANNEL_MAX_WORKERS', 8))
+    CHANNEL_TIMEOUT = float(os.environ.get('CHANNEL_TIMEOUT', 300))
+
+    # OCR结果缓存总大小上限（字节），默认1GB
+    OCR_CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+    # 大模型响应缓存：后端（sqlite/memory/none）、有效期（秒，0表示不过期）及条目上限
+    LLM_CACHE_BACKEND = os.environ.get('LLM_CACHE_BACKEND', 'sqlite')
+    LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))
+    LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 10000))
+
+    # 文本模型抽取：模型上下文长度、输出token上限，以及提示词分块的安全余量、
+    # 单块最小内容token数和并发抽取的分块数
+    LLM_CONTEXT_TOKENS = int(os.environ.get('LLM_CONTEXT_TOKENS', 32768))
+    EXTRACT_MAX_TOKENS = int(os.environ.get('EXTRACT_MAX_TOKENS', 4096))
+    PROMPT_SAFETY_MARGIN = float(os.environ.get('PROMPT_SAFETY_MARGIN', 0.1))
+    PROMPT_MIN_CHUNK_TOKENS = int(os.environ.get('PROMPT_MIN_CHUNK_TOKENS', 2000))
+    PROMPT_CHUNK_WORKERS = int(os.environ.get('PROMPT_CHUNK_WORKERS', 4))
+
+    # 多文件任务的map-reduce抽取：EXTRACT_MAP_REDUCE=1 时每个文件单独并发抽取再合并，
+    # MAP_REDUCE_RECONCILE=1 时文件之间有冲突的字段再交给大模型裁决
+    EXTRACT_MAP_REDUCE = os.environ.get('EXTRACT_MAP_REDUCE', '0').lower() in ('1', 'true', 'yes')
+    MAP_REDUCE_WORKERS = int(os.environ.get('MAP_REDUCE_WORKERS', 4))
+    MAP_REDUCE_RECONCILE = os.environ.get('MAP_REDUCE_RECONCILE', '0').lower() in ('1', 'true', 'yes')
+    MAP_REDUCE_RECONCILE_MODEL = os.environ.get('MAP_REDUCE_RECONCILE_MODEL', 'doubao-1-5-pro-32k-250115')
+
+    # 图片预处理（需要Pillow）：最长边上限、重新编码的格式（JPEG/WEBP）和质量、是否纠偏及最大纠偏角度、
+    # 进程池大小；OCR_PREPROCESS=1 时OCR前也缩小图片（不纠偏，保证原文位置框和原图对齐）
+    IMAGE_PREP_ENABLED = os.environ.get('IMAGE_PREP_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    IMAGE_MAX_SIDE = int(os.environ.get('IMAGE_MAX_SIDE', 2048))
+    IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'JPEG')
+    IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 85))
+    IMAGE_DESKEW = os.environ.get('IMAGE_DESKEW', '1').lower() in ('1', 'true', 'yes')
+    IMAGE_DESKEW_MAX_ANGLE = float(os.environ.get('IMAGE_DESKEW_MAX_ANGLE', 5))
+    IMAGE_PREP_WORKERS = int(os.environ.get('IMAGE_PREP_WORKERS', 2))
+    OCR_PREPROCESS = os.environ.get('OCR_PREPROCESS', '0').lower() in ('1', 'true', 'yes')
+    OCR_IMAGE_MAX_SIDE = int(os.environ.get('OCR_IMAGE_MAX_SIDE', 4096))
+
+    # 预览图和分块图（需要Pillow，PDF页面还需要pypdfium2）：可选宽度、JPEG质量及分块边长
+    THUMBNAIL_WIDTHS = [int(w) for w in os.environ.get('THUMBNAIL_WIDTHS', '256,512,1024,2048').split(',')]
+    THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', 80))
+    TILE_SIZE = int(os.environ.get('TILE_SIZE', 512))
+
+    # 多页PDF按页码范围分块OCR：每块页数及同时进行的OCR请求数
+    OCR_PAGE_CHUNK_SIZE = int(os.environ.get('OCR_PAGE_CHUNK_SIZE', 4))
+    OCR_MAX_CONCURRENCY = int(os.environ.get('OCR_MAX_CONCURRENCY', 4))
+
+    # 任务/文档列表接口的默认及最大分页大小
+    CATALOG_PAGE_SIZE = int(os.environ.get('CATALOG_PAGE_SIZE', 100))
+    CATALOG_MAX_PAGE_SIZE = int(os.environ.get('CATALOG_MAX_PAGE_SIZE', 1000))
+
+    # 多渠道结果缓存的任务数上限
+    RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 512))
+
+    # 单个上传文件的大小上限（字节），默认100MB
+    MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 100 * 1024 * 1024))
+
+    # 批量流水线：各阶段工作线程数、阶段间队列长度、积压任务上限及压缩包大小上限（默认2GB）
+    BATCH_UPLOAD_WORKERS = int(os.environ.get('BATCH_UPLOAD_WORKERS', 2))
+    BATCH_OCR_WORKERS = int(os.environ.get('BATCH_OCR_WORKERS', 4))
+    BATCH_LLM_WORKERS = int(os.environ.get('BATCH_LLM_WORKERS', 4))
+    BATCH_LOCALIZE_WORKERS = int(os.environ.get('BATCH_LOCALIZE_WORKERS', 2))
+    BATCH_QUEUE_SIZE = int(os.environ.get('BATCH_QUEUE_SIZE', 16))
+    BATCH_MAX_PENDING = int(os.environ.get('BATCH_MAX_PENDING', 10000))
+    BATCH_MAX_ARCHIVE_BYTES = int(os.environ.get('BATCH_MAX_ARCHIVE_BYTES', 2 * 1024 * 1024 * 1024))
+
+
+    # 外部接口调用保护：可重试错误（限流、5xx、网络）的最大重试次数，退避等待的基数和上限（秒），
+    # 熔断阈值（连续失败次数）和熔断时长（秒），以及未单独配置的接口的并发上限
+    API_MAX_RETRIES = int(os.environ.get('API_MAX_RETRIES', 4))
+    API_BACKOFF_BASE = float(os.environ.get('API_BACKOFF_BASE', 0.5))
+    API_BACKOFF_MAX = float(os.environ.get('API_BACKOFF_MAX', 30))
+    API_CIRCUIT_THRESHOLD = int(os.environ.get('API_CIRCUIT_THRESHOLD', 10))
+    API_CIRCUIT_RESET = float(os.environ.get('API_CIRCUIT_RESET', 30))
+    API_MAX_CONCURRENCY = int(os.environ.get('API_MAX_CONCURRENCY', 8))
+
+    # 大模型接口：每个模型的每秒请求数、令牌桶容量、并发上限、单次请求超时（秒）及接口地址；
+    # ARK_MODEL_RATE_LIMITS 可以为单个模型指定每秒请求数，例如 {"deepseek-r1-250120": 2}
+    ARK_RATE_LIMIT = float(os.environ.get('ARK_RATE_LIMIT', 5))
+    ARK_RATE_BURST = int(os.environ.get('ARK_RATE_BURST', 10))
+    ARK_MAX_CONCURRENCY = int(os.environ.get('ARK_MAX_CONCURRENCY', 8))
+    ARK_TIMEOUT = float(os.environ.get('ARK_TIMEOUT', 120))
+    ARK_BASE_URL = os.environ.get('ARK_BASE_URL', 'https://ark.cn-beijing.volces.com/api/v3')
+    ARK_MODEL_RATE_LIMITS = json.loads(os.environ.get('ARK_MODEL_RATE_LIMITS', '{}'))
+
+    # OCR接口：每秒请求数、令牌桶容量及单次请求超时（秒），并发上限沿用 OCR_MAX_CONCURRENCY
+    OCR_RATE_LIMIT = float(os.environ.get('OCR_RATE_LIMIT', 2))
+    OCR_RATE_BURST = int(os.environ.get('OCR_RATE_BURST', 4))
+    OCR_TIMEOUT = float(os.environ.get('OCR_TIMEOUT', 120))
+
+    # 外部接口HTTP连接池：最大连接数、保持的长连接数、长连接空闲时间和建立连接超时（秒），
+    # ARK_HTTP2=1 时大模型接口使用HTTP/2（需要安装h2）
+    HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get('HTTP_POOL_MAX_CONNECTIONS', 32))
+    HTTP_POOL_KEEPALIVE = int(os.environ.get('HTTP_POOL_KEEPALIVE', 16))
+    HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('HTTP_KEEPALIVE_EXPIRY', 60))
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+    ARK_HTTP2 = os.environ.get('ARK_HTTP2', '0').lower() in ('1', 'true', 'yes')
+
+    # 生产环境服务（gunicorn.conf.py）：监听地址、worker进程数、每个进程的线程数、worker心跳超时（秒），
+    # 以及停止服务时等待进行中的请求和后台抽取任务完成的时间（秒），超时的任务在重启后重新执行
+    WEB_BIND = os.environ.get('WEB_BIND', '0.0.0.0:5050')
+    WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 2))
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+    WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 120))
+    WEB_GRACEFUL_TIMEOUT = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 120))
+
+    # 前端静态文件（static_files.py）：构建目录，以及不带内容哈希的文件（index.html除外）的缓存时间（秒）；
+    # 带哈希的js/css等文件永久缓存，index.html每次协商缓存
+    FRONTEND_DIST_FOLDER = os.environ.get(
+        'FRONTEND_DIST_FOLDER',
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend', 'dist'))
+    STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+
+    # 抽取进度事件（events.py）及推送服务（sse_server.py）：是否记录事件（关闭时大模型不使用流式响应）、
+    # 监听地址和端口、事件日志的轮询间隔和心跳间隔（秒）、连接数上限，以及单个连接积压的事件数上限，
+    # 超出时断开该连接，浏览器带上Last-Event-ID重连后从事件日志补齐
+    EVENTS_ENABLED = os.environ.get('EVENTS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    EVENTS_HOST = os.environ.get('EVENTS_HOST', '0.0.0.0')
+    EVENTS_PORT = int(os.environ.get('EVENTS_PORT', 5051))
+    EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 0.2))
+    EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+    EVENTS_MAX_CLIENTS = int(os.environ.get('EVENTS_MAX_CLIENTS', 10000))
+    EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 1000))
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import uuid
+from config import Config
+from storage import atomic_write_text
+from logger import get_logger
+
+log = get_logger('events')
+
+# 事件类型
+EVENT_STARTED = 'started'      # 新一轮抽取开始，事件日志从这一行重新开始
+EVENT_OCR = 'ocr'              # 一个文件OCR完成
+EVENT_CHANNEL = 'channel'      # 渠道状态变化（running/done/failed）
+EVENT_FIELD = 'field'          # 渠道从流式响应中解析出一个顶层字段
+EVENT_LOCATIONS = 'locations'  # 原文位置（op.json）计算完成
+EVENT_DONE = 'done'            # 整个任务完成
+EVENT_FAILED = 'failed'        # 整个任务失败
+
+
+def event_log_path(task_id):
+    """
+    任务的事件日志路径，task_id不是合法的目录名时返回None
+
+    事件日志每行一个JSON对象 {"event": 类型, "data": 数据, "ts": 时间}，只追加不修改，
+    推送服务（sse_server.py）跟踪文件末尾把新事件推给浏览器，行的结束位置就是事件ID
+    """
+    if not task_id or task_id in ('.', '..') or os.path.basename(task_id) != task_id or '\\' in task_id:
+        return None
+    return os.path.join(Config.EVENTS_FOLDER, f"{task_id}.jsonl")
+
+
+def _line(event, data):
+    entry = {"event": event, "data": data, "ts": round(time.time(), 3)}
+    return json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+
+
+def reset(task_id, **info):
+    """
+    开始新一轮抽取：用只包含started事件的新文件替换旧的事件日志
+
+    started事件带有本轮的run编号，推送服务据此判断浏览器重连时带的事件ID是否属于当前这一轮
+
+    参数:
+        info: 附加在started事件中的信息，例如job_id、batch_id
+    """
+    path = event_log_path(task_id)
+    if path is None or not Config.EVENTS_ENABLED:
+        return
+    try:
+        atomic_write_text(path, _line(EVENT_STARTED, dict(info, run=uuid.uuid4().hex)))
+    except OSError as e:
+        log.warning("重置事件日志失败", extra={"task_id": task_id, "error": str(e)})
+
+
+def publish(task_id, event, data=None):
+    """
+    向任务的事件日志追加一个事件
+
+    每个事件用一次O_APPEND写入，多个线程和worker进程同时追加时各行不会交错。
+    事件只用于进度展示，写入失败只记录日志，不影响抽取本身
+    """
+    path = event_log_path(task_id)
+    if path is None or not Config.EVENTS_ENABLED:
+        return
+    try:
+        os.makedirs(Config.EVENTS_FOLDER, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, _line(event, data).encode('utf-8'))
+        finally:
+            os.close(fd)
+    except OSError as e:
+        log.warning("写入事件失败", extra={"task_id": task_id, "event": event, "error": str(e)})
+
+
+def field_publisher(task_id, strategy, channel):
+    """
+    返回渠道的on_field回调，每解析出一个字段发布一个field事件
+
+    参数:
+        strategy: 抽取策略名
+        channel: 渠道在比对页面上的显示名称
+    """
+    if not Config.EVENTS_ENABLED:
+        return None
+
+    def on_field(key, value):
+        publish(task_id, EVENT_FIELD, {"strategy": strategy, "channel": channel, "key": key, "value": value})
+    return on_field
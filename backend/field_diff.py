@@ -0,0 +1,183 @@
+import os
+import re
+import json
+from datetime import datetime
+from config import Config
+from text_index import normalize_text
+
+# 字段比对状态
+FIELD_ON_PAGE = 'on-page'      # 所有渠道一致且原文中检索到（绿色）
+FIELD_AGREE = 'agree'          # 所有渠道一致但原文中未检索到（黄色）
+FIELD_DISAGREE = 'disagree'    # 至少两个渠道的值不同（红色）
+FIELD_MISSING = 'missing'      # 所有渠道都没有给出值
+
+FIELD_STATUSES = (FIELD_ON_PAGE, FIELD_AGREE, FIELD_DISAGREE, FIELD_MISSING)
+
+# 数值比较精度，和比对页面原来的判断一致
+NUMBER_PRECISION = 3
+# schema中数组按哪个属性对齐元素，未指定时按位置对齐
+ARRAY_KEY_PROPERTY = 'x-diff-key'
+
+_MISSING = object()
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+# 前端dateFormat（date-fns格式）到strptime格式的转换
+_DATE_TOKENS = (('yyyy', '%Y'), ('yy', '%y'), ('MM', '%m'), ('dd', '%d'))
+_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d', '%Y年%m月%d日', '%Y-%m', '%Y%m')
+
+
+def schema_path_for(task_id):
+    """任务使用的schema文件：任务自己的schema，没有时使用默认的invoice_A2P，都不存在返回None"""
+    for name in (task_id, 'invoice_A2P'):
+        path = os.path.join(Config.SCHEMA_FOLDER, f"{name}.json")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def load_task_schema(task_id):
+    path = schema_path_for(task_id)
+    if path is None:
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _normalize_date(value, field_schema):
+    text = str(value).strip()
+    formats = list(_DATE_FORMATS)
+    date_format = field_schema.get('dateFormat')
+    if date_format:
+        for token, directive in _DATE_TOKENS:
+            date_format = date_format.replace(token, directive)
+        formats.insert(0, date_format)
+    for fmt in formats:
+        try:
+            parsed = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        # 只有年月的格式（如账期yyyyMM）比较到月
+        return parsed.strftime('%Y-%m') if '%d' not in fmt else parsed.strftime('%Y-%m-%d')
+    return normalize_text(text)
+
+
+def normalize_value(value, field_schema=None):
+    """
+    按schema类型归一化标量值：数字按精度取整，日期统一为ISO格式，
+    字符串做全角半角、大小写和空白归一化；空值返回_MISSING
+    """
+    field_schema = field_schema or {}
+    if value is None or value == '' or value == [] or value == {}:
+        return _MISSING
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), NUMBER_PRECISION)
+    if field_schema.get('type') in ('number', 'integer'):
+        match = _NUMBER_RE.search(normalize_text(value))
+        if match:
+            return round(float(match.group()), NUMBER_PRECISION)
+    if field_schema.get('format') == 'date':
+        return _normalize_date(value, field_schema)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return normalize_text(value)
+
+
+def _scalar_status(values, field_schema):
+    normalized = [normalize_value(v, field_schema) for v in values]
+    present = [v for v in normalized if v is not _MISSING]
+    if not present:
+        return FIELD_MISSING
+    if len(present) < len(normalized) or any(v != present[0] for v in present[1:]):
+        return FIELD_DISAGREE
+    return FIELD_AGREE
+
+
+def _combine(statuses):
+    """容器字段的状态：任一子字段不一致则不一致，全部缺失则缺失"""
+    statuses = list(statuses)
+    if any(s == FIELD_DISAGREE for s in statuses):
+        return FIELD_DISAGREE
+    if not statuses or all(s == FIELD_MISSING for s in statuses):
+        return FIELD_MISSING
+    return FIELD_AGREE
+
+
+def _diff(values, field_schema, path, children):
+    """
+    比较各渠道在同一位置的值，叶子的状态写入children
+
+    返回:
+        该位置的整体状态
+    """
+    field_schema = field_schema or {}
+    is_object = field_schema.get('type') == 'object' or any(isinstance(v, dict) for v in values)
+    is_array = field_schema.get('type') == 'array' or any(isinstance(v, list) for v in values)
+
+    if is_object:
+        objects = [v if isinstance(v, dict) else {} for v in values]
+        properties = field_schema.get('properties', {})
+        keys = list(properties) + sorted({k for obj in objects for k in obj} - set(properties))
+        status = _combine(_diff([obj.get(k) for obj in objects], properties.get(k), f"{path}.{k}", children)
+                          for k in keys)
+    elif is_array:
+        arrays = [v if isinstance(v, list) else [] for v in values]
+        item_schema = field_schema.get('items', {})
+        key = field_schema.get(ARRAY_KEY_PROPERTY) or item_schema.get(ARRAY_KEY_PROPERTY)
+        statuses = []
+        if key:
+            # 按key属性对齐各渠道的元素，顺序以第一次出现为准
+            aligned = {}
+            for channel, array in enumerate(arrays):
+                for item in array:
+                    raw_key = item.get(key) if isinstance(item, dict) else None
+                    item_key = normalize_value(raw_key)
+                    if item_key is _MISSING:
+                        continue
+                    aligned.setdefault(item_key, (raw_key, [None] * len(arrays)))[1][channel] = item
+            for raw_key, items in aligned.values():
+                statuses.append(_diff(items, item_schema, f"{path}[{raw_key}]", children))
+        else:
+            for i in range(max((len(a) for a in arrays), default=0)):
+                statuses.append(_diff([a[i] if i < len(a) else None for a in arrays],
+                                      item_schema, f"{path}[{i}]", children))
+        status = _combine(statuses)
+    else:
+        status = _scalar_status(values, field_schema)
+        children[path] = status
+    return status
+
+
+def diff_fields(channels, on_the_page, schema=None):
+    """
+    计算每个字段在各渠道间的一致性
+
+    参数:
+        channels: [{"channel": 渠道名, "data": 抽取结果}, ...]
+        on_the_page: 原文中检索到的字段名列表
+        schema: 任务的JSON Schema，决定字段顺序和类型
+
+    返回:
+        {"fields": {字段名: {"status", "onPage", "children"}}, "summary": {状态: 字段数}}，
+        children只在数组/对象字段中出现，给出每个叶子路径的状态
+    """
+    properties = (schema or {}).get('properties', {})
+    datas = [channel.get('data') if isinstance(channel.get('data'), dict) else {} for channel in channels]
+    # 先按schema顺序，再补充schema之外渠道返回的字段
+    names = list(properties) + sorted({k for data in datas for k in data} - set(properties))
+    on_the_page = set(on_the_page or [])
+
+    fields = {}
+    summary = dict.fromkeys(FIELD_STATUSES, 0)
+    for name in names:
+        children = {}
+        status = _diff([data.get(name) for data in datas], properties.get(name), name, children)
+        on_page = name in on_the_page
+        if status == FIELD_AGREE and on_page:
+            status = FIELD_ON_PAGE
+        field = {"status": status, "onPage": on_page}
+        if list(children) != [name]:
+            field["children"] = children
+        fields[name] = field
+        summary[status] += 1
+    return {"fields": fields, "summary": summary}
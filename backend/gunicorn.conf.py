@@ -0,0 +1,36 @@
+"""
+生产环境的gunicorn配置
+
+    gunicorn -c gunicorn.conf.py app:app                               # 后端API
+    gunicorn -c gunicorn.conf.py -b 0.0.0.0:8080 static_files:app      # 前端静态文件
+
+worker进程数、线程数和超时由Config中的WEB_*配置。不预加载应用（preload_app），
+每个worker各自导入app并启动自己的后台任务线程池，抽取任务通过锁文件在worker之间认领。
+收到SIGTERM后worker不再接受新请求，等待进行中的请求结束，再在worker_exit中等待后台任务完成，
+总时长不超过WEB_GRACEFUL_TIMEOUT。
+"""
+import sys
+from config import Config
+
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS
+# gthread：每个worker用线程处理请求，慢客户端和长请求不会占满整个进程
+worker_class = 'gthread'
+threads = Config.WEB_THREADS
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = Config.WEB_GRACEFUL_TIMEOUT
+keepalive = 5
+# 请求日志由app以结构化日志输出
+accesslog = None
+errorlog = '-'
+
+# 留给gunicorn在超时前结束worker的余量（秒）
+DRAIN_MARGIN = 5
+
+
+def worker_exit(server, worker):
+    """worker退出前等待后台抽取任务和批量任务完成，静态文件服务没有导入app，直接退出"""
+    app_module = sys.modules.get('app')
+    if app_module is None or not hasattr(app_module, 'drain'):
+        return
+    app_module.drain(timeout=max(0, graceful_timeout - DRAIN_MARGIN))
@@ -0,0 +1,332 @@
+import io
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+from storage import atomic_write_bytes, file_sha256
+from logger import get_logger
+
+# Pillow和pypdfium2在第一次处理图片时才导入（_import_optional），不处理图片的进程不需要加载
+Image = None
+ImageOps = None
+pypdfium2 = None
+_optional_imported = False
+
+log = get_logger('image_prep')
+
+# 可以预处理的图片扩展名，PDF等其他文件原样使用
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+# 派生图片的编码格式对应的MIME类型和扩展名
+FORMAT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+# 文件内容哈希的内存缓存条目上限
+CONTENT_HASH_CACHE_SIZE = 4096
+# PDF页面按72dpi的点计算尺寸，栅格化时未指定宽度使用的缩放倍数
+PDF_DEFAULT_SCALE = 2
+# 纠偏时候选角度的步长（度）及估计角度所用缩略图的最长边
+DESKEW_STEP = 0.5
+DESKEW_SAMPLE_SIDE = 800
+
+
+def _import_optional():
+    """导入可选依赖，未安装Pillow时不做预处理，未安装pypdfium2时不能栅格化PDF页面"""
+    global Image, ImageOps, pypdfium2, _optional_imported
+    if _optional_imported:
+        return
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        Image = ImageOps = None
+    try:
+        import pypdfium2
+    except ImportError:
+        pypdfium2 = None
+    _optional_imported = True
+
+
+class DerivedImageUnavailable(Exception):
+    """缺少生成派生图片所需的依赖（Pillow，PDF还需要pypdfium2）"""
+
+
+def mime_type_for(path):
+    """按扩展名确定图片的MIME类型，未知扩展名按PNG处理"""
+    extension = os.path.splitext(path)[1].lower()
+    return {
+        '.jpg': 'image/jpeg',
+        '.jpeg': 'image/jpeg',
+        '.gif': 'image/gif',
+        '.webp': 'image/webp',
+        '.bmp': 'image/bmp',
+    }.get(extension, 'image/png')
+
+
+def _skew_angle(image, max_angle):
+    """
+    估计文字行的倾斜角度：在候选角度中选出使各行平均亮度方差最大的角度
+
+    文字行和水平方向对齐时，有字的行和行间空白的亮度差最大
+    """
+    sample = ImageOps.invert(image.convert('L'))
+    sample.thumbnail((DESKEW_SAMPLE_SIDE, DESKEW_SAMPLE_SIDE))
+    steps = int(max_angle / DESKEW_STEP)
+    best_angle, best_score = 0.0, None
+    for i in range(-steps, steps + 1):
+        angle = i * DESKEW_STEP
+        rotated = sample.rotate(angle, resample=Image.BILINEAR, fillcolor=0)
+        # 缩成一列得到每行的平均亮度
+        rows = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+        mean = sum(rows) / len(rows)
+        score = sum((row - mean) ** 2 for row in rows)
+        if best_score is None or score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def _open_page(path, options):
+    """打开图片（按EXIF转正），PDF按options中的页码和宽度栅格化"""
+    if path.lower().endswith('.pdf'):
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            page_index = options.get('page', 0)
+            if not 0 <= page_index < len(pdf):
+                raise IndexError(f"页码超出范围: {page_index}")
+            page = pdf[page_index]
+            width = options.get('width')
+            scale = width / page.get_width() if width else PDF_DEFAULT_SCALE
+            return page.render(scale=scale).to_pil()
+        finally:
+            pdf.close()
+    with Image.open(path) as source:
+        image = ImageOps.exif_transpose(source)
+        image.load()
+        return image
+
+
+def _render(path, options):
+    """
+    在进程池中执行：按options生成派生图片
+
+    参数:
+        path: 原图路径
+        options: {"format", "quality"}，以及可选的"max_side"（最长边上限）、"width"（宽度上限）、
+            "page"（PDF页码）、"crop"（裁剪区域）、"deskew"和"deskew_max_angle"
+
+    返回:
+        编码后的图片字节
+    """
+    _import_optional()
+    image = _open_page(path, options)
+    if image.mode not in ('RGB', 'L'):
+        # 透明背景铺成白色，JPEG不支持透明通道
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, 'white')
+        image.paste(rgba, mask=rgba.getchannel('A'))
+
+    if options.get('deskew'):
+        angle = _skew_angle(image, options['deskew_max_angle'])
+        if angle:
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor='white')
+
+    max_side = options.get('max_side')
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    width = options.get('width')
+    if width and image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+
+    if options.get('crop'):
+        image = image.crop(tuple(options['crop']))
+
+    buffer = io.BytesIO()
+    image_format = options['format']
+    if image_format == 'JPEG':
+        image.save(buffer, image_format, quality=options['quality'], optimize=True, progressive=True)
+    elif image_format == 'WEBP':
+        image.save(buffer, image_format, quality=options['quality'], method=4)
+    else:
+        image.save(buffer, image_format, optimize=True)
+    return buffer.getvalue()
+
+
+class ImagePreprocessor:
+    """
+    派生图片：调用视觉模型和OCR之前的预处理，以及预览页面使用的缩略图和分块图
+
+    预处理自动转正（EXIF方向）、纠偏、缩小到最长边上限，并重新编码为JPEG/WebP。
+    派生图片按原图内容哈希和处理参数缓存在磁盘上，同一张图片只处理一次；
+    解码、缩放和编码在进程池中执行，不占用Flask的工作线程。
+    """
+
+    def __init__(self, cache_folder=None, max_workers=None):
+        self.cache_folder = cache_folder or Config.IMAGE_CACHE_FOLDER
+        self.max_workers = max_workers or Config.IMAGE_PREP_WORKERS
+        self._executor = None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._hashes = {}
+
+    @staticmethod
+    def available():
+        if not Config.IMAGE_PREP_ENABLED:
+            return False
+        _import_optional()
+        return Image is not None
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def content_hash(self, path):
+        """文件内容的sha256，按路径、修改时间和大小缓存在内存中，避免每次请求都读取整个文件"""
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            content_hash = self._hashes.get(key)
+        if content_hash is None:
+            content_hash = file_sha256(path)
+            with self._lock:
+                if len(self._hashes) >= CONTENT_HASH_CACHE_SIZE:
+                    self._hashes.clear()
+                self._hashes[key] = content_hash
+        return content_hash
+
+    def variant_path(self, content_hash, options):
+        """派生图片的缓存路径，由原图内容哈希和处理参数决定"""
+        options_str = json.dumps(options, sort_keys=True)
+        key = hashlib.sha256(f"{content_hash}:{options_str}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_folder, key[:2], f"{key}{FORMAT_EXTENSIONS[options['format']]}")
+
+    def derive(self, path, options, content_hash=None):
+        """
+        生成派生图片，已缓存时直接返回
+
+        返回:
+            (派生图片路径, 是否命中缓存)
+        """
+        target = self.variant_path(content_hash or self.content_hash(path), options)
+        if os.path.exists(target):
+            return target, True
+        atomic_write_bytes(target, self._pool().submit(_render, path, options).result())
+        return target, False
+
+    def prepare(self, path, max_side=None, deskew=None):
+        """
+        把图片处理为适合请求的大小
+
+        参数:
+            path: 原图路径
+            max_side: 最长边上限，默认Config.IMAGE_MAX_SIDE
+            deskew: 是否纠偏，默认Config.IMAGE_DESKEW
+
+        返回:
+            (请求使用的图片路径, MIME类型)；不是图片、未安装Pillow、处理失败
+            或处理后反而更大时返回原图
+        """
+        if not self.available() or not path.lower().endswith(IMAGE_EXTENSIONS):
+            return path, mime_type_for(path)
+        image_format = Config.IMAGE_FORMAT.upper()
+        options = {
+            "format": image_format if image_format in FORMAT_MIME_TYPES else 'JPEG',
+            "quality": Config.IMAGE_QUALITY,
+            "max_side": max_side or Config.IMAGE_MAX_SIDE,
+            "deskew": Config.IMAGE_DESKEW if deskew is None else deskew,
+            "deskew_max_angle": Config.IMAGE_DESKEW_MAX_ANGLE
+        }
+        try:
+            target, cached = self.derive(path, options)
+        except Exception as e:
+            log.warning("图片预处理失败，使用原图", extra={"path": path, "error": str(e)})
+            return path, mime_type_for(path)
+
+        original_size = os.path.getsize(path)
+        size = os.path.getsize(target)
+        if size >= original_size:
+            target, size = path, original_size
+        with self._lock:
+            self.calls += 1
+            self.cache_hits += int(cached)
+            self.bytes_in += original_size
+            self.bytes_out += size
+        log.info("图片预处理完成", extra={"file": os.path.basename(path), "bytes_in": original_size, "bytes_out": size,
+                                        "bytes_saved": original_size - size, "cached": cached})
+        if target == path:
+            return path, mime_type_for(path)
+        return target, FORMAT_MIME_TYPES[options['format']]
+
+    @staticmethod
+    def preview_width(width):
+        """把请求的宽度对齐到Config.THUMBNAIL_WIDTHS中不小于它的最小值，限制派生图片的种类"""
+        widths = sorted(Config.THUMBNAIL_WIDTHS)
+        return next((w for w in widths if w >= width), widths[-1])
+
+    def thumbnail(self, path, width, page=0):
+        """
+        限定宽度的预览图，PDF按页栅格化，不会放大原图
+
+        参数:
+            path: 原文件路径
+            width: 期望的宽度，对齐到Config.THUMBNAIL_WIDTHS
+            page: PDF页码（从0开始），图片只有第0页
+
+        返回:
+            (预览图路径, MIME类型, ETag)；缺少依赖时抛出DerivedImageUnavailable，页码无效时抛出IndexError
+        """
+        is_pdf = path.lower().endswith('.pdf')
+        _import_optional()
+        if Image is None or (is_pdf and pypdfium2 is None):
+            raise DerivedImageUnavailable("缺少Pillow或pypdfium2，无法生成预览图")
+        if not is_pdf and page != 0:
+            raise IndexError(f"页码超出范围: {page}")
+        options = {
+            "format": "JPEG",
+            "quality": Config.THUMBNAIL_QUALITY,
+            "width": self.preview_width(width),
+            "page": page
+        }
+        target, _ = self.derive(path, options)
+        return target, FORMAT_MIME_TYPES["JPEG"], os.path.splitext(os.path.basename(target))[0]
+
+    def tile(self, path, width, x, y, page=0):
+        """
+        预览图中的一个分块，用于放大查看：先生成同宽度的预览图，再从中裁剪
+
+        参数:
+            x, y: 分块的列号和行号（从0开始），分块边长为Config.TILE_SIZE
+
+        返回:
+            同thumbnail；分块超出图片范围时抛出IndexError
+        """
+        base, _, base_key = self.thumbnail(path, width, page)
+        with Image.open(base) as image:
+            base_width, base_height = image.size
+        size = Config.TILE_SIZE
+        if x < 0 or y < 0 or x * size >= base_width or y * size >= base_height:
+            raise IndexError(f"分块超出范围: ({x}, {y})")
+        options = {
+            "format": "JPEG",
+            "quality": Config.THUMBNAIL_QUALITY,
+            "crop": [x * size, y * size, min((x + 1) * size, base_width), min((y + 1) * size, base_height)]
+        }
+        target, _ = self.derive(base, options, content_hash=base_key)
+        return target, FORMAT_MIME_TYPES["JPEG"], os.path.splitext(os.path.basename(target))[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "cache_hits": self.cache_hits,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out
+            }
+
+
+image_preprocessor = ImagePreprocessor()
@@ -0,0 +1,291 @@
+import os
+import json
+import uuid
+import time
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import Config
+from storage import atomic_write_json
+from logger import get_logger
+import events
+
+log = get_logger('jobs')
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_SKIPPED = 'skipped'
+
+FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+
+class JobsDraining(Exception):
+    """服务正在停止，不再接受新的抽取任务"""
+
+
+class JobManager:
+    """
+    抽取任务管理器
+
+    提交Schema后立即返回job_id，抽取在后台线程池中执行。
+    每个任务的状态（整体及各抽取策略的queued/running/done/failed和耗时）
+    持久化在 Config.JOBS_FOLDER/<job_id>.json，任意worker进程都可以读取，
+    服务重启后未完成的任务会被重新执行。
+    """
+
+    def __init__(self, runner, jobs_folder=None, max_workers=None):
+        """
+        参数:
+            runner: 执行函数 runner(task_id, schema_data, extract_strategy, reporter, schema_diff=None)
+            jobs_folder: 任务状态存储目录
+            max_workers: 后台执行线程数
+        """
+        self.runner = runner
+        self.jobs_folder = jobs_folder or Config.JOBS_FOLDER
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or Config.JOB_MAX_WORKERS)
+        self._lock = threading.Lock()
+        # 本进程提交到线程池的任务 {job_id: Future}，停止服务时用来取消排队中的任务并等待执行中的任务
+        self._futures = {}
+        self._draining = False
+        os.makedirs(self.jobs_folder, exist_ok=True)
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_folder, f"{job_id}.json")
+
+    def _lock_path(self, job_id):
+        return os.path.join(self.jobs_folder, f"{job_id}.lock")
+
+    def get(self, job_id):
+        """读取任务状态，不存在时返回None"""
+        # job_id只允许由submit生成的格式，防止路径穿越
+        if not job_id or os.path.basename(job_id) != job_id:
+            return None
+        try:
+            with open(self._job_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def list_for_task(self, task_id):
+        """列出某个任务ID下的所有抽取任务，最新的在前"""
+        jobs = []
+        for filename in os.listdir(self.jobs_folder):
+            if not filename.endswith('.json'):
+                continue
+            job = self.get(filename[:-len('.json')])
+            if job and job.get('task_id') == task_id:
+                jobs.append(job)
+        jobs.sort(key=lambda x: x['created_at'], reverse=True)
+        return jobs
+
+    def submit(self, task_id, schema_data, extract_strategy, schema_diff=None):
+        """
+        创建任务并放入后台执行，立即返回任务状态
+
+        参数:
+            schema_diff: 和上一版本schema的差异，提供时只重新抽取变化的字段，None表示全量抽取
+
+        服务正在停止时抛出JobsDraining
+        """
+        if self._draining:
+            raise JobsDraining('服务正在停止，请稍后重试')
+        now = time.time()
+        job = {
+            'job_id': f"job_{uuid.uuid4().hex}",
+            'task_id': task_id,
+            'status': JOB_QUEUED,
+            'error': None,
+            'created_at': now,
+            'started_at': None,
+            'finished_at': None,
+            'duration': None,
+            'strategies': {
+                strategy: {
+                    'status': JOB_QUEUED,
+                    'error': None,
+                    'started_at': None,
+                    'finished_at': None,
+                    'duration': None
+                } for strategy in extract_strategy
+            },
+            'schema': schema_data,
+            'schema_diff': schema_diff
+        }
+        with self._lock:
+            atomic_write_json(self._job_path(job['job_id']), job)
+        self._claim(job['job_id'])
+        self._execute(job['job_id'])
+        return job
+
+    def _execute(self, job_id):
+        future = self.executor.submit(self._run, job_id)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+
+    def _forget(self, job_id):
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _update(self, job_id, mutate):
+        with self._lock:
+            job = self.get(job_id)
+            if job is None:
+                return None
+            mutate(job)
+            atomic_write_json(self._job_path(job_id), job)
+            return job
+
+    def _report(self, job_id, strategy, status, error=None):
+        """process_with_ai的进度回调，strategy为None时表示整个任务"""
+        def mutate(job):
+            now = time.time()
+            target = job if strategy is None else job['strategies'].setdefault(
+                strategy, {'status': JOB_QUEUED, 'error': None, 'started_at': None,
+                           'finished_at': None, 'duration': None})
+            target['status'] = status
+            if error is not None:
+                target['error'] = str(error)
+            if status == JOB_RUNNING:
+                target['started_at'] = now
+            elif status in FINISHED_STATUSES or status == JOB_SKIPPED:
+                target['finished_at'] = now
+                if target.get('started_at'):
+                    target['duration'] = round(now - target['started_at'], 3)
+        self._update(job_id, mutate)
+
+    def _run(self, job_id):
+        job = self._update(job_id, lambda j: j.update(
+            status=JOB_RUNNING, started_at=time.time(), error=None))
+        if job is None:
+            return
+        # 新一轮抽取的进度事件从头记录，重启后重新执行的任务也一样
+        events.reset(job['task_id'], job_id=job_id)
+        try:
+            self.runner(job['task_id'], job['schema'], list(job['strategies'].keys()),
+                        lambda strategy, status, error=None: self._report(job_id, strategy, status, error),
+                        schema_diff=job.get('schema_diff'))
+        except Exception as e:
+            log.exception("抽取任务执行出错", extra={"job_id": job_id})
+            self._report(job_id, None, JOB_FAILED, error=e)
+        finally:
+            self._finish(job_id)
+            self._release(job_id)
+
+    def _finish(self, job_id):
+        """根据各策略的结果汇总任务最终状态"""
+        def mutate(job):
+            now = time.time()
+            strategies = job['strategies'].values()
+            for item in strategies:
+                # 没有被执行到的策略（例如没有匹配的文件）标记为跳过
+                if item['status'] in (JOB_QUEUED, JOB_RUNNING):
+                    item['status'] = JOB_SKIPPED
+            if job['status'] != JOB_FAILED:
+                if any(item['status'] == JOB_FAILED for item in strategies):
+                    job['status'] = JOB_FAILED
+                    job['error'] = job['error'] or '部分抽取策略执行失败'
+                elif not any(item['status'] == JOB_DONE for item in strategies):
+                    job['status'] = JOB_FAILED
+                    job['error'] = job['error'] or '没有执行任何抽取策略'
+                else:
+                    job['status'] = JOB_DONE
+            job['finished_at'] = now
+            if job.get('started_at'):
+                job['duration'] = round(now - job['started_at'], 3)
+        self._update(job_id, mutate)
+
+    def _claim(self, job_id):
+        """通过独占创建锁文件认领任务，避免多个worker进程重复执行"""
+        owner = {'host': socket.gethostname(), 'pid': os.getpid()}
+        try:
+            fd = os.open(self._lock_path(job_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(owner, f)
+        return True
+
+    def _release(self, job_id):
+        try:
+            os.remove(self._lock_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _lock_is_stale(self, job_id):
+        """锁的持有进程已不存在（服务重启/崩溃）时视为失效"""
+        try:
+            with open(self._lock_path(job_id), 'r', encoding='utf-8') as f:
+                owner = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (json.JSONDecodeError, OSError):
+            return True
+        if owner.get('host') != socket.gethostname():
+            # 其他主机上的进程无法检测，交给该主机自己恢复
+            return False
+        try:
+            os.kill(owner.get('pid'), 0)
+        except ProcessLookupError:
+            return True
+        except (PermissionError, TypeError):
+            return False
+        return False
+
+    def recover(self):
+        """重新执行重启前未完成的任务，返回恢复的任务数"""
+        recovered = 0
+        for filename in os.listdir(self.jobs_folder):
+            if not filename.endswith('.json'):
+                continue
+            job_id = filename[:-len('.json')]
+            job = self.get(job_id)
+            if not job or job['status'] in FINISHED_STATUSES:
+                continue
+            if self._lock_is_stale(job_id):
+                self._release(job_id)
+            if not self._claim(job_id):
+                continue
+
+            def reset(j):
+                j['status'] = JOB_QUEUED
+                for item in j['strategies'].values():
+                    if item['status'] not in FINISHED_STATUSES:
+                        item.update(status=JOB_QUEUED, started_at=None, finished_at=None, duration=None)
+            self._update(job_id, reset)
+            log.info("恢复未完成的任务", extra={"job_id": job_id})
+            self._execute(job_id)
+            recovered += 1
+        return recovered
+
+    def drain(self, timeout=None):
+        """
+        停止服务前调用：不再接受新任务，还没开始的任务释放锁留给重启后的进程恢复，
+        等待执行中的任务完成
+
+        参数:
+            timeout: 最长等待时间（秒），None表示一直等待
+
+        返回:
+            超时后仍未完成的任务数；这些任务的锁随进程退出失效，重启后会被重新执行
+        """
+        with self._lock:
+            self._draining = True
+            futures = dict(self._futures)
+        running = []
+        for job_id, future in futures.items():
+            if future.cancel():
+                self._release(job_id)
+            else:
+                running.append(future)
+        if running:
+            log.info("等待执行中的抽取任务完成", extra={"jobs": len(running), "timeout": timeout})
+        _, pending = wait(running, timeout=timeout)
+        self.executor.shutdown(wait=False)
+        return len(pending)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,334 @@
+import re
+import json
+
+# 宽松解码：模型输出的字符串中常有未转义的换行
+_decoder = json.JSONDecoder(strict=False)
+
+_CLOSERS = {'{': '}', '[': ']'}
+_WHITESPACE = ' \t\r\n'
+_SCALAR_END = ',}]' + _WHITESPACE
+# 不能作为数字、true/false/null开头的字符
+_STRUCTURAL = '{}[]:,"'
+# 字符串中只有引号和反斜杠需要逐个处理，其余字符整段跳过
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+# JSON Schema类型对应的Python类型，bool是int的子类，单独排除
+_SCHEMA_TYPES = {
+    'string': (str,),
+    'number': (int, float),
+    'integer': (int,),
+    'boolean': (bool,),
+    'array': (list,),
+    'object': (dict,),
+}
+
+
+def _type_errors(schema, value, path):
+    """按字段schema检查取值的类型和枚举，null视为未抽取到，不算错误"""
+    if value is None or not isinstance(schema, dict):
+        return []
+    expected = schema.get('type')
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        matched = any(
+            isinstance(value, _SCHEMA_TYPES.get(t, ())) and not (isinstance(value, bool) and t in ('number', 'integer'))
+            for t in types)
+        if not matched:
+            return [f"{path}: 期望{'/'.join(types)}，实际为{type(value).__name__}"]
+    if 'enum' in schema and value not in schema['enum']:
+        return [f"{path}: 取值不在枚举范围内"]
+    errors = []
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in schema.get('properties', {}):
+                errors.extend(_type_errors(schema['properties'][key], item, f"{path}.{key}"))
+    elif isinstance(value, list) and isinstance(schema.get('items'), dict):
+        for i, item in enumerate(value):
+            errors.extend(_type_errors(schema['items'], item, f"{path}[{i}]"))
+    return errors
+
+
+def validate_field(schema, key, value):
+    """
+    按任务schema检查一个顶层字段
+
+    返回:
+        错误描述列表，没有问题时为空列表
+    """
+    if not schema:
+        return []
+    properties = schema.get('properties', {})
+    if key not in properties:
+        return [f"{key}: schema中没有该字段"] if schema.get('additionalProperties') is False else []
+    return _type_errors(properties[key], value, key)
+
+
+class JsonStreamParser:
+    """
+    从模型输出中提取JSON，支持边接收边解析
+
+    逐字符扫描一遍（跳过JSON之前的说明文字和```json标记），顶层对象的每个字段在取值结束时
+    单独解析一次，已解析的文本随即丢弃，整个输出不会被重复解析。输出被截断（例如达到max_tokens）时，
+    最后一个字段如果是对象或数组则补齐括号保留已完整的部分，其中没有任何完整成员的对象或数组整个丢弃；
+    如果是字符串、数字或只有键则丢弃。
+
+    说明文字中的花括号（例如 "结果{如下}：{...}"）在还没有解析出字段时视为误判，从下一个 { 重新开始；
+    已经解析出字段后遇到语法错误则停止解析，保留已解析的字段并在errors中记录。
+
+    用法:
+        parser = JsonStreamParser(schema)
+        for delta in stream:
+            for key, value in parser.feed(delta):
+                ...  # 新解析出的顶层字段
+        result = parser.result()
+    """
+
+    def __init__(self, schema=None):
+        """
+        参数:
+            schema: 任务的JSON Schema，提供时逐字段检查类型，错误记录在errors中
+        """
+        self.schema = schema
+        self.errors = []
+        self.truncated = False
+        self.complete = False
+        self._finished = False
+        self._failed = False
+        self._prefix = ''
+        self._parts = []
+        self._base = 0  # _parts中第一个字符在整个输出中的位置
+        self._pos = 0
+        self._items = []
+        self._reset()
+
+    def _reset(self):
+        """回到寻找JSON开头的状态"""
+        self._started = False
+        self._root = None  # 顶层容器：'{'或'['
+        self._stack = []
+        self._ends = []  # 每层容器中最后一个完整成员的结束位置，还没有完整成员时为None
+        self._expect = None  # 当前容器中期望的下一个元素：key/colon/value/comma
+        self._in_string = False
+        self._escape = False
+        self._string_is_key = False
+        self._in_scalar = False
+        self._key_start = None
+        self._key = None
+        self._value_start = None
+
+    def _slice(self, start, end):
+        text = ''.join(self._parts)
+        self._parts = [text]
+        return text[start - self._base:end - self._base]
+
+    def _trim(self, position):
+        """丢弃position之前已经解析过的文本"""
+        text = ''.join(self._parts)
+        self._parts = [text[position - self._base:]]
+        self._base = position
+
+    def _can_start(self, char):
+        """对象可以从任意位置开始；数组只在输出开头或```标记之后开始，避免把说明文字中的[注]当成JSON"""
+        if char == '{':
+            return True
+        prefix = self._prefix.rstrip()
+        return not prefix or prefix.endswith(('```', '```json', '```JSON'))
+
+    def _seek_start(self, position, char):
+        """在JSON开始之前逐字符寻找顶层的 { 或 ["""
+        if char in '{[' and self._can_start(char):
+            self._started = True
+            self._prefix = ''
+            self._trim(position)
+            self._root = char
+            self._stack.append(char)
+            self._ends.append(None)
+            self._expect = 'key' if char == '{' else 'value'
+        else:
+            self._prefix = (self._prefix + char)[-16:]
+
+    def _syntax_error(self, position, char):
+        """
+        遇到不符合JSON语法的字符
+
+        还没有解析出任何字段时，之前的 { 是说明文字中的误判，回到寻找JSON开头的状态；
+        否则记录错误并停止解析
+        """
+        if not self._items:
+            self._reset()
+            # 误判的 { 之后不再允许从 [ 开始，避免把说明文字中的[注]当成JSON
+            self._prefix = self._root or '{'
+            return
+        self.errors.append(f"位置{position}: 无效的JSON字符 {char!r}，之后的内容被忽略")
+        self._failed = True
+
+    def _begin_value(self, position):
+        if len(self._stack) == 1 and self._expect == 'value':
+            self._value_start = position
+
+    def _value_done(self, end):
+        if len(self._stack) == 1 and self._value_start is not None:
+            self._emit(self._slice(self._value_start, end))
+            self._trim(end)
+            self._value_start = None
+        self._expect = 'comma'
+        self._ends[-1] = end
+
+    def _emit(self, text):
+        key = self._key if self._root == '{' else len(self._items)
+        try:
+            value = _decoder.decode(text)
+        except ValueError as e:
+            self.errors.append(f"{key}: 无法解析的取值 ({e})")
+            return
+        if self._root == '{':
+            self.errors.extend(validate_field(self.schema, key, value))
+        self._items.append((key, value))
+        self._new.append((key, value))
+
+    def _consume(self, position, char):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._string_is_key:
+                    if len(self._stack) == 1:
+                        try:
+                            self._key = _decoder.decode(self._slice(self._key_start, position + 1))
+                        except ValueError:
+                            self._key = self._slice(self._key_start + 1, position)
+                    self._expect = 'colon'
+                else:
+                    self._value_done(position + 1)
+            return
+        if self._in_scalar:
+            if char not in _SCALAR_END:
+                return
+            self._in_scalar = False
+            self._value_done(position)
+        if char in _WHITESPACE:
+            return
+        expect = self._expect
+        if char == '"' and expect in ('key', 'value'):
+            self._in_string = True
+            self._string_is_key = expect == 'key'
+            if self._string_is_key and len(self._stack) == 1:
+                self._key_start = position
+            else:
+                self._begin_value(position)
+        elif char in '{[' and expect == 'value':
+            self._begin_value(position)
+            self._stack.append(char)
+            self._ends.append(None)
+            self._expect = 'key' if char == '{' else 'value'
+        elif (char == '}' and self._stack[-1] == '{' and expect in ('key', 'comma')) or \
+                (char == ']' and self._stack[-1] == '[' and expect in ('value', 'comma')):
+            # 允许末尾多余的逗号
+            self._stack.pop()
+            self._ends.pop()
+            if not self._stack:
+                self.complete = True
+                return
+            self._value_done(position + 1)
+        elif char == ':' and expect == 'colon':
+            self._expect = 'value'
+        elif char == ',' and expect == 'comma':
+            self._expect = 'key' if self._stack[-1] == '{' else 'value'
+        elif expect == 'value' and char not in _STRUCTURAL:
+            # 数字、true/false/null，遇到分隔符时结束，取值是否合法在解析字段时检查
+            self._begin_value(position)
+            self._in_scalar = True
+        else:
+            self._syntax_error(position, char)
+
+    def feed(self, text):
+        """
+        追加一段模型输出
+
+        返回:
+            [(字段名, 取值), ...] 本次新解析出的顶层字段（顶层为数组时字段名为下标）
+        """
+        self._new = []
+        if self.complete or self._finished or self._failed or not text:
+            return self._new
+        self._parts.append(text)
+        base = self._pos
+        i, length = 0, len(text)
+        while i < length:
+            if self._in_string and not self._escape:
+                match = _STRING_SPECIAL.search(text, i)
+                if match is None:
+                    break
+                i = match.start()
+            char = text[i]
+            position = base + i
+            i += 1
+            if not self._started:
+                self._seek_start(position, char)
+                continue
+            self._consume(position, char)
+            if self._failed:
+                self._parts = []
+                break
+            if not self._started:
+                # 误判的开头已丢弃，当前字符可能是真正的JSON开头
+                self._seek_start(position, char)
+            elif self.complete:
+                self._parts = []
+                break
+        self._pos = base + length
+        return self._new
+
+    def _repair(self):
+        """
+        输出在最后一个顶层字段中间截断时，补齐括号保留该字段中已完整的部分
+
+        从最内层的未闭合容器向外找第一个已有完整成员的容器，截断到它最后一个完整成员之后，
+        更内层的容器（没有任何完整成员）整个丢弃；所有层都没有完整成员时丢弃整个字段
+        """
+        self.truncated = True
+        self._new = []
+        if self._value_start is None:
+            return
+        for depth in range(len(self._stack) - 1, 0, -1):
+            end = self._ends[depth]
+            if end is not None:
+                closers = ''.join(_CLOSERS[c] for c in reversed(self._stack[1:depth + 1]))
+                self._emit(self._slice(self._value_start, end) + closers)
+                return
+
+    def result(self):
+        """
+        结束解析，返回提取到的JSON（顶层对象返回字典，数组返回列表）
+
+        输出不完整时返回修复后的部分结果并把truncated置为True；没有找到JSON时抛出ValueError
+        """
+        if not self._started:
+            raise ValueError("无法从文本中提取有效的JSON")
+        if not self._finished:
+            self._finished = True
+            if not self.complete and not self._failed:
+                self._repair()
+            if self.schema and self._root == '{':
+                fields = dict(self._items)
+                missing = [key for key in self.schema.get('required', []) if key not in fields]
+                if missing:
+                    self.errors.append(f"缺少必填字段: {', '.join(missing)}")
+        if self._root == '[':
+            return [value for _, value in self._items]
+        return dict(self._items)
+
+
+def extract_json(text, schema=None):
+    """
+    从完整的模型输出中提取JSON，见JsonStreamParser
+
+    返回:
+        (JSON对象, 解析器)，解析器的errors和truncated记录了schema检查结果和是否截断
+    """
+    parser = JsonStreamParser(schema)
+    parser.feed(text)
+    return parser.result(), parser
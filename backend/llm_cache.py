@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from config import Config
+
+
+class MemoryBackend:
+    """进程内LRU缓存后端"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or Config.LLM_CACHE_MAX_ENTRIES
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回 (过期时间, 值)，不存在返回None"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                self._data.move_to_end(key)
+            return item
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteBackend:
+    """磁盘sqlite缓存后端，多个worker进程可以共享"""
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or Config.LLM_CACHE_PATH
+        self.max_entries = max_entries or Config.LLM_CACHE_MAX_ENTRIES
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL, last_used REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)")
+
+    def get(self, key):
+        """返回 (过期时间, 值)，不存在返回None"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT expires_at, value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def set(self, key, value, expires_at):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, time.time()))
+            # 超过条目上限时删除最久未使用的条目
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+def _fingerprint_messages(messages):
+    """把消息中的base64图片替换为其内容哈希，避免缓存键中包含整张图片"""
+    def normalize(value):
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [normalize(v) for v in value]
+        if isinstance(value, str) and value.startswith('data:'):
+            return 'sha256:' + hashlib.sha256(value.encode('utf-8')).hexdigest()
+        return value
+    return normalize(messages)
+
+
+class LLMCache:
+    """
+    大模型响应缓存
+
+    缓存键由模型、消息内容（图片按内容哈希）、temperature和max_tokens共同决定，
+    只要提示词或参数有任何变化就会重新请求模型。
+    """
+
+    def __init__(self, backend=None, ttl=None):
+        """
+        参数:
+            backend: 缓存后端（MemoryBackend/SqliteBackend），为None时不缓存
+            ttl: 缓存有效期（秒），0表示永不过期
+        """
+        self.backend = backend
+        self.ttl = ttl if ttl is not None else Config.LLM_CACHE_TTL
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    @staticmethod
+    def make_key(model, messages, temperature=None, max_tokens=None):
+        payload = json.dumps({
+            "model": model,
+            "messages": _fingerprint_messages(messages),
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """读取缓存的响应文本，未命中或已过期返回None"""
+        if not self.enabled:
+            return None
+        item = self.backend.get(key)
+        if item is not None and item[0] and item[0] < time.time():
+            self.backend.delete(key)
+            item = None
+        with self._lock:
+            if item is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return item[1] if item is not None else None
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl if self.ttl else None
+        self.backend.set(key, value, expires_at)
+
+    def delete(self, key):
+        if self.enabled:
+            self.backend.delete(key)
+
+    def stats(self):
+        """返回命中率等统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__ if self.backend else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self.backend) if self.backend else 0
+            }
+
+
+def create_llm_cache(backend_name=None):
+    """根据配置创建缓存：sqlite（默认）、memory 或 none"""
+    backend_name = (backend_name or Config.LLM_CACHE_BACKEND).lower()
+    if backend_name == 'sqlite':
+        return LLMCache(SqliteBackend())
+    if backend_name == 'memory':
+        return LLMCache(MemoryBackend())
+    return LLMCache(None)
@@ -0,0 +1,92 @@
+import sys
+import json
+import logging
+import threading
+import contextvars
+from config import Config
+
+# 当前HTTP请求的ID，由app在请求开始时设置，请求处理过程中的日志都会带上
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# LogRecord自带的属性，其余属性都是通过extra传入的结构化字段
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def _fields(record):
+    fields = {}
+    request_id = request_id_var.get()
+    if request_id:
+        fields["request_id"] = request_id
+    for key, value in record.__dict__.items():
+        if key not in _RECORD_ATTRIBUTES:
+            fields[key] = value
+    return fields
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行JSON：时间、级别、模块、消息以及extra中的字段"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """便于本地阅读的单行文本格式，结构化字段以key=value附在消息后"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        fields = _fields(record)
+        if fields:
+            text += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+def configure_logging():
+    """按LOG_FORMAT（json/text）和LOG_LEVEL配置后端日志，重复调用不会重复添加handler"""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(TextFormatter() if Config.LOG_FORMAT == 'text' else JsonFormatter())
+        root = logging.getLogger('backend')
+        root.addHandler(handler)
+        root.setLevel(Config.LOG_LEVEL)
+        root.propagate = False
+        _configured = True
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """
+    后端模块使用的日志对象
+
+    extra中的键和LogRecord自带的属性（message、name、args等）同名时，logging会抛出KeyError，
+    日志调用反而让业务代码出错；这里把同名的键改为 extra_<键> 后再记录
+    """
+
+    def process(self, msg, kwargs):
+        extra = kwargs.get('extra')
+        if extra and not _RECORD_ATTRIBUTES.isdisjoint(extra):
+            kwargs['extra'] = {(f"extra_{key}" if key in _RECORD_ATTRIBUTES else key): value
+                               for key, value in extra.items()}
+        return msg, kwargs
+
+
+def get_logger(name):
+    """获取模块的日志对象，例如 log = get_logger('ai')"""
+    configure_logging()
+    return StructuredLogger(logging.getLogger(f'backend.{name}'), {})
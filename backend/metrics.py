@@ -0,0 +1,204 @@
+import time
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from logger import get_logger
+
+log = get_logger('metrics')
+
+# 耗时直方图的分桶（秒），覆盖从本地文件读写到大模型长请求的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器，按标签分别计数"""
+
+    type = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """分桶直方图，输出_bucket、_sum和_count"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", dict(labels, le=_format_value(bound)), count
+            yield f"{self.name}_sum", labels, round(total, 6)
+            yield f"{self.name}_count", labels, counts[-1]
+
+
+class Registry:
+    """
+    指标注册表
+
+    计数器和直方图在调用处更新；各模块已有的统计（缓存命中、接口重试等）通过collector
+    在导出时读取，不重复计数。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """
+        注册导出时调用的函数
+
+        collector() 返回 [(指标名, 类型, 说明, [(标签字典, 值), ...]), ...]
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """按Prometheus文本格式（0.0.4）导出所有指标"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                log.warning("指标采集失败", extra={"collector": getattr(collector, '__name__', str(collector)),
+                                                  "error": str(e)})
+                continue
+            for name, metric_type, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram('pipeline_stage_duration_seconds', '抽取流水线各阶段耗时（秒）', ('stage',))
+STAGE_ERRORS = registry.counter('pipeline_stage_errors_total', '抽取流水线各阶段抛出异常的次数', ('stage',))
+LLM_TOKENS = registry.counter('llm_tokens_total', '大模型接口返回的token用量', ('model', 'kind'))
+HTTP_SECONDS = registry.histogram('http_request_duration_seconds', 'HTTP请求处理耗时（秒）',
+                                  ('method', 'endpoint', 'status'))
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    记录一个阶段的耗时：写入阶段耗时直方图，出错时增加错误计数，并输出一条debug日志
+
+    用法:
+        with span("ocr", file_id=file_id):
+            ...
+    """
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if failed:
+            STAGE_ERRORS.inc(stage=stage)
+        log.debug("阶段完成", extra=dict(fields, stage=stage, duration_ms=round(elapsed * 1000, 2), failed=failed))
+
+
+def timed(stage):
+    """把整个函数（同步或异步）作为一个阶段计时的装饰器"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_token_usage(model, usage):
+    """记录方舟接口返回的completion.usage"""
+    if usage is None:
+        return
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        value = getattr(usage, kind, None)
+        if value:
+            LLM_TOKENS.inc(value, model=model, kind=kind[:-len('_tokens')])
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import threading
+from config import Config
+from storage import atomic_write_json, file_sha256
+
+
+class OCRCache:
+    """
+    按内容寻址的OCR结果缓存
+
+    缓存键由文件内容的sha256和OCR参数（version、parse_mode、table_mode、页码范围等）
+    共同决定，同一文件在不同任务下、或以不同文件名上传都能命中缓存。
+    缓存条目保存在磁盘上，总大小超过上限时按最近使用时间淘汰（LRU）。
+    """
+
+    def __init__(self, cache_folder=None, max_bytes=None):
+        """
+        参数:
+            cache_folder: 缓存目录
+            max_bytes: 缓存总大小上限（字节）
+        """
+        self.cache_folder = cache_folder or Config.OCR_CACHE_FOLDER
+        self.max_bytes = max_bytes if max_bytes is not None else Config.OCR_CACHE_MAX_BYTES
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.cache_folder, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._scan())
+
+    @staticmethod
+    def make_key(file_path, params, content_hash=None):
+        """
+        生成缓存键
+
+        参数:
+            file_path: 文件路径
+            params: OCR请求参数（不含文件内容本身）
+            content_hash: 已经计算好的文件sha256，避免重复读取文件
+        """
+        content_hash = content_hash or file_sha256(file_path)
+        params_str = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{content_hash}:{params_str}".encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_folder, key[:2], f"{key}.json")
+
+    def _scan(self):
+        """遍历缓存目录，返回 (路径, 大小, 最近使用时间) 列表"""
+        entries = []
+        for root, _, filenames in os.walk(self.cache_folder):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, key):
+        """
+        读取缓存
+
+        返回:
+            {"detail": 解析JSON, "markdown": markdown文本}，未命中返回None
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            # 更新修改时间作为最近使用时间，供LRU淘汰使用
+            os.utime(path, None)
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, detail, markdown):
+        """写入缓存并在超过大小上限时淘汰最久未使用的条目"""
+        path = self._entry_path(key)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        atomic_write_json(path, {"detail": detail, "markdown": markdown}, indent=None)
+        with self._lock:
+            self._total_bytes += os.path.getsize(path) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict(keep=path)
+
+    def _evict(self, keep=None):
+        """淘汰最久未使用的条目直到总大小低于上限，调用方需持有锁"""
+        entries = sorted(self._scan(), key=lambda x: x[2])
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        """返回命中/未命中等统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes
+            }
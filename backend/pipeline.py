@@ -0,0 +1,306 @@
+import os
+import json
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+import ai
+from jobs import JOB_RUNNING, JOB_DONE, JOB_FAILED
+from catalog import catalog, allowed_file, TASK_EXTRACTING, TASK_EXTRACTED, TASK_FAILED
+from result_cache import result_cache, CHANNEL_DISPLAY_NAMES
+from schema_store import sub_schema, diff_schemas, load_result_schema, save_result_schema, clear_result_schema
+from logger import get_logger
+from metrics import span, timed
+import events
+
+log = get_logger('pipeline')
+
+
+def task_files(task_id):
+    """
+    列出任务目录下所有可处理的文件
+
+    返回:
+        文件ID列表（<task_id>/<文件名>），任务目录不存在时返回None
+    """
+    task_folder = os.path.join(Config.UPLOAD_FOLDER, task_id)
+    if not os.path.exists(task_folder):
+        return None
+    return [os.path.join(task_id, filename) for filename in sorted(os.listdir(task_folder)) if allowed_file(filename)]
+
+
+def _is_failed_result(result):
+    """ai模块在文件缺失时返回None，JSON解析失败时返回带raw_text的错误字典"""
+    return result is None or (isinstance(result, dict) and "error" in result and "raw_text" in result)
+
+
+def _markdown_channel(file_ids, system_prompt, user_prompt, json_save_path, schema=None, on_field=None):
+    """markdown渠道：OCR解析后交给文本模型抽取"""
+    return functools.partial(
+        ai.process_multiple_files,
+        file_ids=file_ids,
+        system_prompt=system_prompt,
+        question=user_prompt,
+        output_json=True,
+        json_save_path=json_save_path,
+        schema=schema,
+        on_field=on_field
+    )
+
+
+def _multimodal_channel(file_ids, system_prompt, user_prompt, json_save_path, schema=None, on_field=None):
+    """多模态渠道：图片直接交给视觉模型抽取"""
+    return functools.partial(
+        ai.multimodal_completion,
+        file_ids=file_ids,
+        prompt=user_prompt,
+        output_json=True,
+        json_save_path=json_save_path,
+        schema=schema,
+        on_field=on_field
+    )
+
+
+# 抽取渠道注册表：策略名 -> (允许的文件扩展名, 构造渠道调用的函数, 结果文件名)
+# 新增模型渠道只需在这里注册，各渠道并发执行，不会线性增加耗时；
+# 构造函数的on_field参数接收流式解析出的字段，用于推送抽取进度
+EXTRACT_CHANNELS = {
+    "markdown": (Config.MARKDOWN_ALLOWED_EXTENSIONS, _markdown_channel, "markdown_result.json"),
+    "multi-modal": (Config.MULTIMODAL_ALLOWED_EXTENSIONS, _multimodal_channel, "multimodal_result.json"),
+}
+
+
+# 支持的抽取策略
+EXTRACT_STRATEGIES = tuple(EXTRACT_CHANNELS)
+
+
+# 渠道调用都是阻塞的网络请求，放在有界线程池中并发执行
+channel_executor = ThreadPoolExecutor(max_workers=Config.CHANNEL_MAX_WORKERS)
+
+
+async def _run_channel(strategy, call, report, timeout=None):
+    """
+    在线程池中执行单个渠道，超时或出错只影响该渠道本身
+
+    返回:
+        渠道结果，失败时返回None
+    """
+    timeout = timeout or Config.CHANNEL_TIMEOUT
+    loop = asyncio.get_running_loop()
+    report(strategy, JOB_RUNNING)
+    try:
+        result = await asyncio.wait_for(loop.run_in_executor(channel_executor, call), timeout)
+        if _is_failed_result(result):
+            raise ValueError(f"{strategy}渠道结果无效")
+    except asyncio.TimeoutError:
+        # 线程中的请求无法被强制中断，这里只是不再等待它的结果
+        log.warning("渠道处理超时", extra={"strategy": strategy, "timeout": timeout})
+        report(strategy, JOB_FAILED, f"处理超时({timeout}s)")
+        return None
+    except Exception as e:
+        log.error("渠道处理出错", extra={"strategy": strategy, "error": str(e)})
+        report(strategy, JOB_FAILED, e)
+        return None
+    report(strategy, JOB_DONE)
+    log.info("渠道处理完成", extra={"strategy": strategy})
+    return result
+
+
+def _reusable_result(result_path, file_ids):
+    """
+    读取可以增量更新的渠道结果：结果存在、不是错误结果，且比任务中所有文件都新
+
+    返回:
+        渠道结果字典，不可复用时返回None（需要全量抽取）
+    """
+    try:
+        result_mtime = os.path.getmtime(result_path)
+        with open(result_path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if not isinstance(result, dict) or _is_failed_result(result):
+        return None
+    # 文件在上次抽取之后被重新上传过，旧结果不再可信
+    for file_id in file_ids:
+        if os.path.getmtime(os.path.join(Config.UPLOAD_FOLDER, file_id)) > result_mtime:
+            return None
+    return result
+
+
+async def _run_full_channel(strategy, call, report, result_path, schema_data):
+    """全量抽取一个渠道，成功后记录结果所用的schema"""
+    clear_result_schema(result_path)
+    result = await _run_channel(strategy, call, report)
+    if result is not None:
+        save_result_schema(result_path, schema_data)
+    return result
+
+
+async def _run_incremental_channel(strategy, call, report, existing, result_path, schema_data, schema_diff):
+    """
+    只抽取新增和修改的字段，合并到已有的渠道结果中，合并后记录结果所用的schema
+
+    参数:
+        call: 使用只包含变化字段的schema构造的渠道调用，没有需要重新抽取的字段时为None
+        existing: 已有的渠道结果
+        result_path: 渠道结果的保存路径
+        schema_data: 当前的schema
+        schema_diff: 已有结果所用的schema和当前schema的差异
+
+    返回:
+        合并后的渠道结果，失败时返回None
+    """
+    fields = schema_diff['added'] + schema_diff['modified']
+    clear_result_schema(result_path)
+    if call is not None:
+        partial = await _run_channel(strategy, call, report)
+        if partial is None:
+            return None
+    else:
+        report(strategy, JOB_RUNNING)
+
+    # 删除的字段和重新抽取的字段不再保留旧值
+    stale = set(schema_diff['removed']) | set(fields)
+    merged = {k: v for k, v in existing.items() if k not in stale}
+    if call is not None:
+        merged.update({k: v for k, v in partial.items() if k in fields})
+    # 按schema中的字段顺序排列，schema之外的字段放在最后
+    order = {k: i for i, k in enumerate(schema_data.get('properties', {}))}
+    merged = dict(sorted(merged.items(), key=lambda item: order.get(item[0], len(order))))
+    ai.save_extract_result(result_path, merged)
+    save_result_schema(result_path, schema_data)
+    if call is None:
+        report(strategy, JOB_DONE)
+    return merged
+
+
+# 添加异步处理函数
+@timed("process_with_ai")
+async def process_with_ai(task_id, schema_data,extract_strategy=["markdown","multi-modal"],reporter=None,localize=True,schema_diff=None):
+    """
+    使用AI处理任务，各抽取渠道并发执行
+    
+    参数:
+        task_id: 任务ID
+        schema_data: Schema数据
+        extract_strategy: 抽取策略列表，见EXTRACT_CHANNELS
+        reporter: 进度回调 reporter(strategy, status, error=None)，strategy为None时表示整个任务
+        localize: 是否在渠道完成后计算原文位置（批量流水线中由单独的阶段完成）
+        schema_diff: 和上一版本schema的差异（见schema_store.diff_schemas），提供时允许增量抽取：
+            已有渠道结果记录了生成它所用的schema时，按该schema和当前schema的差异只重新抽取新增和修改的字段，
+            结果合并到已有的渠道结果中；没有记录或差异无法增量处理时该渠道全量抽取
+            （上次抽取失败、超时或还没完成时，已有结果可能不是由上一版本schema生成的）
+
+    返回:
+        {策略名: 渠道结果}，失败的渠道结果为None
+    """
+    def report(strategy, status, error=None):
+        if strategy is None:
+            events.publish(task_id, events.EVENT_FAILED, {"error": str(error)})
+        else:
+            events.publish(task_id, events.EVENT_CHANNEL,
+                           {"strategy": strategy, "status": status, "error": None if error is None else str(error)})
+        if reporter:
+            reporter(strategy, status, error)
+
+    try:
+        # 从schema中提取提示词，如果没有则使用默认值
+        system_prompt = schema_data.get('system_prompt', '你是一个专业的文档分析助手，擅长从文档中提取结构化信息')
+        user_prompt = schema_data.get('user_prompt', '请分析这个文档并提取关键信息,并以JSON格式返回，jsonSchema如下：{jsonSchema}')
+        prompt_template = user_prompt
+        user_prompt = user_prompt.format(jsonSchema=json.dumps(schema_data, ensure_ascii=False))
+        # print(user_prompt)
+        # 获取任务相关的文件
+        files = task_files(task_id)
+        if files is None:
+            log.warning("任务文件夹不存在", extra={"task_id": task_id})
+            report(None, JOB_FAILED, f"任务文件夹不存在: {task_id}")
+            return {}
+        
+        if not files:
+            log.warning("任务没有可处理的文件", extra={"task_id": task_id})
+            report(None, JOB_FAILED, f"任务 {task_id} 没有可处理的文件")
+            catalog.update_task(task_id, TASK_FAILED, error=f"任务 {task_id} 没有可处理的文件")
+            return {}
+        catalog.update_task(task_id, TASK_EXTRACTING)
+        
+        # 确保结果目录存在
+        extract_result_folder = os.path.join(Config.EXTRACT_RESULTS_FOLDER, task_id)
+        os.makedirs(extract_result_folder, exist_ok=True)
+
+        # 根据文件扩展名为每个渠道过滤文件列表，并发执行所有渠道
+        pending = {}
+        for strategy in extract_strategy:
+            if strategy not in EXTRACT_CHANNELS:
+                continue
+            extensions, build_channel, result_name = EXTRACT_CHANNELS[strategy]
+            channel_files = [file_id for file_id in files if '.' in file_id and file_id.rsplit('.', 1)[1].lower() in extensions]
+            if not channel_files:
+                continue
+            result_path = os.path.join(extract_result_folder, result_name)
+            channel_name = os.path.splitext(result_name)[0]
+            on_field = events.field_publisher(task_id, strategy, CHANNEL_DISPLAY_NAMES.get(channel_name, channel_name))
+            existing, channel_diff = None, None
+            if schema_diff is not None:
+                existing = _reusable_result(result_path, channel_files)
+                if existing is not None:
+                    channel_diff = diff_schemas(load_result_schema(result_path), schema_data)
+            if channel_diff is None:
+                log.info("开始处理渠道", extra={"task_id": task_id, "strategy": strategy, "files": channel_files})
+                call = build_channel(channel_files, system_prompt, user_prompt, result_path, schema=schema_data,
+                                     on_field=on_field)
+                pending[strategy] = _run_full_channel(strategy, call, report, result_path, schema_data)
+            else:
+                fields = channel_diff['added'] + channel_diff['modified']
+                log.info("开始增量处理渠道", extra={"task_id": task_id, "strategy": strategy, "fields": fields})
+                call = None
+                if fields:
+                    partial_schema = sub_schema(schema_data, fields)
+                    partial_prompt = prompt_template.format(jsonSchema=json.dumps(partial_schema, ensure_ascii=False))
+                    call = build_channel(channel_files, system_prompt, partial_prompt, None, schema=partial_schema,
+                                         on_field=on_field)
+                pending[strategy] = _run_incremental_channel(strategy, call, report, existing, result_path,
+                                                             schema_data, channel_diff)
+
+        results = dict(zip(pending.keys(), await asyncio.gather(*pending.values())))
+
+        # 所有渠道完成后再基于markdown结果计算原文位置
+        if localize and results.get("markdown") is not None:
+            ai.extract_text_locations(task_id)
+
+        if any(result is not None for result in results.values()):
+            # 预先计算各字段在渠道间的一致性，比对页面和批量统计直接读取
+            if localize:
+                with span("field_diff", task_id=task_id):
+                    result_cache.save_field_diff(task_id)
+            catalog.update_task(task_id, TASK_EXTRACTED)
+            # 批量流水线中原文定位完成后才算结束，由定位阶段发布done事件
+            if localize:
+                events.publish(task_id, events.EVENT_DONE,
+                               {"channels": {k: v is not None for k, v in results.items()}})
+        else:
+            catalog.update_task(task_id, TASK_FAILED, error="所有抽取渠道均失败")
+            events.publish(task_id, events.EVENT_FAILED, {"error": "所有抽取渠道均失败"})
+        log.info("任务处理完成", extra={"task_id": task_id,
+                                      "channels": {k: v is not None for k, v in results.items()}})
+        return results
+        
+    except Exception as e:
+        log.exception("AI处理出错", extra={"task_id": task_id})
+        report(None, JOB_FAILED, e)
+        catalog.update_task(task_id, TASK_FAILED, error=e)
+        return {}
+
+
+def run_extraction_job(task_id, schema_data, extract_strategy, reporter, localize=True, schema_diff=None):
+    """在后台线程中运行异步的process_with_ai"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(process_with_ai(task_id, schema_data, extract_strategy,
+                                                       reporter=reporter, localize=localize,
+                                                       schema_diff=schema_diff))
+    finally:
+        loop.close()
+
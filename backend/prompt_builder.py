@@ -0,0 +1,178 @@
+import re
+import json
+from config import Config
+
+# 文件内容在提示词中的模板
+FILE_TEMPLATE = """[file name]: {file_name}
+[file content begin]
+{file_content}
+[file content end]"""
+
+_IMAGE_RE = re.compile(r'!\[[^\]]*\]\([^)]*\)')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+_CJK_RE = re.compile(r'[　-〿㐀-䶿一-鿿豈-﫿＀-￯]')
+
+
+def estimate_tokens(text):
+    """
+    估算文本的token数：中日文字符按每字1个token，其余字符按每4个字符1个token，
+    比实际分词结果略大，保证不会超出上下文
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def compact_page(page):
+    """
+    把一页OCR结果压缩为提示词文本：使用页面markdown，去掉图片链接和多余空行，
+    不包含坐标等定位信息；没有markdown时使用文本块的文字
+    """
+    text = page.get('page_md') or '\n'.join(
+        block.get('text', '') for block in page.get('textblocks', []) if block.get('text'))
+    text = _IMAGE_RE.sub('', text)
+    text = '\n'.join(line.strip() for line in text.splitlines())
+    return _BLANK_LINES_RE.sub('\n', text).strip()
+
+
+def compact_document(detail):
+    """document_parse的结果 -> 每页一个压缩后的文本"""
+    return [compact_page(page) for page in detail]
+
+
+def _cut_length(line, budget):
+    """line中估算token数（含换行）不超过budget的最长前缀的字符数，至少为1"""
+    low, high = 1, len(line)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(line[:middle]) + 1 <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _split_oversized(text, budget):
+    """单页超过预算时按行切分，单行仍然超过预算时按token预算切分，片段保持原文顺序"""
+    pieces, current, current_tokens = [], [], 0
+    for line in text.splitlines():
+        tokens = estimate_tokens(line) + 1
+        if tokens > budget:
+            # 超长的行先输出之前积攒的行，再按预算硬切，最后一段和后面的行一起装箱
+            if current:
+                pieces.append('\n'.join(current))
+                current, current_tokens = [], 0
+            while tokens > budget:
+                cut = _cut_length(line, budget)
+                pieces.append(line[:cut])
+                line = line[cut:]
+                tokens = estimate_tokens(line) + 1
+        if current and current_tokens + tokens > budget:
+            pieces.append('\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += tokens
+    if current:
+        pieces.append('\n'.join(current))
+    return pieces
+
+
+def build_chunks(files, budget):
+    """
+    把多个文件的页面文本按token预算装箱成若干提示词片段，尽量不拆开同一页
+
+    参数:
+        files: [(文件名, [页面文本, ...]), ...]
+        budget: 每个片段的文件内容token上限
+
+    返回:
+        [提示词中的文件内容, ...]，内容不超过预算时只有一个片段
+    """
+    units = []
+    for file_name, pages in files:
+        for page_number, text in enumerate(pages, start=1):
+            if not text:
+                continue
+            header = f"--- 第{page_number}页 ---\n" if len(pages) > 1 else ''
+            overhead = estimate_tokens(FILE_TEMPLATE.format(file_name=file_name, file_content=header))
+            for piece in _split_oversized(text, max(1, budget - overhead)):
+                units.append((file_name, header + piece))
+
+    chunks, current, current_tokens = [], [], 0
+    for file_name, text in units:
+        tokens = estimate_tokens(FILE_TEMPLATE.format(file_name=file_name, file_content=text))
+        if current and current_tokens + tokens > budget:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append((file_name, text))
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+
+    rendered = []
+    for chunk in chunks:
+        # 同一文件的相邻片段合并到一个文件模板中
+        sections = []
+        for file_name, text in chunk:
+            if sections and sections[-1][0] == file_name:
+                sections[-1][1].append(text)
+            else:
+                sections.append((file_name, [text]))
+        rendered.append('\n'.join(FILE_TEMPLATE.format(file_name=name, file_content='\n'.join(texts))
+                                  for name, texts in sections))
+    return rendered
+
+
+def content_budget(system_prompt, question, max_tokens):
+    """模型上下文中留给文件内容的token数：扣除系统提示词、问题（含schema）、输出长度和安全余量"""
+    reserved = estimate_tokens(system_prompt) + estimate_tokens(question) + max_tokens
+    budget = int((Config.LLM_CONTEXT_TOKENS - reserved) * (1 - Config.PROMPT_SAFETY_MARGIN))
+    return max(budget, Config.PROMPT_MIN_CHUNK_TOKENS)
+
+
+def _is_empty(value):
+    return value is None or value == '' or value == [] or value == {}
+
+
+def merge_results(results):
+    """
+    按文档顺序合并各片段的抽取结果
+
+    标量字段取第一个非空的值；数组字段按顺序拼接并去掉重复元素；
+    对象字段递归合并。合并结果只依赖片段顺序，与各片段完成的先后无关。
+    """
+    merged = {}
+    for result in results:
+        for key, value in result.items():
+            if _is_empty(value):
+                merged.setdefault(key, value)
+                continue
+            current = merged.get(key)
+            if _is_empty(current):
+                merged[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(current, list) and isinstance(value, list):
+                seen = {json.dumps(item, sort_keys=True, ensure_ascii=False) for item in current}
+                for item in value:
+                    item_key = json.dumps(item, sort_keys=True, ensure_ascii=False)
+                    if item_key not in seen:
+                        seen.add(item_key)
+                        current.append(item)
+            elif isinstance(current, dict) and isinstance(value, dict):
+                merged[key] = merge_results([current, value])
+    return merged
+
+
+def conflicting_fields(results):
+    """
+    各文件结果中取值不同的顶层字段（忽略空值）
+
+    返回:
+        {字段名: [各文件的不同取值, ...]}，按字段第一次出现的顺序
+    """
+    candidates = {}
+    for result in results:
+        for key, value in result.items():
+            if _is_empty(value):
+                continue
+            values = candidates.setdefault(key, {})
+            values.setdefault(json.dumps(value, sort_keys=True, ensure_ascii=False), value)
+    return {key: list(values.values()) for key, values in candidates.items() if len(values) > 1}
@@ -0,0 +1,254 @@
+import time
+import random
+import threading
+from collections import deque
+from config import Config
+from logger import get_logger
+
+log = get_logger('resilience')
+
+
+class RetryableError(Exception):
+    """可以重试的外部接口错误（限流、服务端错误、网络错误）"""
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发出直接失败"""
+
+
+class TokenBucket:
+    """令牌桶限流：每秒补充rate个令牌，最多积攒burst个"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，没有令牌时阻塞等待；rate<=0表示不限流"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败达到阈值后打开，reset_timeout秒内的请求直接失败；
+    之后进入半开状态只放行一个试探请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+            # 半开状态同一时间只放行一个试探请求
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class ApiGuard:
+    """
+    外部接口调用保护：限流、并发上限、指数退避重试、熔断和耗时统计
+
+    每个模型/接口一个实例，通过get_guard获取，同一进程内所有线程共享。
+    """
+
+    # 保留最近多少次调用的耗时用于计算分位数
+    LATENCY_WINDOW = 1000
+
+    def __init__(self, name, rate, burst=None, max_concurrency=None, max_retries=None,
+                 backoff_base=None, backoff_max=None, failure_threshold=None, reset_timeout=None):
+        """
+        参数:
+            name: 名称，例如 "ark:doubao-1-5-pro-32k-250115"、"visual:ocr_pdf"
+            rate: 每秒请求数上限，0表示不限流
+            burst: 令牌桶容量
+            max_concurrency: 同时进行的请求数上限
+            max_retries: 可重试错误的最大重试次数
+            backoff_base/backoff_max: 退避等待时间的基数和上限（秒）
+            failure_threshold/reset_timeout: 熔断阈值（连续失败次数）和熔断时长（秒）
+        """
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = threading.BoundedSemaphore(max_concurrency or Config.API_MAX_CONCURRENCY)
+        self.max_retries = Config.API_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = backoff_base or Config.API_BACKOFF_BASE
+        self.backoff_max = backoff_max or Config.API_BACKOFF_MAX
+        self.breaker = CircuitBreaker(failure_threshold or Config.API_CIRCUIT_THRESHOLD,
+                                      reset_timeout or Config.API_CIRCUIT_RESET)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+        self.latencies = deque(maxlen=self.LATENCY_WINDOW)
+
+    def backoff(self, attempt):
+        """指数退避加全抖动，避免大量请求在同一时刻重试"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def call(self, func, *args, is_retryable=None, **kwargs):
+        """
+        执行一次外部调用，可重试的错误按指数退避重试
+
+        参数:
+            func: 实际发起请求的函数
+            is_retryable: 判断异常是否可以重试的函数，默认只重试RetryableError
+
+        返回:
+            func的返回值；重试耗尽或熔断时抛出最后一次的异常或CircuitOpenError
+        """
+        is_retryable = is_retryable or (lambda e: isinstance(e, RetryableError))
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                with self._lock:
+                    self.rejected += 1
+                raise CircuitOpenError(f"{self.name} 连续失败，已暂停请求{self.breaker.reset_timeout}秒")
+
+            waited = self.bucket.acquire()
+            with self.semaphore:
+                start = time.monotonic()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    self._record(time.monotonic() - start, waited, failed=True)
+                    if not is_retryable(e):
+                        # 参数错误等不可重试的错误说明服务本身可用，不计入熔断
+                        self.breaker.record_success()
+                        raise
+                    self.breaker.record_failure()
+                    if attempt >= self.max_retries:
+                        raise
+                    error = e
+                else:
+                    self._record(time.monotonic() - start, waited)
+                    self.breaker.record_success()
+                    return result
+
+            delay = self.backoff(attempt)
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            log.warning("请求失败，稍后重试", extra={"api": self.name, "attempt": attempt,
+                                                   "delay": round(delay, 2), "error": str(error)})
+            time.sleep(delay)
+
+    def _record(self, latency, waited, failed=False):
+        with self._lock:
+            self.calls += 1
+            self.throttled_seconds += waited
+            self.latencies.append(latency)
+            if failed:
+                self.failures += 1
+
+    def stats(self):
+        """返回调用次数、失败/重试次数、熔断状态和最近调用的耗时分位数"""
+        with self._lock:
+            latencies = sorted(self.latencies)
+
+            def percentile(p):
+                if not latencies:
+                    return None
+                return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 4)
+
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "throttled_seconds": round(self.throttled_seconds, 4),
+                "circuit": self.breaker.state,
+                "latency_p50": percentile(0.5),
+                "latency_p99": percentile(0.99),
+            }
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(name, **options):
+    """
+    获取或创建指定名称的ApiGuard，第一次创建时使用options或配置中的默认值
+
+    "ark:<模型>" 使用ARK_*配置，可以通过ARK_MODEL_RATE_LIMITS为单个模型指定每秒请求数；
+    "visual:<接口>" 使用OCR_*配置。
+    """
+    with _guards_lock:
+        guard = _guards.get(name)
+        if guard is None:
+            if name.startswith('ark:'):
+                defaults = {
+                    "rate": Config.ARK_MODEL_RATE_LIMITS.get(name[4:], Config.ARK_RATE_LIMIT),
+                    "burst": Config.ARK_RATE_BURST,
+                    "max_concurrency": Config.ARK_MAX_CONCURRENCY,
+                }
+            elif name.startswith('visual:'):
+                defaults = {
+                    "rate": Config.OCR_RATE_LIMIT,
+                    "burst": Config.OCR_RATE_BURST,
+                    "max_concurrency": Config.OCR_MAX_CONCURRENCY,
+                }
+            else:
+                defaults = {"rate": 0}
+            defaults.update(options)
+            guard = _guards[name] = ApiGuard(name, **defaults)
+        return guard
+
+
+def guard_stats():
+    """所有外部接口的调用统计 {名称: stats}"""
+    with _guards_lock:
+        guards = list(_guards.values())
+    return {guard.name: guard.stats() for guard in guards}
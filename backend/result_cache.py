@@ -0,0 +1,186 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from config import Config
+from storage import atomic_write_json
+from field_diff import diff_fields, load_task_schema, schema_path_for
+from schema_store import RESULT_SCHEMA_SUFFIX
+
+# 渠道结果文件名和页面上显示的渠道名
+CHANNEL_DISPLAY_NAMES = {"markdown_result": "DeepSeek-R1", "multimodal_result": "豆包vision"}
+# 没有任务自己的渠道结果时使用的示例结果目录
+FALLBACK_RESULT_FOLDER = "invoice"
+# 原文位置和字段比对结果，和渠道结果放在同一目录但不是渠道
+OP_RESULT_NAME = "op"
+FIELD_DIFF_NAME = "field_diff"
+
+
+class ResultCache:
+    """
+    多渠道抽取结果缓存
+
+    每个任务的响应（渠道结果、原文位置、字段比对结果、默认核对结果）只读取和序列化一次，
+    之后直接返回内存中的JSON字节和对应的ETag。抽取结果都通过原子替换写入，
+    每次写入都会改变结果目录的修改时间，所以只需要stat结果目录就能判断缓存是否过期；
+    本进程内的写入还会通过invalidate立即清除缓存。
+    """
+
+    def __init__(self, results_folder=None, max_entries=None):
+        self.results_folder = results_folder or Config.EXTRACT_RESULTS_FOLDER
+        self.max_entries = max_entries or Config.RESULT_CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _signature(self, task_id):
+        """结果目录及示例目录的修改时间，目录不存在时为None"""
+        signature = []
+        for folder in (task_id, FALLBACK_RESULT_FOLDER):
+            try:
+                signature.append(os.stat(os.path.join(self.results_folder, folder)).st_mtime_ns)
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def get(self, task_id):
+        """
+        获取任务的多渠道结果
+
+        返回:
+            {"body": JSON字节, "etag": ETag, "last_modified": 最后修改时间戳}
+        """
+        signature = self._signature(task_id)
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None and entry["signature"] == signature:
+                self._entries.move_to_end(task_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        payload, last_modified = self._load(task_id)
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        entry = {
+            "signature": signature,
+            "body": body,
+            "etag": hashlib.sha256(body).hexdigest()[:32],
+            "last_modified": last_modified
+        }
+        with self._lock:
+            self._entries[task_id] = entry
+            self._entries.move_to_end(task_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, task_id):
+        with self._lock:
+            self._entries.pop(task_id, None)
+
+    def invalidate_path(self, result_path):
+        """按写入的结果文件路径清除对应任务的缓存"""
+        self.invalidate(os.path.basename(os.path.dirname(os.path.abspath(result_path))))
+
+    def read_results(self, task_id):
+        """
+        读取任务的渠道结果和op.json
+
+        返回:
+            (渠道列表, op.json内容, 读取的文件路径列表)
+        """
+        channels = []
+        op_data = {}
+        folder = os.path.join(self.results_folder, task_id)
+        channel_files = self._list_json(folder)
+        # 如果没有找到特定文档的渠道文件，则使用示例渠道文件
+        if not channel_files:
+            channel_files = self._list_json(os.path.join(self.results_folder, FALLBACK_RESULT_FOLDER))
+
+        for file_path in channel_files:
+            channel_name = os.path.splitext(os.path.basename(file_path))[0]
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if channel_name == OP_RESULT_NAME:
+                op_data = data
+            else:
+                channels.append({
+                    "channel": CHANNEL_DISPLAY_NAMES.get(channel_name, channel_name),
+                    "data": data
+                })
+        return channels, op_data, channel_files
+
+    @staticmethod
+    def _diff_source(task_id, files):
+        """字段比对结果依赖的文件及其修改时间，任一文件变化时比对结果过期"""
+        source = {os.path.basename(path): os.stat(path).st_mtime_ns for path in files}
+        schema_path = schema_path_for(task_id)
+        if schema_path:
+            source["schema:" + os.path.basename(schema_path)] = os.stat(schema_path).st_mtime_ns
+        return source
+
+    def save_field_diff(self, task_id):
+        """
+        在抽取完成后计算并保存字段比对结果，页面加载和批量统计时直接读取
+
+        返回:
+            {"fields", "summary"}
+        """
+        channels, op_data, files = self.read_results(task_id)
+        folder = os.path.join(self.results_folder, task_id)
+        if not files or os.path.dirname(files[0]) != folder:
+            return None
+        diff = diff_fields(channels, op_data.get("onThePage"), load_task_schema(task_id))
+        atomic_write_json(os.path.join(folder, f"{FIELD_DIFF_NAME}.json"),
+                          dict(diff, source=self._diff_source(task_id, files)))
+        self.invalidate(task_id)
+        return diff
+
+    def _field_diff(self, task_id, channels, op_data, files):
+        """优先使用抽取时保存的比对结果，过期或不存在时重新计算"""
+        try:
+            with open(os.path.join(self.results_folder, task_id, f"{FIELD_DIFF_NAME}.json"), 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get("source") == self._diff_source(task_id, files):
+                return {"fields": saved["fields"], "summary": saved["summary"]}
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+        return diff_fields(channels, op_data.get("onThePage"), load_task_schema(task_id))
+
+    def _load(self, task_id):
+        """读取渠道结果和op.json，返回 (响应内容, 最后修改时间)"""
+        channels, op_data, files = self.read_results(task_id)
+        last_modified = max((os.path.getmtime(path) for path in files), default=0)
+
+        # 生成默认的人类人工核对结果（使用第一个渠道的结果作为默认值）
+        default_decision = channels[0]["data"] if channels else {}
+        return {
+            "channels": channels,
+            "onThePage": op_data.get("onThePage", []),
+            "normBox": op_data.get("normBox", []),
+            "defaultDecision": default_decision,
+            "fieldDiff": self._field_diff(task_id, channels, op_data, files)
+        }, last_modified
+
+    @staticmethod
+    def _list_json(folder):
+        if not os.path.isdir(folder):
+            return []
+        return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                      if name.endswith('.json') and name != f"{FIELD_DIFF_NAME}.json"
+                      and not name.endswith(RESULT_SCHEMA_SUFFIX))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+result_cache = ResultCache()
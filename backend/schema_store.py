@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from config import Config
+from storage import atomic_write_json
+
+_lock = threading.Lock()
+
+# 渠道结果旁记录生成该结果所用schema的文件后缀，例如 markdown_result.json -> markdown_result.schema.json
+RESULT_SCHEMA_SUFFIX = '.schema.json'
+
+
+def diff_schemas(old_schema, new_schema):
+    """
+    比较两个版本schema的顶层字段
+
+    提示词、标题等properties之外的内容变化会影响所有字段的抽取，此时返回None表示需要全量重新抽取。
+
+    返回:
+        {"added": [...], "removed": [...], "modified": [...]}，或None
+    """
+    if not isinstance(old_schema, dict) or not isinstance(new_schema, dict):
+        return None
+    ignored = ('properties', 'required')
+    if {k: v for k, v in old_schema.items() if k not in ignored} != \
+            {k: v for k, v in new_schema.items() if k not in ignored}:
+        return None
+    old_properties = old_schema.get('properties', {})
+    new_properties = new_schema.get('properties', {})
+    old_required = set(old_schema.get('required', []))
+    new_required = set(new_schema.get('required', []))
+    return {
+        "added": [k for k in new_properties if k not in old_properties],
+        "removed": [k for k in old_properties if k not in new_properties],
+        "modified": [k for k in new_properties if k in old_properties and (
+            old_properties[k] != new_properties[k] or (k in old_required) != (k in new_required))]
+    }
+
+
+def sub_schema(schema, fields):
+    """只保留指定字段的schema，用于增量抽取的提示词"""
+    properties = schema.get('properties', {})
+    return dict(schema,
+                properties={k: properties[k] for k in fields if k in properties},
+                required=[k for k in schema.get('required', []) if k in fields])
+
+
+def schema_hash(schema):
+    """schema内容的哈希，键的顺序不影响结果"""
+    return hashlib.sha256(json.dumps(schema, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _result_schema_path(result_path):
+    return os.path.splitext(result_path)[0] + RESULT_SCHEMA_SUFFIX
+
+
+def save_result_schema(result_path, schema):
+    """渠道结果写入成功后记录生成它所用的schema，增量抽取时以此为基准计算差异"""
+    atomic_write_json(_result_schema_path(result_path), {"hash": schema_hash(schema), "schema": schema})
+
+
+def load_result_schema(result_path):
+    """
+    读取生成渠道结果所用的schema
+
+    返回:
+        schema，没有记录或记录损坏时返回None
+    """
+    try:
+        with open(_result_schema_path(result_path), 'r', encoding='utf-8') as f:
+            record = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if not isinstance(record, dict) or record.get('hash') != schema_hash(record.get('schema')):
+        return None
+    return record['schema']
+
+
+def clear_result_schema(result_path):
+    """
+    渠道开始重新抽取前删除记录
+
+    抽取失败、超时后线程仍写入结果或进程中途退出时，结果文件和记录可能不一致，
+    没有记录的结果下次只能全量抽取
+    """
+    try:
+        os.remove(_result_schema_path(result_path))
+    except FileNotFoundError:
+        pass
+
+
+def _versions_folder(task_id):
+    return os.path.join(Config.SCHEMA_VERSIONS_FOLDER, task_id)
+
+
+def list_versions(task_id):
+    """列出任务schema的历史版本（不含schema内容），按版本号升序"""
+    folder = _versions_folder(task_id)
+    if not os.path.isdir(folder):
+        return []
+    versions = []
+    for filename in os.listdir(folder):
+        if filename.endswith('.json'):
+            with open(os.path.join(folder, filename), 'r', encoding='utf-8') as f:
+                version = json.load(f)
+            version.pop('schema', None)
+            versions.append(version)
+    versions.sort(key=lambda x: x['version'])
+    return versions
+
+
+def save_task_schema(task_id, schema_data):
+    """
+    保存任务的schema并记录一个新版本
+
+    返回:
+        (版本号, 和上一版本的差异)，差异为None表示没有上一版本或需要全量抽取
+    """
+    schema_path = os.path.join(Config.SCHEMA_FOLDER, f"{task_id}.json")
+    with _lock:
+        previous = None
+        if os.path.exists(schema_path):
+            try:
+                with open(schema_path, 'r', encoding='utf-8') as f:
+                    previous = json.load(f)
+            except json.JSONDecodeError:
+                previous = None
+        diff = diff_schemas(previous, schema_data)
+
+        folder = _versions_folder(task_id)
+        os.makedirs(folder, exist_ok=True)
+        version = 1 + max((int(name[:-len('.json')]) for name in os.listdir(folder)
+                           if name.endswith('.json') and name[:-len('.json')].isdigit()), default=0)
+        atomic_write_json(os.path.join(folder, f"{version}.json"), {
+            "version": version,
+            "saved_at": time.time(),
+            "diff": diff,
+            "schema": schema_data
+        })
+        atomic_write_json(schema_path, schema_data)
+    return version, diff
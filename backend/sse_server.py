@@ -0,0 +1,330 @@
+"""
+抽取进度推送服务（Server-Sent Events）
+
+    python sse_server.py
+
+浏览器用 EventSource 订阅 GET /api/tasks/<task_id>/events，收到OCR完成、各渠道流式解析出的字段、
+原文位置和任务完成/失败等事件（见events.py）。抽取在API服务的worker中进行，事件写入任务的事件日志，
+这里跟踪日志末尾推送给所有订阅者。
+
+单线程asyncio服务：每个连接只是一个协程和一个有界队列，空闲连接只占用一个socket，
+不像gthread worker那样每个长连接占用一个线程；同一任务的所有订阅者共享一个轮询协程。
+浏览器断线重连时带上Last-Event-ID（<run>:<日志位置>），从断开的位置继续推送。
+"""
+import os
+import json
+import signal
+import asyncio
+from urllib.parse import unquote
+from config import Config
+import events
+from logger import get_logger
+
+log = get_logger('sse_server')
+
+EVENTS_PATH_PREFIX = '/api/tasks/'
+EVENTS_PATH_SUFFIX = '/events'
+# 请求行和请求头的大小上限及读取超时（秒）
+MAX_REQUEST_BYTES = 16 * 1024
+REQUEST_TIMEOUT = 10
+# 浏览器断线后的重连间隔（毫秒）
+RETRY_MS = 3000
+
+_STREAM_HEADERS = (
+    "HTTP/1.1 200 OK\r\n"
+    "Content-Type: text/event-stream; charset=utf-8\r\n"
+    "Cache-Control: no-cache\r\n"
+    "Connection: close\r\n"
+    # 经过nginx反向代理时不缓冲响应
+    "X-Accel-Buffering: no\r\n"
+    "Access-Control-Allow-Origin: *\r\n"
+    "\r\n"
+)
+
+
+def _format_event(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+class TaskFeed:
+    """
+    一个任务的事件日志跟踪器
+
+    保持日志文件打开，按 Config.EVENTS_POLL_INTERVAL 检查是否有新的完整行，解析后放入每个订阅者的队列。
+    日志被events.reset替换（新一轮抽取）时重新打开并从头读取。没有订阅者时停止轮询并关闭文件。
+    """
+
+    def __init__(self, task_id, on_idle):
+        self.task_id = task_id
+        self.path = events.event_log_path(task_id)
+        self.subscribers = set()
+        self.run = None
+        self._on_idle = on_idle
+        self._file = None
+        self._offset = 0
+        self._poller = None
+
+    def _open(self):
+        """打开当前的事件日志，读取第一行的run编号；日志还不存在时返回False"""
+        self._close()
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+        self._offset = 0
+        self.run = None
+        try:
+            first = json.loads(self._file.readline())
+            if first.get('event') == events.EVENT_STARTED:
+                self.run = first['data']['run']
+        except (ValueError, KeyError, TypeError):
+            pass
+        return True
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _replaced(self):
+        """事件日志是否被替换或截断"""
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        opened = os.fstat(self._file.fileno())
+        return current.st_ino != opened.st_ino or current.st_dev != opened.st_dev or opened.st_size < self._offset
+
+    def _read(self, start, end=None):
+        """
+        读取日志中start之后的完整行
+
+        返回:
+            ([(事件ID, 事件类型, 数据), ...], 最后一个完整行的结束位置)
+        """
+        self._file.seek(start)
+        data = self._file.read() if end is None else self._file.read(end - start)
+        last = data.rfind(b'\n')
+        if last < 0:
+            return [], start
+        items = []
+        position = start
+        for line in data[:last + 1].splitlines(keepends=True):
+            position += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            items.append((f"{self.run or ''}:{position}", entry.get('event'), entry.get('data')))
+        return items, position
+
+    def poll(self):
+        """读取新事件并分发给所有订阅者"""
+        if self._file is None or self._replaced():
+            if not self._open():
+                return
+        items, self._offset = self._read(self._offset)
+        for subscriber in list(self.subscribers):
+            for item in items:
+                subscriber.put(item)
+
+    def subscribe(self, subscriber, last_event_id=None):
+        """
+        加入订阅，返回需要先补发的事件：Last-Event-ID属于当前这一轮时从该位置开始，否则从日志开头开始
+
+        补发的事件和之后队列中的事件之间没有遗漏或重复：两者以同一个日志位置为界，中间没有让出事件循环
+        """
+        self.poll()
+        backlog = []
+        if self._file is not None:
+            start = 0
+            run, _, offset = (last_event_id or '').rpartition(':')
+            if run == (self.run or '') and offset.isdigit() and int(offset) <= self._offset:
+                start = int(offset)
+            backlog, _ = self._read(start, self._offset)
+        self.subscribers.add(subscriber)
+        if self._poller is None:
+            self._poller = asyncio.ensure_future(self._poll_loop())
+        return backlog
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def _poll_loop(self):
+        try:
+            while self.subscribers:
+                await asyncio.sleep(Config.EVENTS_POLL_INTERVAL)
+                try:
+                    self.poll()
+                except OSError as e:
+                    log.warning("读取事件日志失败", extra={"task_id": self.task_id, "error": str(e)})
+                    self._close()
+        finally:
+            self._poller = None
+            self._close()
+            self._on_idle(self)
+
+
+class Subscriber:
+    """一个SSE连接的事件队列，积压超过上限时标记为溢出，由连接处理协程断开"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=Config.EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, item):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # 让等待中的连接协程醒来并断开，浏览器重连后从事件日志补齐
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    def close(self):
+        self.overflowed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class EventServer:
+    """SSE推送服务，见模块说明"""
+
+    def __init__(self):
+        self.feeds = {}
+        self.clients = set()
+        self._handlers = set()
+        self._server = None
+
+    def _feed(self, task_id):
+        feed = self.feeds.get(task_id)
+        if feed is None:
+            feed = self.feeds[task_id] = TaskFeed(task_id, self._feed_idle)
+        return feed
+
+    def _feed_idle(self, feed):
+        if not feed.subscribers and self.feeds.get(feed.task_id) is feed:
+            del self.feeds[feed.task_id]
+
+    async def _read_request(self, reader):
+        """
+        读取请求行和请求头
+
+        返回:
+            (方法, 路径, {小写的请求头名: 值})
+        """
+        data = await reader.readuntil(b'\r\n\r\n')
+        if len(data) > MAX_REQUEST_BYTES:
+            raise ValueError("请求头过大")
+        lines = data.decode('latin-1').split('\r\n')
+        parts = lines[0].split(' ')
+        if len(parts) != 3:
+            raise ValueError("无效的请求行")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return parts[0], parts[1], headers
+
+    @staticmethod
+    async def _respond(writer, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        writer.write((f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                      f"Content-Length: {len(payload)}\r\nAccess-Control-Allow-Origin: *\r\n"
+                      f"Connection: close\r\n\r\n").encode('latin-1') + payload)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        try:
+            try:
+                method, target, headers = await asyncio.wait_for(self._read_request(reader), REQUEST_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                return
+            path = target.split('?', 1)[0]
+            if method != 'GET':
+                await self._respond(writer, '405 Method Not Allowed', {"error": "只支持GET请求"})
+                return
+            if path == '/healthz':
+                await self._respond(writer, '200 OK', {"clients": len(self.clients), "tasks": len(self.feeds)})
+                return
+            task_id = None
+            if path.startswith(EVENTS_PATH_PREFIX) and path.endswith(EVENTS_PATH_SUFFIX):
+                task_id = unquote(path[len(EVENTS_PATH_PREFIX):-len(EVENTS_PATH_SUFFIX)])
+            if events.event_log_path(task_id) is None:
+                await self._respond(writer, '404 Not Found', {"error": "未找到"})
+                return
+            if len(self.clients) >= Config.EVENTS_MAX_CLIENTS:
+                await self._respond(writer, '503 Service Unavailable', {"error": "连接数已达上限"})
+                return
+            await self._stream(task_id, headers.get('last-event-id'), reader, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            self._handlers.discard(handler)
+
+    async def _stream(self, task_id, last_event_id, reader, writer):
+        """推送一个任务的事件，直到浏览器断开、积压溢出或服务停止"""
+        subscriber = Subscriber()
+        feed = self._feed(task_id)
+        self.clients.add(subscriber)
+        # 浏览器不会再发送数据，读到EOF说明连接已断开
+        disconnected = asyncio.ensure_future(reader.read(1))
+        try:
+            writer.write(_STREAM_HEADERS.encode('latin-1') + f"retry: {RETRY_MS}\n\n".encode('latin-1'))
+            for item in feed.subscribe(subscriber, last_event_id):
+                writer.write(_format_event(*item))
+            await writer.drain()
+            while True:
+                received = asyncio.ensure_future(subscriber.queue.get())
+                done, _ = await asyncio.wait({received, disconnected}, timeout=Config.EVENTS_HEARTBEAT,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if received not in done:
+                    received.cancel()
+                    if disconnected in done:
+                        return
+                    writer.write(b": ping\n\n")
+                else:
+                    item = received.result()
+                    # 一次写出队列中所有积压的事件
+                    while item is not None:
+                        writer.write(_format_event(*item))
+                        if subscriber.queue.empty():
+                            break
+                        item = subscriber.queue.get_nowait()
+                    if item is None:
+                        return
+                await writer.drain()
+        finally:
+            disconnected.cancel()
+            feed.unsubscribe(subscriber)
+            self.clients.discard(subscriber)
+
+    async def serve(self, host=None, port=None):
+        """监听端口直到收到SIGTERM/SIGINT，停止时断开所有连接（浏览器会自动重连到新的进程）"""
+        self._server = await asyncio.start_server(self.handle, host or Config.EVENTS_HOST,
+                                                  port or Config.EVENTS_PORT, backlog=1024)
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stopped.set)
+        log.info("进度推送服务已启动", extra={"host": host or Config.EVENTS_HOST, "port": port or Config.EVENTS_PORT})
+        await stopped.wait()
+        self._server.close()
+        clients = len(self.clients)
+        for subscriber in list(self.clients):
+            subscriber.close()
+        # 等待各连接写出队列中剩余的事件后断开
+        if self._handlers:
+            await asyncio.wait(set(self._handlers), timeout=REQUEST_TIMEOUT)
+        log.info("进度推送服务已停止", extra={"clients": clients})
+
+
+if __name__ == '__main__':
+    asyncio.run(EventServer().serve())
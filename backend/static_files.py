@@ -0,0 +1,147 @@
+import os
+import re
+import sys
+import gzip
+import mimetypes
+from flask import Flask, request, send_file, abort
+from werkzeug.utils import safe_join
+from config import Config
+from logger import get_logger
+
+try:
+    import brotli
+except ImportError:
+    # 未安装brotli时只生成gzip压缩文件
+    brotli = None
+
+log = get_logger('static_files')
+
+# 预压缩的文件类型，图片和字体（woff/woff2）本身已经压缩过
+COMPRESSIBLE_EXTENSIONS = ('.html', '.js', '.css', '.svg', '.json', '.map', '.txt', '.xml', '.ico', '.ttf', '.eot')
+# 小于该大小的文件压缩收益不明显
+MIN_COMPRESS_BYTES = 1024
+# 按优先级排列的预压缩编码及文件后缀
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# 构建时文件名中带内容哈希（例如 js/app.3f2a9c1d.js），内容变化时文件名也会变，可以永久缓存
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress(root):
+    """
+    为构建目录中的文本文件生成 .gz（以及安装了brotli时的 .br）压缩文件，服务时直接发送，不在请求中压缩
+
+    压缩文件比原文件新时跳过，压缩后没有变小的文件不保留压缩版本
+
+    返回:
+        生成的压缩文件数
+    """
+    encodings = [(name, suffix) for name, suffix in ENCODINGS if name != 'br' or brotli is not None]
+    written = 0
+    for folder, _, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(folder, filename)
+            if os.path.getsize(path) < MIN_COMPRESS_BYTES:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            mtime = os.path.getmtime(path)
+            for name, suffix in encodings:
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+                    continue
+                compressed = _compress(data, name)
+                if len(compressed) >= len(data):
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+    return written
+
+
+def _accepted_encodings():
+    """解析Accept-Encoding，返回客户端接受的编码（忽略q=0）"""
+    accepted = set()
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.partition(';')
+        key, _, value = params.partition('=')
+        try:
+            quality = float(value) if key.strip() == 'q' else 1.0
+        except ValueError:
+            quality = 1.0
+        if name.strip() and quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def create_app(dist_folder=None):
+    """
+    前端构建目录的静态文件服务
+
+    参数:
+        dist_folder: 构建目录，默认Config.FRONTEND_DIST_FOLDER
+
+    没有扩展名的路径返回index.html（前端路由），按Accept-Encoding发送预压缩的文件，
+    带哈希的文件永久缓存，index.html每次协商缓存，其余文件缓存Config.STATIC_MAX_AGE秒
+    """
+    root = os.path.abspath(dist_folder or Config.FRONTEND_DIST_FOLDER)
+    static_app = Flask(__name__, static_folder=None)
+
+    @static_app.route('/', defaults={'path': ''})
+    @static_app.route('/<path:path>')
+    def serve(path):
+        if '.' not in os.path.basename(path):
+            path = 'index.html'
+        file_path = safe_join(root, path)
+        if file_path is None or not os.path.isfile(file_path):
+            abort(404)
+
+        send_path, encoding = file_path, None
+        accepted = _accepted_encodings()
+        for name, suffix in ENCODINGS:
+            candidate = file_path + suffix
+            if (name in accepted and os.path.isfile(candidate)
+                    and os.path.getmtime(candidate) >= os.path.getmtime(file_path)):
+                send_path, encoding = candidate, name
+                break
+
+        immutable = path != 'index.html' and HASHED_NAME.search(os.path.basename(path)) is not None
+        if path == 'index.html':
+            max_age = 0
+        elif immutable:
+            max_age = IMMUTABLE_MAX_AGE
+        else:
+            max_age = Config.STATIC_MAX_AGE
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        response = send_file(send_path, mimetype=mimetype, conditional=True, max_age=max_age)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        if path == 'index.html':
+            response.cache_control.no_cache = True
+        elif immutable:
+            response.cache_control.immutable = True
+        return response
+
+    return static_app
+
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'compress':
+        folder = sys.argv[2] if len(sys.argv) > 2 else Config.FRONTEND_DIST_FOLDER
+        log.info("预压缩前端静态文件", extra={"folder": folder, "files": precompress(folder)})
+    else:
+        print("用法: python static_files.py compress [构建目录]")
@@ -0,0 +1,107 @@
+import os
+import json
+import base64
+import hashlib
+import threading
+
+# 计算文件哈希时每次读取的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+# base64编码时每次读取的块大小，必须是3的倍数才能逐块编码后直接拼接
+BASE64_CHUNK_SIZE = 3 * 256 * 1024
+
+
+class FileTooLargeError(Exception):
+    """上传文件超过大小上限"""
+
+
+def atomic_write_text(path, text, encoding='utf-8'):
+    """先写临时文件再替换，保证读取方不会看到写了一半的文件"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding=encoding) as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def atomic_write_bytes(path, data):
+    """原子写入二进制文件"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def atomic_write_json(path, data, indent=2):
+    """原子写入JSON文件"""
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=indent))
+
+
+def file_sha256(file_path):
+    """分块计算文件内容的sha256，不把整个文件读入内存"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_stream(stream, file_path, max_bytes=None, chunk_size=HASH_CHUNK_SIZE):
+    """
+    分块把上传流写入磁盘，同时计算sha256和大小，不在内存中缓存整个文件
+
+    参数:
+        stream: 可读的文件流（如werkzeug的FileStorage.stream）
+        file_path: 保存路径，写完后原子替换
+        max_bytes: 大小上限，超过时删除临时文件并抛出FileTooLargeError
+
+    返回:
+        (sha256, 文件大小)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.upload"
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise FileTooLargeError(f"文件超过大小上限 {max_bytes} 字节")
+                digest.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return digest.hexdigest(), size
+
+
+def file_base64(file_path, prefix=''):
+    """
+    分块读取文件并编码为base64字符串
+
+    编码结果直接追加到一个bytearray中，最后只解码一次，
+    避免同时持有原始字节、base64字节和字符串三份完整拷贝。
+
+    参数:
+        file_path: 文件路径
+        prefix: 拼接在编码结果前的前缀，例如 "data:image/png;base64,"
+    """
+    buffer = bytearray()
+    buffer += prefix.encode('ascii')
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(BASE64_CHUNK_SIZE), b''):
+            buffer += base64.b64encode(chunk)
+    return buffer.decode('ascii')
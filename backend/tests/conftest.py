@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# 后端模块以扁平方式互相导入（from config import Config），测试从backend目录导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+
+# 数据目录、目录数据库和缓存重定向到临时目录，必须在测试导入ai/pipeline/app之前完成
+benchmark.configure_data_folders(tempfile.mkdtemp(prefix='backend-tests-'))
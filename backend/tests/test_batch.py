@@ -0,0 +1,73 @@
+import io
+import os
+import json
+import zipfile
+import pytest
+from config import Config
+from batch import BatchPipeline, BatchRejected, parse_manifest, member_filenames
+
+
+def _archive(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    buffer.seek(0)
+    return buffer
+
+
+def test_manifest_list_and_dict_forms_are_equivalent():
+    expected = ('invoice', [('a', 'ticket'), ('b', None)])
+    assert parse_manifest({"schema": "invoice", "tasks": [{"task_id": "a", "schema": "ticket"}, "b"]}) == expected
+    assert parse_manifest({"schema": "invoice", "tasks": {"a": {"schema": "ticket"}, "b": {}}}) == expected
+
+
+@pytest.mark.parametrize('manifest', [
+    [{"task_id": "a"}],
+    None,
+    {"tasks": "a"},
+    {"tasks": [1]},
+    {"tasks": [{"schema": "x"}]},
+    {"tasks": {"a": "ticket"}},
+    {"schema": ["invoice"], "tasks": ["a"]},
+])
+def test_malformed_manifest_is_rejected(tmp_path, manifest):
+    pipeline = BatchPipeline(batches_folder=str(tmp_path))
+    with pytest.raises(BatchRejected):
+        pipeline.submit_manifest(manifest)
+
+
+def test_malformed_archive_manifest_is_rejected(tmp_path):
+    pipeline = BatchPipeline(batches_folder=str(tmp_path))
+    archive = _archive({"manifest.json": json.dumps({"tasks": "a"}), "a/1.png": b"x"})
+    with pytest.raises(BatchRejected):
+        pipeline.submit_archive(archive, default_schema='invoice')
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_member_filenames_keep_files_from_different_subfolders():
+    filenames = member_filenames(['a/x/1.png', 'a/y/1.png', 'a/1.png', 'a/x_1.png', 'a/发票.pdf', 'a/合同.pdf'])
+    assert filenames == {
+        'a/x/1.png': 'x_1.png',
+        'a/y/1.png': 'y_1.png',
+        'a/1.png': '1.png',
+        'a/x_1.png': 'x_1_1.png',
+        'a/发票.pdf': 'file.pdf',
+        'a/合同.pdf': 'file_1.pdf',
+    }
+    assert member_filenames(['report.pdf']) == {'report.pdf': 'report.pdf'}
+
+
+def test_finished_batches_are_evicted_from_memory(tmp_path):
+    schema_name = f"batch_{os.urandom(4).hex()}"
+    with open(os.path.join(Config.SCHEMA_FOLDER, f"{schema_name}.json"), 'w', encoding='utf-8') as f:
+        json.dump({"type": "object", "properties": {}}, f)
+    pipeline = BatchPipeline(batches_folder=str(tmp_path))
+    pipeline.handlers = {stage: (lambda item: None) for stage in pipeline.handlers}
+
+    batch = pipeline.submit_manifest({"schema": schema_name, "tasks": ["t1", "t2"]})
+    assert pipeline.drain(timeout=10) == 0
+
+    assert pipeline.batches == {}
+    summary = pipeline.summary(batch['batch_id'])
+    assert (summary['status'], summary['total'], summary['succeeded']) == ('done', 2, 2)
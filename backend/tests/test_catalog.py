@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import pytest
+from config import Config
+from catalog import TaskCatalog, COMPARISON_SUFFIX
+
+
+def _touch(path, content=b'%PDF-1.4'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def task_id():
+    return f"catalog_{os.urandom(4).hex()}"
+
+
+def test_reconcile_adds_folders_missing_from_catalog(tmp_path, task_id):
+    catalog = TaskCatalog(str(tmp_path / 'catalog.sqlite3'))
+    catalog.record_document(f"{task_id}_known", 'a.pdf', 8)
+    _touch(os.path.join(Config.UPLOAD_FOLDER, task_id, 'a.pdf'))
+    _touch(os.path.join(Config.UPLOAD_FOLDER, task_id, 'b.png'), b'png')
+    _touch(os.path.join(Config.RESULTS_FOLDER, f"{task_id}{COMPARISON_SUFFIX}"), b'{}')
+
+    added = catalog.reconcile()
+
+    assert added["tasks"] >= 1 and added["documents"] >= 2
+    task = catalog.get_task(task_id)
+    assert (task['file_count'], task['total_size'], task['comparison']) == (2, 11, 1)
+    # 已有的记录不受影响，再次对账不会重复添加
+    assert catalog.get_task(f"{task_id}_known")['file_count'] == 1
+    assert catalog.reconcile() == {"tasks": 0, "documents": 0}
+    tasks, _ = catalog.list_tasks(comparison=True, limit=None)
+    assert task_id in [row['task_id'] for row in tasks]
+    assert f"{task_id}_known" not in [row['task_id'] for row in tasks]
+
+
+def test_opens_catalog_without_comparison_column(tmp_path):
+    path = str(tmp_path / 'catalog.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE tasks (task_id TEXT PRIMARY KEY, status TEXT NOT NULL, schema TEXT, error TEXT, "
+                 "file_count INTEGER NOT NULL DEFAULT 0, total_size INTEGER NOT NULL DEFAULT 0, "
+                 "created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+    conn.execute("INSERT INTO tasks VALUES ('old', 'uploaded', NULL, NULL, 0, 0, 1, 1)")
+    conn.commit()
+    conn.close()
+
+    catalog = TaskCatalog(path)
+    assert catalog.get_task('old')['comparison'] == 0
+    assert catalog.list_tasks(comparison=True)[1] == 0
+
+
+def test_task_listing_keeps_comparison_filter_and_fields(task_id):
+    from app import app
+    from catalog import catalog
+    catalog.ensure_task(f"{task_id}_plain")
+    _touch(os.path.join(Config.RESULTS_FOLDER, f"{task_id}{COMPARISON_SUFFIX}"), b'{}')
+    catalog.reconcile(task_ids={task_id})
+    client = app.test_client()
+
+    tasks = client.get('/api/tasks?limit=1000').get_json()
+    assert task_id in [task['task_id'] for task in tasks]
+    assert f"{task_id}_plain" not in [task['task_id'] for task in tasks]
+    assert all(set(task) == {'task_id', 'created_at'} for task in tasks)
+
+    tasks = client.get('/api/tasks?scope=all&details=1&limit=1000').get_json()
+    assert f"{task_id}_plain" in [task['task_id'] for task in tasks]
+    assert 'status' in tasks[0]
+
+
+def test_document_listing_reconciles_unknown_task_folder(task_id):
+    from app import app
+    _touch(os.path.join(Config.UPLOAD_FOLDER, task_id, 'a.pdf'))
+    client = app.test_client()
+
+    response = client.get(f'/api/documents/{task_id}')
+    assert response.status_code == 200
+    assert [doc['id'] for doc in response.get_json()['documents']] == [f"{task_id}/a.pdf"]
+    assert client.get(f'/api/documents/{task_id}_missing').status_code == 404
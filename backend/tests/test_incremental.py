@@ -0,0 +1,76 @@
+import os
+import asyncio
+import functools
+import pytest
+from config import Config
+import pipeline
+from schema_store import load_result_schema
+
+
+def _schema(**fields):
+    return {"type": "object", "properties": {name: {"type": "string", "description": d} for name, d in fields.items()}}
+
+
+@pytest.fixture
+def task(monkeypatch):
+    """一个只有markdown渠道的任务，渠道按schema中的字段描述返回取值，并记录每次请求的字段"""
+    task_id = f"incremental_{os.urandom(4).hex()}"
+    os.makedirs(os.path.join(Config.UPLOAD_FOLDER, task_id))
+    with open(os.path.join(Config.UPLOAD_FOLDER, task_id, 'a.pdf'), 'wb') as f:
+        f.write(b'%PDF-1.4')
+    calls = []
+
+    def extract(json_save_path, schema, fail=False):
+        calls.append(sorted(schema['properties']))
+        if fail:
+            return None
+        result = {name: prop['description'] for name, prop in schema['properties'].items()}
+        if json_save_path:
+            pipeline.ai.save_extract_result(json_save_path, result)
+        return result
+
+    def build_channel(file_ids, system_prompt, user_prompt, json_save_path, schema=None, on_field=None):
+        return functools.partial(extract, json_save_path, schema, fail=task.fail)
+
+    task.fail = False
+    monkeypatch.setattr(pipeline, 'EXTRACT_CHANNELS', {
+        "markdown": (Config.MARKDOWN_ALLOWED_EXTENSIONS, build_channel, "markdown_result.json")})
+    task.id, task.calls = task_id, calls
+    task.result_path = os.path.join(Config.EXTRACT_RESULTS_FOLDER, task_id, 'markdown_result.json')
+    return task
+
+
+def _run(task, schema, incremental=True):
+    diff = {"added": [], "removed": [], "modified": []} if incremental else None
+    return asyncio.run(pipeline.process_with_ai(task.id, schema, ["markdown"], localize=False, schema_diff=diff))
+
+
+def test_incremental_run_diffs_against_result_schema(task):
+    _run(task, _schema(a='a1', b='b1'), incremental=False)
+    assert load_result_schema(task.result_path) == _schema(a='a1', b='b1')
+
+    results = _run(task, _schema(a='a1', b='b2', c='c1'))
+    assert task.calls[-1] == ['b', 'c']
+    assert results["markdown"] == {"a": "a1", "b": "b2", "c": "c1"}
+
+
+def test_failed_run_does_not_hide_stale_fields(task):
+    _run(task, _schema(a='a1', b='b1'), incremental=False)
+    # 这一版schema的抽取失败，磁盘上仍是a1/b1的结果
+    task.fail = True
+    _run(task, _schema(a='a2', b='b1'))
+    task.fail = False
+
+    # 和上一版本相比a没有变化，但已有结果是用a1抽取的，a仍需要重新抽取
+    results = _run(task, _schema(a='a2', b='b2'))
+    assert task.calls[-1] == ['a', 'b']
+    assert results["markdown"] == {"a": "a2", "b": "b2"}
+
+
+def test_result_without_schema_record_falls_back_to_full_run(task):
+    _run(task, _schema(a='a1', b='b1'), incremental=False)
+    os.remove(task.result_path.replace('.json', '.schema.json'))
+
+    _run(task, _schema(a='a1', b='b1', c='c1'))
+    assert task.calls[-1] == ['a', 'b', 'c']
+    assert load_result_schema(task.result_path) == _schema(a='a1', b='b1', c='c1')
@@ -0,0 +1,78 @@
+import pytest
+from json_stream import JsonStreamParser, extract_json
+
+
+def _stream(text, chunk=3):
+    """按小块喂给解析器，模拟流式响应"""
+    parser = JsonStreamParser()
+    for i in range(0, len(text), chunk):
+        parser.feed(text[i:i + chunk])
+    return parser.result(), parser
+
+
+@pytest.mark.parametrize('text', [
+    'Here is {the} result: {"a":1}',
+    '{{"a":1}}',
+    '说明[注]如下：{"a":1}',
+    '```json\n{"a":1}\n```',
+])
+def test_skips_prose_before_json(text):
+    for chunk in (1, 3, len(text)):
+        result, parser = _stream(text, chunk)
+        assert result == {"a": 1}
+        assert not parser.truncated
+        assert parser.errors == []
+
+
+def test_braces_without_json_raise():
+    with pytest.raises(ValueError):
+        extract_json('no json {here}')
+
+
+def test_syntax_error_after_fields_keeps_parsed_fields():
+    result, parser = _stream('{"a":1, b: 2}')
+    assert result == {"a": 1}
+    assert not parser.truncated
+    assert len(parser.errors) == 1
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('[{"a":1},{"b":2', [{"a": 1}]),
+    ('{"x":1,"items":[{"a":1},{"b":2', {"x": 1, "items": [{"a": 1}]}),
+    ('{"x":1,"a":{"b":{"c":1,"d":2', {"x": 1, "a": {"b": {"c": 1}}}),
+    ('{"x":1,"a":[', {"x": 1}),
+    ('{"x":1,"a":"unterminated', {"x": 1}),
+    ('{"x":1,"a"', {"x": 1}),
+])
+def test_truncated_output_drops_incomplete_containers(text, expected):
+    result, parser = _stream(text)
+    assert result == expected
+    assert parser.truncated
+
+
+def test_fields_are_reported_as_they_complete():
+    parser = JsonStreamParser()
+    assert parser.feed('{"a": [1, 2], "b"') == [("a", [1, 2])]
+    assert parser.feed(': "s"}') == [("b", "s")]
+    assert parser.complete
+
+
+@pytest.mark.parametrize('text, cached', [
+    ('{"a": 1, "b": 2}', True),
+    ('{"a": 1, "b": "unterminated', False),
+    ('no json here', False),
+])
+def test_only_complete_responses_stay_cached(monkeypatch, text, cached):
+    import ai
+
+    class Cache:
+        def __init__(self):
+            self.keys = {'key'}
+
+        def delete(self, key):
+            self.keys.discard(key)
+
+    cache = Cache()
+    monkeypatch.setattr(ai, 'llm_cache', cache)
+    ai._parse_json_output(text, 'key', 'model', None)
+    assert ('key' in cache.keys) == cached
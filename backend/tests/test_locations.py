@@ -0,0 +1,41 @@
+import os
+import json
+from config import Config
+import ai
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def _page(*blocks):
+    return {"textblocks": [{"text": text, "norm_box": {"x0": x, "y0": 0.1, "x1": x + 0.2, "y1": 0.2}}
+                           for text, x in blocks]}
+
+
+def test_locates_fields_in_every_file_of_the_task():
+    task_id = f"locations_{os.urandom(4).hex()}"
+    for filename in ('a.pdf', 'b.png'):
+        _write_json(os.path.join(Config.UPLOAD_FOLDER, task_id, filename), {})
+    _write_json(os.path.join(Config.PARSE_RESULTS_FOLDER, task_id, 'a.json'), [_page(("发票号码 12345", 0.1))])
+    _write_json(os.path.join(Config.PARSE_RESULTS_FOLDER, task_id, 'b.json'),
+                [_page(("封面", 0.1)), _page(("合同编号 HT-2024-001", 0.5))])
+    _write_json(os.path.join(Config.EXTRACT_RESULTS_FOLDER, task_id, 'markdown_result.json'),
+                {"invoice_no": "12345", "contract_no": "HT-2024-001", "missing": "不存在"})
+
+    result = ai.extract_text_locations(task_id)
+
+    assert result["onThePage"] == ["invoice_no", "contract_no"]
+    assert result["normBox"]["contract_no"] == [[0.5, 0.1, 0.7, 0.2]]
+    invoice, = result["matches"]["invoice_no"]
+    contract, = result["matches"]["contract_no"]
+    assert (invoice["file"], invoice["page"]) == (f"{task_id}/a.pdf", 0)
+    assert (contract["file"], contract["page"]) == (f"{task_id}/b.png", 1)
+
+
+def test_localization_is_timed_as_one_stage():
+    # @timed("localize")包装的是整个定位过程，而不是其中的目录列举
+    assert hasattr(ai.extract_text_locations, '__wrapped__')
+    assert not hasattr(ai._task_parse_results, '__wrapped__')
@@ -0,0 +1,53 @@
+import os
+import ast
+import json
+import logging
+from logger import get_logger, JsonFormatter, _RECORD_ATTRIBUTES
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _extra_keys(path):
+    """找出文件中日志调用的extra字面量字典里的键"""
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        for keyword in node.keywords:
+            if keyword.arg == 'extra' and isinstance(keyword.value, ast.Dict):
+                for key in keyword.value.keys:
+                    if isinstance(key, ast.Constant) and isinstance(key.value, str):
+                        yield node.lineno, key.value
+
+
+def test_no_reserved_extra_keys():
+    """extra中不能使用LogRecord自带的属性名，否则logging会抛出KeyError"""
+    offending = []
+    for filename in sorted(os.listdir(BACKEND_DIR)):
+        if filename.endswith('.py'):
+            for lineno, key in _extra_keys(os.path.join(BACKEND_DIR, filename)):
+                if key in _RECORD_ATTRIBUTES:
+                    offending.append(f"{filename}:{lineno} {key}")
+    assert offending == []
+
+
+def test_reserved_extra_key_is_renamed():
+    log = get_logger('test_logger')
+    records = []
+
+    class Collect(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    handler = Collect()
+    log.logger.addHandler(handler)
+    try:
+        log.error("解析请求失败", extra={"code": 40000, "message": "bad"})
+    finally:
+        log.logger.removeHandler(handler)
+
+    entry = json.loads(JsonFormatter().format(records[0]))
+    assert entry["msg"] == "解析请求失败"
+    assert entry["extra_message"] == "bad"
+    assert entry["code"] == 40000
@@ -0,0 +1,26 @@
+from prompt_builder import _split_oversized, build_chunks, estimate_tokens
+
+
+def test_long_cjk_line_keeps_document_order():
+    text = "第一行\n" + "长" * 50 + "\n末行"
+    pieces = _split_oversized(text, 20)
+    assert ''.join(pieces).replace('\n', '') == text.replace('\n', '')
+    assert pieces[0] == "第一行"
+    assert pieces[-1].endswith("末行")
+    assert all(estimate_tokens(piece) + 1 <= 20 for piece in pieces)
+
+
+def test_long_ascii_line_is_cut_by_token_estimate():
+    pieces = _split_oversized("a" * 100, 10)
+    assert ''.join(pieces) == "a" * 100
+    # 4个ASCII字符约1个token，每段远多于10个字符
+    assert len(pieces) == 3
+    assert all(estimate_tokens(piece) + 1 <= 10 for piece in pieces)
+
+
+def test_chunks_preserve_page_text_order():
+    page = "标题\n" + "正文" * 200 + "\n结尾"
+    chunks = build_chunks([("a.pdf", [page])], 120)
+    assert len(chunks) > 1
+    joined = ''.join(chunks)
+    assert joined.index("标题") < joined.index("正文") < joined.index("结尾")
@@ -0,0 +1,171 @@
+import json
+import time
+import threading
+import urllib.request
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import ai
+from resilience import ApiGuard, CircuitBreaker, CircuitOpenError, get_guard
+
+
+class StubServer:
+    """本地桩服务：按顺序返回预设的状态码，记录请求数和最大并发数"""
+
+    def __init__(self):
+        self.statuses = []
+        self.delay = 0
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                    status = stub.statuses.pop(0) if stub.statuses else 200
+                time.sleep(stub.delay)
+                with stub._lock:
+                    stub.active -= 1
+                self.send_response(status)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def get(self):
+        with urllib.request.urlopen(self.url, timeout=5) as resp:
+            return resp.status
+
+
+def _is_retryable_http(error):
+    return isinstance(error, urllib.error.HTTPError) and (error.code == 429 or error.code >= 500)
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def _guard(**options):
+    defaults = {"rate": 0, "max_concurrency": 8, "max_retries": 3, "backoff_base": 0.01, "backoff_max": 0.02,
+                "failure_threshold": 10, "reset_timeout": 30}
+    defaults.update(options)
+    return ApiGuard('test', **defaults)
+
+
+def test_token_bucket_limits_request_rate(stub):
+    guard = _guard(rate=20, burst=1)
+    started = time.monotonic()
+    for _ in range(5):
+        guard.call(stub.get)
+    # 第一个请求使用桶中的令牌，之后每个请求等待1/20秒
+    assert time.monotonic() - started >= 4 / 20 * 0.9
+    assert guard.stats()["throttled_seconds"] > 0
+    assert stub.requests == 5
+
+
+def test_429_is_retried_with_backoff(stub):
+    stub.statuses = [429, 429]
+    guard = _guard()
+    assert guard.call(stub.get, is_retryable=_is_retryable_http) == 200
+    assert stub.requests == 3
+    assert guard.stats()["retries"] == 2
+
+
+def test_non_retryable_error_is_raised_immediately(stub):
+    stub.statuses = [400]
+    guard = _guard()
+    with pytest.raises(urllib.error.HTTPError):
+        guard.call(stub.get, is_retryable=_is_retryable_http)
+    assert stub.requests == 1
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_opens_and_closes(stub):
+    stub.statuses = [503, 503]
+    guard = _guard(max_retries=0, failure_threshold=2, reset_timeout=0.2)
+    for _ in range(2):
+        with pytest.raises(urllib.error.HTTPError):
+            guard.call(stub.get, is_retryable=_is_retryable_http)
+    assert guard.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        guard.call(stub.get, is_retryable=_is_retryable_http)
+    assert stub.requests == 2
+    assert guard.stats()["rejected"] == 1
+
+    time.sleep(0.25)
+    # 熔断时长过后放行一个试探请求，成功后关闭
+    assert guard.call(stub.get, is_retryable=_is_retryable_http) == 200
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_semaphore_bounds_concurrency(stub):
+    stub.delay = 0.1
+    guard = _guard(max_concurrency=2)
+    threads = [threading.Thread(target=guard.call, args=(stub.get,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stub.requests == 6
+    assert stub.max_active == 2
+
+
+class StubVisualService:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def ocr_pdf(self, form):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+OCR_OK = {"code": 10000, "data": {"detail": json.dumps([{"page_id": 1}]), "markdown": "# ok"}}
+
+
+@pytest.fixture
+def visual(monkeypatch):
+    monkeypatch.setattr(get_guard("visual:ocr_pdf"), 'backoff', lambda attempt: 0)
+
+    def install(*responses):
+        service = StubVisualService(responses)
+        monkeypatch.setattr(ai, 'visual_service', service)
+        return service
+    return install
+
+
+@pytest.mark.parametrize('error', [
+    {"code": 50429, "message": "limited"},
+    {"ResponseMetadata": {"Error": {"CodeN": 10006, "Code": "FlowLimitExceeded", "Message": "limited"}}},
+    {"ResponseMetadata": {"Error": {"Code": "InternalServiceError", "Message": "unavailable"}}},
+])
+def test_ocr_retries_throttling_and_server_errors(visual, error):
+    service = visual(error, OCR_OK)
+    result = ai._ocr_page_range('', {"page_start": 0, "page_num": 1})
+    assert result == {"detail": [{"page_id": 1}], "markdown": "# ok"}
+    assert service.calls == 2
+
+
+@pytest.mark.parametrize('error', [
+    {"code": 40000, "message": "bad"},
+    {"ResponseMetadata": {"Error": {"Code": "SignatureDoesNotMatch", "Message": "bad"}}},
+])
+def test_ocr_client_errors_are_not_retried(visual, error):
+    service = visual(error)
+    assert ai._ocr_page_range('', {"page_start": 0, "page_num": 1}) is None
+    assert service.calls == 1
@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import unicodedata
+from collections import Counter
+from storage import atomic_write_json
+
+# 索引格式版本，格式变化时旧索引自动重建
+INDEX_VERSION = 2
+# n-gram长度，2对中文和短数字都有较好的区分度
+NGRAM_SIZE = 2
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_THOUSANDS_RE = re.compile(r'(?<=\d),(?=\d{3}(?!\d))')
+
+
+def normalize_text(text):
+    """
+    匹配前的文本归一化：全角转半角(NFKC)、转小写、去掉空白和数字中的千分位逗号
+    """
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    text = _WHITESPACE_RE.sub('', text)
+    return _THOUSANDS_RE.sub('', text)
+
+
+def _ngrams(text, n=NGRAM_SIZE):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def index_path_for(parse_result_path):
+    """索引文件和解析结果放在一起，使用.index扩展名避免被当作解析结果读取"""
+    return os.path.splitext(parse_result_path)[0] + '.index'
+
+
+class TextBlockIndex:
+    """
+    解析结果中文本块的n-gram倒排索引
+
+    每个文本块按文档顺序编号，n-gram -> 包含它的文本块编号列表，
+    文本在建索引前经过normalize_text归一化，查询词也需要同样归一化。
+    精确查找时先取查询词所有n-gram倒排列表的交集作为候选，再做子串校验；
+    模糊查找时按共享n-gram数量过滤候选，避免对每个字段都扫描全部文本块。
+    """
+
+    def __init__(self, blocks, postings):
+        """
+        参数:
+            blocks: [(页序号, 归一化文本, [x0, y0, x1, y1]), ...]，按文档顺序排列
+            postings: {n-gram: [文本块编号, ...]}
+        """
+        self.blocks = blocks
+        self.postings = postings
+
+    @classmethod
+    def build(cls, parse_data):
+        """从document_parse的解析结果构建索引，只收录有文本和坐标的文本块"""
+        blocks = []
+        postings = {}
+        for page_index, page in enumerate(parse_data):
+            for textblock in page.get('textblocks', []):
+                text = textblock.get('text', '')
+                norm_box = textblock.get('norm_box')
+                text = normalize_text(text) if text else ''
+                if not text or not norm_box:
+                    continue
+                block_id = len(blocks)
+                blocks.append((page_index, text,
+                               [norm_box['x0'], norm_box['y0'], norm_box['x1'], norm_box['y1']]))
+                for gram in _ngrams(text):
+                    postings.setdefault(gram, []).append(block_id)
+        return cls(blocks, postings)
+
+    @classmethod
+    def load(cls, parse_result_path, parse_data=None):
+        """
+        读取与解析结果对应的索引，不存在或已过期时重建并保存
+
+        参数:
+            parse_result_path: 解析结果JSON路径
+            parse_data: 已读取的解析结果，避免重建时重复读取
+        """
+        stat = os.stat(parse_result_path)
+        source = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        path = index_path_for(parse_result_path)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION and data.get("source") == source:
+                return cls([tuple(block) for block in data["blocks"]], data["postings"])
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+
+        if parse_data is None:
+            with open(parse_result_path, 'r', encoding='utf-8') as f:
+                parse_data = json.load(f)
+        index = cls.build(parse_data)
+        index.save(path, source)
+        return index
+
+    @classmethod
+    def merge(cls, indexes):
+        """
+        把一个任务中多个文件的索引合并为一个，文本块增加第四项：所属的文件ID
+
+        参数:
+            indexes: [(文件ID, TextBlockIndex), ...]，合并后按此顺序排列
+        """
+        blocks = []
+        postings = {}
+        for file_id, index in indexes:
+            offset = len(blocks)
+            blocks.extend((page, text, box, file_id) for page, text, box, *_ in index.blocks)
+            for gram, posting in index.postings.items():
+                postings.setdefault(gram, []).extend(block_id + offset for block_id in posting)
+        return cls(blocks, postings)
+
+    def save(self, path, source):
+        atomic_write_json(path, {
+            "version": INDEX_VERSION,
+            "source": source,
+            "blocks": self.blocks,
+            "postings": self.postings
+        }, indent=None)
+
+    def candidates(self, query):
+        """返回可能包含query的文本块编号（升序），query过短时返回全部文本块"""
+        grams = _ngrams(query)
+        if not grams:
+            return range(len(self.blocks))
+        lists = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if not posting:
+                return []
+            lists.append(posting)
+        # 从最短的倒排列表开始求交集
+        lists.sort(key=len)
+        result = set(lists[0])
+        for posting in lists[1:]:
+            result.intersection_update(posting)
+            if not result:
+                return []
+        return sorted(result)
+
+    def fuzzy_candidates(self, query, max_dist):
+        """
+        返回可能与query编辑距离不超过max_dist的文本块编号（升序）
+
+        q-gram引理：每次编辑最多破坏n个n-gram，编辑距离为k的子串
+        至少包含查询词 len(不同n-gram) - k*n 个不同的n-gram
+        """
+        grams = _ngrams(query)
+        threshold = len(grams) - max_dist * NGRAM_SIZE
+        if not grams or threshold <= 0:
+            return range(len(self.blocks))
+        counts = Counter()
+        for gram in grams:
+            counts.update(self.postings.get(gram, ()))
+        return sorted(block_id for block_id, count in counts.items() if count >= threshold)
+
+    def find(self, query):
+        """返回文档顺序中第一个包含query（已归一化）的文本块，找不到返回None"""
+        if not query:
+            return None
+        for block_id in self.candidates(query):
+            if query in self.blocks[block_id][1]:
+                return self.blocks[block_id]
+        return None
@@ -0,0 +1,193 @@
+import re
+from text_index import normalize_text
+
+# 模糊匹配的最短查询长度，过短的值模糊匹配没有意义
+FUZZY_MIN_LENGTH = 4
+# 模糊匹配允许的最大编辑距离
+FUZZY_MAX_DISTANCE = 3
+# 每多少个字符允许一次编辑
+FUZZY_CHARS_PER_EDIT = 5
+
+_ISO_DATE_RE = re.compile(r'^(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})$')
+_NUMBER_RE = re.compile(r'^-?\d+(\.\d+)?$')
+
+
+def _number_variants(value):
+    """数字的常见书写形式：400 -> 400、400.00、400.0"""
+    variants = []
+    if float(value).is_integer():
+        variants.append(str(int(value)))
+        variants.append(f"{value:.2f}")
+        variants.append(f"{value:.1f}")
+    else:
+        variants.append(str(value))
+        variants.append(f"{value:.2f}")
+    return variants
+
+
+def _date_variants(year, month, day):
+    """日期的常见书写形式，覆盖 年-月-日、日/月/年、两位年份和中文日期"""
+    y, m, d = int(year), int(month), int(day)
+    yy = f"{y % 100:02d}"
+    return [
+        f"{y}-{m:02d}-{d:02d}", f"{y}/{m:02d}/{d:02d}", f"{y}.{m:02d}.{d:02d}", f"{y}{m:02d}{d:02d}",
+        f"{y}年{m}月{d}日", f"{y}年{m:02d}月{d:02d}日",
+        f"{d:02d}/{m:02d}/{y}", f"{m:02d}/{d:02d}/{y}", f"{d:02d}/{m:02d}/{yy}", f"{d:02d}-{m:02d}-{y}",
+    ]
+
+
+def value_variants(value):
+    """
+    把字段值转换为可以在原文中查找的归一化文本列表，第一个是最原始的形式
+
+    返回:
+        [(归一化文本, 是否为数字), ...]
+    """
+    if isinstance(value, bool) or value is None:
+        return []
+    if isinstance(value, (int, float)):
+        return [(normalize_text(v), True) for v in _number_variants(value)]
+
+    text = normalize_text(value)
+    if not text:
+        return []
+    variants = [(text, bool(_NUMBER_RE.match(text)))]
+    date_match = _ISO_DATE_RE.match(text)
+    if date_match:
+        variants.extend((normalize_text(v), False) for v in _date_variants(*date_match.groups()))
+    elif _NUMBER_RE.match(text):
+        variants.extend((normalize_text(v), True) for v in _number_variants(float(text)))
+    # 去重并保持顺序
+    seen = set()
+    return [v for v in variants if not (v[0] in seen or seen.add(v[0]))]
+
+
+def iter_leaves(value, path):
+    """遍历数组/对象中的每个叶子值，返回 (路径, 值)"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from iter_leaves(item, f"{path}.{key}")
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            yield from iter_leaves(item, f"{path}[{i}]")
+    else:
+        yield path, value
+
+
+def _contains_number(text, query):
+    """数字必须完整出现，例如 6 不能匹配到 16 或 6.5 中"""
+    start = text.find(query)
+    while start != -1:
+        end = start + len(query)
+        before = text[start - 1] if start > 0 else ''
+        after = text[end:end + 2]
+        if not before.isdigit() and not (after[:1].isdigit() or (after[:1] == '.' and after[1:2].isdigit())):
+            return True
+        start = text.find(query, start + 1)
+    return False
+
+
+def substring_edit_distance(pattern, text, max_dist):
+    """
+    pattern与text中任意子串的最小编辑距离（Sellers算法），超过max_dist时返回None
+    """
+    m = len(pattern)
+    previous = list(range(m + 1))
+    best = previous[m]
+    for ch in text:
+        # 子串可以从text任意位置开始，所以第0行始终为0
+        current = [0] * (m + 1)
+        for i in range(1, m + 1):
+            cost = 0 if pattern[i - 1] == ch else 1
+            current[i] = min(previous[i] + 1, current[i - 1] + 1, previous[i - 1] + cost)
+        best = min(best, current[m])
+        if best == 0:
+            return 0
+        previous = current
+    return best if best <= max_dist else None
+
+
+class ValueMatcher:
+    """
+    字段值定位引擎
+
+    对字段值做归一化（全角半角、空白、金额、日期），先在倒排索引上精确查找，
+    找不到时再对索引筛选出的候选文本块做有界编辑距离的模糊匹配。
+    数组和对象会逐个定位其中的叶子值，每个字段可以返回多个带分数的位置。
+    """
+
+    def __init__(self, index):
+        """
+        参数:
+            index: TextBlockIndex
+        """
+        self.index = index
+
+    def match_value(self, value):
+        """
+        定位单个叶子值
+
+        返回:
+            (文本块, 分数)，找不到返回None；精确匹配分数为1，模糊匹配按编辑距离折算
+        """
+        variants = value_variants(value)
+        for query, is_number in variants:
+            for block_id in self.index.candidates(query):
+                block = self.index.blocks[block_id]
+                if (_contains_number(block[1], query) if is_number else query in block[1]):
+                    return block, 1.0
+
+        # 数字和日期只做精确匹配，模糊匹配只用于较长的文本
+        if not variants or variants[0][1] or len(variants) > 1:
+            return None
+        query = variants[0][0]
+        if len(query) < FUZZY_MIN_LENGTH:
+            return None
+        max_dist = min(FUZZY_MAX_DISTANCE, len(query) // FUZZY_CHARS_PER_EDIT)
+        if max_dist == 0:
+            return None
+        best = None
+        for block_id in self.index.fuzzy_candidates(query, max_dist):
+            block = self.index.blocks[block_id]
+            dist = substring_edit_distance(query, block[1], max_dist)
+            if dist is not None and (best is None or dist < best[1]):
+                best = (block, dist)
+                max_dist = dist
+        if best is None:
+            return None
+        return best[0], round(1 - best[1] / len(query), 4)
+
+    def match_field(self, field_name, field_value):
+        """
+        定位一个字段，数组/对象会展开为多个叶子值
+
+        返回:
+            [{"path", "page", "box", "score"}, ...]，按分数从高到低排列；
+            合并索引（TextBlockIndex.merge）的匹配还带有文本块所属的文件ID "file"
+        """
+        matches = []
+        for path, leaf in iter_leaves(field_value, field_name):
+            found = self.match_value(leaf)
+            if found is None:
+                continue
+            block, score = found
+            match = {"path": path, "page": block[0], "box": block[2], "score": score}
+            if len(block) > 3:
+                match["file"] = block[3]
+            matches.append(match)
+        matches.sort(key=lambda x: -x["score"])
+        return matches
+
+    def match_all(self, result):
+        """
+        定位抽取结果中的所有字段
+
+        返回:
+            {字段名: [匹配, ...]}，只包含找到的字段，按result中的字段顺序
+        """
+        located = {}
+        for field_name, field_value in result.items():
+            matches = self.match_field(field_name, field_value)
+            if matches:
+                located[field_name] = matches
+        return located
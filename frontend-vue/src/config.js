@@ -1,4 +1,7 @@
 const BACKEND_PORT = process.env.BACKEND_PORT || '30267';
+const EVENTS_PORT = process.env.EVENTS_PORT || '5051';
 const PROTOCOL = process.env.PROTOCOL || 'http';
 const K8S_HOST = process.env.K8S_HOST || '172.22.141.90';
-export const API_BASE_URL = window.location.hostname === 'localhost' ? `http://localhost:${BACKEND_PORT}` : `${PROTOCOL}://${K8S_HOST}:${BACKEND_PORT}`
\ No newline at end of file
+export const API_BASE_URL = window.location.hostname === 'localhost' ? `http://localhost:${BACKEND_PORT}` : `${PROTOCOL}://${K8S_HOST}:${BACKEND_PORT}`
+// 抽取进度推送服务（SSE）
+export const EVENTS_BASE_URL = window.location.hostname === 'localhost' ? `http://localhost:${EVENTS_PORT}` : `${PROTOCOL}://${K8S_HOST}:${EVENTS_PORT}`
@@ -1,27 +1,68 @@
 #!/bin/bash
 
-# 启动前端服务
-cd /app/frontend/dist
-# 使用更好的静态文件服务器
-python3 -c '
-import http.server
-import socketserver
-
-class Handler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if not "." in self.path:
-            self.path = "index.html"
-        return http.server.SimpleHTTPRequestHandler.do_GET(self)
-
-with socketserver.TCPServer(("", 8080), Handler) as httpd:
-    print("前端服务已启动在端口 8080")
-    httpd.serve_forever()
-' &
-
-# 等待前端服务启动
-sleep 2
-
-# 启动后端服务
 cd /app/backend
-echo "启动后端服务在端口 5050"
-exec python app.py
\ No newline at end of file
+
+# 预压缩的静态文件（构建镜像时已生成，这里只补充比原文件旧或缺少的压缩文件）
+python3 static_files.py compress /app/frontend/dist
+
+# 容器中运行三个服务，由这个脚本（容器的主进程）看管：
+# - 停止容器时收到的SIGTERM/SIGINT转发给所有服务，等待它们按各自的方式完成收尾后再退出
+#   （后端gunicorn等待进行中的请求和抽取任务，见config.py中的WEB_*配置）
+# - 某个服务意外退出时重新启动它
+declare -A PIDS
+STOPPING=0
+
+start_service() {
+    case "$1" in
+        frontend)
+            # 前端服务
+            gunicorn -c gunicorn.conf.py -b 0.0.0.0:8080 \
+                --workers "${FRONTEND_WORKERS:-1}" --threads "${FRONTEND_THREADS:-16}" static_files:app &
+            echo "前端服务已启动在端口 8080" ;;
+        events)
+            # 抽取进度推送服务（SSE），单线程asyncio，跟踪events目录中的事件日志
+            python3 sse_server.py &
+            echo "进度推送服务已启动在端口 5051" ;;
+        api)
+            # 后端服务
+            gunicorn -c gunicorn.conf.py app:app &
+            echo "后端服务已启动在端口 5050" ;;
+    esac
+    PIDS[$1]=$!
+}
+
+stop_services() {
+    STOPPING=1
+    echo "收到停止信号，等待各服务退出"
+    for pid in "${PIDS[@]}"; do
+        kill -TERM "$pid" 2>/dev/null
+    done
+}
+
+trap stop_services TERM INT
+
+start_service frontend
+start_service events
+start_service api
+
+while [ "$STOPPING" = 0 ]; do
+    EXITED=
+    # 等待任意一个服务退出；收到信号时wait提前返回，由循环条件结束看管
+    wait -n -p EXITED
+    status=$?
+    if [ "$STOPPING" = 1 ] || [ -z "$EXITED" ]; then
+        continue
+    fi
+    for name in "${!PIDS[@]}"; do
+        if [ "${PIDS[$name]}" = "$EXITED" ]; then
+            echo "服务 $name 意外退出（状态 $status），1秒后重新启动"
+            sleep 1
+            # 等待期间收到了停止信号时不再启动
+            [ "$STOPPING" = 1 ] || start_service "$name"
+        fi
+    done
+done
+
+# 等待所有服务完成收尾
+wait
+echo "所有服务已停止"